@@ -0,0 +1,305 @@
+import argparse, asyncio, gc, json, os, platform, random, statistics, sys, time
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("IP_USER_MAX_COUNT", str(10_000_000))
+os.environ["METADATA_ENGINE"] = "json"
+
+from fbox.database import db
+from fbox.codes import CodeAllocator
+from fbox.files.models import Box, File, IPUser
+from fbox.files.utils import generate_code
+from fbox.files.choices import StatusChoice
+from fbox.cards.models import Card
+from fbox.cards.choices import LevelChoice
+from benchmarks.load import get_rss, get_version
+
+
+CODE_LOW = 10_000_000
+
+
+def make_box(code: str, created: int) -> Box:
+    return Box(
+        code=code,
+        status=StatusChoice.complete,
+        level=LevelChoice.visitor,
+        created=created,
+        files={
+            "file.jpg": File(
+                status=StatusChoice.complete,
+                filename="file.jpg",
+                size=4096,
+                sha256="0" * 64,
+            )
+        },
+    )
+
+
+def measure_rss(func) -> int | None:
+    gc.collect()
+    before = get_rss()
+    func()
+    gc.collect()
+    after = get_rss()
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+class Suite:
+    def __init__(self, args) -> None:
+        self.args = args
+        self.now = int(time.time())
+        self.space = int(args.boxes / args.fill)
+        self.codes: list[str] = []
+        self.ips: list[str] = []
+        self.card_codes: list[str] = []
+        self.memory: dict[str, int | None] = {}
+        self.results: dict[str, dict] = {}
+        self.loop = asyncio.new_event_loop()
+
+    def populate_boxes(self) -> None:
+        offsets = random.sample(range(self.space), self.args.boxes)
+        self.codes = [str(CODE_LOW + i) for i in offsets]
+        for code in self.codes:
+            box = make_box(code, self.now - random.randrange(3600))
+            db.boxes[code] = box
+            db.schedule_box_expire(box)
+        db.rebuild_box_index()
+
+    def populate_cards(self) -> None:
+        self.card_codes = [str(100_000_000 + i) for i in range(self.args.cards)]
+        for code in self.card_codes:
+            db.track_card(
+                Card(code=code, level=LevelChoice.red, count=10, created=self.now)
+            )
+
+    def populate_ip_users(self) -> None:
+        self.ips = [
+            f"{i >> 24 & 255}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+            for i in range(167_772_160, 167_772_160 + self.args.ip_users)
+        ]
+        for ip in self.ips:
+            db.save_ip_user(IPUser(ip=ip, tats={"error": self.now + 3600.0}))
+
+    def populate(self) -> None:
+        self.memory["boxes"] = measure_rss(self.populate_boxes)
+        self.memory["cards"] = measure_rss(self.populate_cards)
+        self.memory["ip_users"] = measure_rss(self.populate_ip_users)
+
+    def record(self, name: str, timings: list[float], loops: int) -> None:
+        per_op = [t / loops for t in timings]
+        self.results[name] = {
+            "seconds": statistics.median(per_op),
+            "stdev": statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+            "loops": loops,
+        }
+        result = self.results[name]
+        print(
+            f"{name:<28} {format_time(result['seconds']):>12} "
+            f"+- {format_time(result['stdev']):>10}",
+            file=sys.stderr,
+        )
+
+    def bench(self, name: str, func, loops: int, setup=None) -> None:
+        timings = []
+        for _ in range(self.args.rounds):
+            if setup is not None:
+                setup()
+            gc.collect()
+            start = time.perf_counter()
+            func(loops)
+            timings.append(time.perf_counter() - start)
+        self.record(name, timings, loops)
+
+    def bench_lookups(self) -> None:
+        loops = self.args.loops
+        hits = random.choices(self.codes, k=loops)
+        misses = [str(CODE_LOW + self.space + i) for i in range(loops)]
+        cards = random.choices(self.card_codes, k=loops)
+        ips = random.choices(self.ips, k=loops)
+
+        def get_box(n: int) -> None:
+            for code in hits:
+                db.get_box(code)
+
+        def get_box_miss(n: int) -> None:
+            for code in misses:
+                db.get_box(code)
+
+        def check_box_by_code(n: int) -> None:
+            for code in hits:
+                db.check_box_by_code(code)
+
+        def get_card(n: int) -> None:
+            for code in cards:
+                db.get_card(code)
+
+        def get_ip_user(n: int) -> None:
+            for ip in ips:
+                db.get_ip_user(ip)
+
+        self.bench("get_box", get_box, loops)
+        self.bench("get_box_miss", get_box_miss, loops)
+        self.bench("check_box_by_code", check_box_by_code, loops)
+        self.bench("get_card", get_card, loops)
+        self.bench("get_ip_user", get_ip_user, loops)
+
+    def bench_scans(self) -> None:
+        def get_boxes(n: int) -> None:
+            for _ in range(n):
+                db.get_boxes(False)
+
+        def list_boxes(n: int) -> None:
+            for _ in range(n):
+                db.list_boxes(status=StatusChoice.complete, limit=100)
+
+        self.bench("get_boxes", get_boxes, 1)
+        self.bench("list_boxes", list_boxes, 100)
+
+    def bench_codes(self) -> None:
+        loops = self.args.loops // 10
+        allocator = CodeAllocator(
+            CODE_LOW, CODE_LOW + self.space - 1, "benchmark", 0
+        )
+
+        def generate_full(n: int) -> None:
+            for _ in range(n):
+                allocator.allocate(db.check_box_by_code)
+
+        def generate(n: int) -> None:
+            for _ in range(n):
+                generate_code()
+
+        self.bench(f"generate_code_fill_{self.args.fill:g}", generate_full, loops)
+        self.bench("generate_code", generate, loops)
+
+    def bench_cleaners(self) -> None:
+        count = max(int(self.args.boxes * self.args.expired), 1)
+        expired_codes = random.sample(self.codes, count)
+        expired_ips = random.sample(self.ips, max(int(len(self.ips) * 0.01), 1))
+
+        def expire_boxes() -> None:
+            for code in expired_codes:
+                box = db.boxes.get(code) or make_box(code, 0)
+                box.created = 0
+                db.boxes[code] = box
+                db.schedule_box_expire(box)
+                db.track_box(box)
+
+        def clean_boxes(n: int) -> None:
+            self.loop.run_until_complete(db.clean_expired_boxes())
+
+        def expire_ip_users() -> None:
+            for ip in expired_ips:
+                db.save_ip_user(IPUser(ip=ip, tats={"error": 1.0}))
+
+        def clean_ip_users(n: int) -> None:
+            self.loop.run_until_complete(db.clean_expire_ip_user())
+
+        db.leader = False
+        self.bench("clean_expired_boxes", clean_boxes, 1, expire_boxes)
+        self.bench("clean_expire_ip_user", clean_ip_users, 1, expire_ip_users)
+
+    def run(self) -> dict:
+        print(
+            f"{self.args.boxes} boxes, {self.args.cards} cards, "
+            f"{self.args.ip_users} ip users",
+            file=sys.stderr,
+        )
+        self.populate()
+        for name, size in self.memory.items():
+            print(f"{name:<28} {(size or 0) / 1024**2:>9.1f} MB", file=sys.stderr)
+
+        self.bench_lookups()
+        self.bench_scans()
+        self.bench_codes()
+        self.bench_cleaners()
+        return {
+            "version": get_version(),
+            "python": platform.python_version(),
+            "params": {
+                "boxes": self.args.boxes,
+                "cards": self.args.cards,
+                "ip_users": self.args.ip_users,
+                "fill": self.args.fill,
+                "expired": self.args.expired,
+            },
+            "memory": self.memory,
+            "results": self.results,
+        }
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def check(report: dict, path: str) -> bool:
+    with open(path) as f:
+        thresholds = json.load(f)
+
+    if thresholds.get("params") != report["params"]:
+        print("parameters differ from the baseline run", file=sys.stderr)
+
+    tolerance = thresholds.get("tolerance", 0.25)
+    ok = True
+    for name, baseline in thresholds["baseline"].items():
+        result = report["results"].get(name)
+        if result is None:
+            continue
+        ratio = result["seconds"] / baseline
+        if ratio > 1 + tolerance:
+            ok = False
+            print(f"{name} regressed: {ratio:.2f}x of baseline", file=sys.stderr)
+    return ok
+
+
+def update(report: dict, path: str) -> None:
+    thresholds = {"tolerance": 0.25}
+    if os.path.exists(path):
+        with open(path) as f:
+            thresholds = json.load(f)
+    thresholds["params"] = report["params"]
+    thresholds["baseline"] = {
+        name: result["seconds"] for name, result in report["results"].items()
+    }
+    with open(path, "w") as f:
+        json.dump(thresholds, f, indent=2)
+        f.write("\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.database")
+    parser.add_argument("--boxes", type=int, default=1_000_000)
+    parser.add_argument("--cards", type=int, default=100_000)
+    parser.add_argument("--ip-users", type=int, default=1_000_000)
+    parser.add_argument("--fill", type=float, default=0.9)
+    parser.add_argument("--expired", type=float, default=0.01)
+    parser.add_argument("--loops", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    parser.add_argument("--check")
+    parser.add_argument("--update")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = Suite(args).run()
+
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    elif not args.check and not args.update:
+        print(data)
+
+    if args.update:
+        update(report, args.update)
+    if args.check and not check(report, args.check):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
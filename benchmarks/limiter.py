@@ -0,0 +1,46 @@
+import asyncio, os, random, sys, time
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("IP_USER_MAX_COUNT", str(2_000_000))
+
+from fastapi import HTTPException
+
+from fbox.database import db
+from fbox.limiter import check_rate, update_rate
+
+
+async def populate(count: int) -> None:
+    for i in range(len(db.ip_users), count):
+        await update_rate(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", "error")
+
+
+async def measure(count: int, rounds: int) -> float:
+    keys = [
+        f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        for i in random.choices(range(count), k=rounds)
+    ]
+    start = time.perf_counter()
+    for ip in keys:
+        try:
+            await check_rate(ip, "error")
+        except HTTPException:
+            pass
+        await update_rate(ip, "error")
+    return (time.perf_counter() - start) / rounds
+
+
+async def run(rounds: int) -> None:
+    print(f"{'keys':>10} {'check+update':>14} {'heap':>10}")
+    for count in (1_000, 10_000, 100_000, 1_000_000):
+        await populate(count)
+        cost = await measure(count, rounds)
+        print(f"{count:>10} {cost * 1e6:>11.2f} us {len(db.ip_user_heap):>10}")
+
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    asyncio.run(run(rounds))
+
+
+if __name__ == "__main__":
+    main()
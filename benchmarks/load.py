@@ -0,0 +1,622 @@
+import argparse, asyncio, hashlib, json, os, platform, random, shutil, signal, socket
+import itertools, subprocess, sys, tempfile, time
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+import httpx
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+ADMIN_PASSWORD = "benchmark"
+
+S3_PART_SIZE = 10_000_000
+
+S3_ENGINES = ("s3remote", "s3async")
+
+UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    if value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def get_rss(pid: int | None = None) -> int | None:
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_tree_rss(pid: int) -> int | None:
+    rss = get_rss(pid)
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return rss
+    for child in children:
+        rss = (rss or 0) + (get_tree_rss(child) or 0)
+    return rss
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def random_ip() -> str:
+    return "10." + ".".join(str(random.randrange(256)) for _ in range(3))
+
+
+def summarize(latencies: list[float], errors: int, seconds: float, size: int) -> dict:
+    latencies = sorted(latencies)
+    n = len(latencies)
+
+    def percentile(p: float) -> float | None:
+        if not n:
+            return None
+        return round(latencies[min(int(n * p), n - 1)] * 1000, 3)
+
+    return {
+        "requests": n + errors,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rps": round(n / seconds, 1) if seconds else None,
+        "mbps": round(size / seconds / 1024**2, 1) if seconds else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / n * 1000, 3) if n else None,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": percentile(1.0),
+        },
+    }
+
+
+async def run_pool(count: int, concurrency: int, func) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    size = 0
+    jobs = iter(range(count))
+
+    async def worker() -> None:
+        nonlocal errors, size
+        for i in jobs:
+            start = time.perf_counter()
+            try:
+                n = await func(i)
+            except (httpx.HTTPError, KeyError, ValueError):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+                size += n
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, count))))
+    return summarize(latencies, errors, time.perf_counter() - start, size)
+
+
+class FboxClient:
+    POOL_SIZE = 4
+
+    def __init__(self, base_url: str, concurrency: int, transport=None) -> None:
+        limits = httpx.Limits(max_connections=self.POOL_SIZE)
+        timeout = httpx.Timeout(None)
+        count = max(concurrency // self.POOL_SIZE, 1) * 2
+        self.clients = [
+            httpx.AsyncClient(
+                base_url=base_url, transport=transport, limits=limits, timeout=timeout
+            )
+            for _ in range(count)
+        ]
+        self.s3_clients = [
+            httpx.AsyncClient(limits=limits, timeout=timeout) for _ in range(count)
+        ]
+        self.client_cycle = itertools.cycle(self.clients)
+        self.s3_cycle = itertools.cycle(self.s3_clients)
+        self.blocks: dict[int, bytes] = {}
+
+    async def __aenter__(self) -> "FboxClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        for client in self.clients + self.s3_clients:
+            await client.aclose()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return next(self.client_cycle)
+
+    @property
+    def s3(self) -> httpx.AsyncClient:
+        return next(self.s3_cycle)
+
+    def get_block(self, size: int) -> bytes:
+        if size not in self.blocks:
+            self.blocks[size] = os.urandom(size)
+        return self.blocks[size]
+
+    async def create_box(self, files: dict[str, int]) -> dict:
+        data = [{"name": name, "size": size} for name, size in files.items()]
+        r = await self.client.post(
+            "/api/files/", json=data, headers={"X-Real-Ip": random_ip()}
+        )
+        r.raise_for_status()
+        return r.json()
+
+    async def complete_box(self, code: str) -> None:
+        r = await self.client.patch(f"/api/files/{code}")
+        r.raise_for_status()
+
+    async def upload_file(
+        self, res: dict, filename: str, size: int, slice_size: int, parallel: int
+    ) -> None:
+        if res["storage"] in S3_ENGINES:
+            await self.upload_s3(res, filename, size, parallel)
+        else:
+            await self.upload_local(res, filename, size, slice_size, parallel)
+
+    async def upload_local(
+        self, res: dict, filename: str, size: int, slice_size: int, parallel: int
+    ) -> None:
+        url = res["uploads"][filename][0]
+        block = self.get_block(min(slice_size, size))
+        m = hashlib.sha256()
+        slices = []
+        for offset in range(0, size, slice_size):
+            content = block[: min(slice_size, size - offset)]
+            m.update(content)
+            slices.append((offset, content))
+
+        async def put(i: int) -> int:
+            offset, content = slices[i]
+            params = {"offset": offset, "sha256": hashlib.sha256(content).hexdigest()}
+            r = await self.client.put(url, params=params, content=content)
+            r.raise_for_status()
+            return len(content)
+
+        result = await run_pool(len(slices), parallel, put)
+        if result["errors"]:
+            raise ValueError("slice upload failed")
+
+        r = await self.client.patch(
+            f"/api/files/{res['code']}/{filename}",
+            json={"sha256": m.hexdigest(), "extra": {}},
+        )
+        r.raise_for_status()
+
+    async def upload_s3(self, res: dict, filename: str, size: int, parallel: int):
+        urls = res["uploads"][filename]
+        block = self.get_block(min(S3_PART_SIZE, size))
+        parts = [
+            block[: min(S3_PART_SIZE, size - offset)]
+            for offset in range(0, size, S3_PART_SIZE)
+        ]
+        etags = [""] * len(parts)
+
+        async def put(i: int) -> int:
+            r = await self.s3.put(urls[i], content=parts[i])
+            r.raise_for_status()
+            etags[i] = r.headers["ETag"].strip('"')
+            return len(parts[i])
+
+        result = await run_pool(len(parts), parallel, put)
+        if result["errors"]:
+            raise ValueError("part upload failed")
+
+        upload_id = parse_qs(urlparse(urls[0]).query)["uploadId"][0]
+        extra = {
+            "Parts": [{"ETag": e, "PartNumber": i + 1} for i, e in enumerate(etags)],
+            "UploadId": upload_id,
+        }
+        r = await self.client.patch(
+            f"/api/files/{res['code']}/{filename}",
+            json={"sha256": "", "extra": extra},
+        )
+        r.raise_for_status()
+
+    async def download(self, storage: str, code: str, filename: str) -> int:
+        headers = {"X-Real-Ip": random_ip()}
+        if storage in S3_ENGINES:
+            r = await self.client.get(f"/api/files/{code}", headers=headers)
+            r.raise_for_status()
+            return len(r.content)
+
+        size = 0
+        url = f"/api/files/{code}/{filename}"
+        async with self.client.stream("GET", url, headers=headers) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_raw():
+                size += len(chunk)
+        return size
+
+
+async def bench_create(fbox: FboxClient, args) -> dict:
+    async def create(i: int) -> int:
+        await fbox.create_box({f"burst-{i}.bin": 1024})
+        return 0
+
+    return await run_pool(args.burst, args.concurrency, create)
+
+
+async def bench_upload(fbox: FboxClient, args) -> dict:
+    results = {}
+    for label in args.upload_sizes.split(","):
+        size = parse_size(label)
+
+        async def upload(i: int) -> int:
+            filename = f"upload-{i}.bin"
+            res = await fbox.create_box({filename: size})
+            await fbox.upload_file(
+                res, filename, size, args.slice_size, args.slice_parallel
+            )
+            await fbox.complete_box(res["code"])
+            return size
+
+        results[label] = await run_pool(args.upload_files, args.upload_files, upload)
+    return results
+
+
+async def bench_download(fbox: FboxClient, args) -> dict:
+    size = parse_size(args.download_size)
+    hot = []
+    for i in range(args.hot_boxes):
+        filename = f"hot-{i}.bin"
+        res = await fbox.create_box({filename: size})
+        await fbox.upload_file(res, filename, size, args.slice_size, 4)
+        await fbox.complete_box(res["code"])
+        hot.append((res["storage"], res["code"], filename))
+
+    async def download(i: int) -> int:
+        return await fbox.download(*random.choice(hot))
+
+    result = await run_pool(args.downloads, args.concurrency, download)
+    result["target"] = "box" if hot and hot[0][0] in S3_ENGINES else "file"
+    return result
+
+
+async def run_workloads(fbox: FboxClient, args, get_server_rss) -> dict:
+    benches = {
+        "create": bench_create,
+        "upload": bench_upload,
+        "download": bench_download,
+    }
+    results = {}
+    for name in args.workloads.split(","):
+        if name not in benches:
+            continue
+        print(f"  {name}", file=sys.stderr)
+        results[name] = await benches[name](fbox, args)
+        results[name]["rss_bytes"] = get_server_rss()
+    return results
+
+
+def make_env(args, storage: str, data: Path, s3_endpoint: str | None) -> dict:
+    env = dict(os.environ)
+    env.update(
+        {
+            "SECRET_KEY": "benchmark",
+            "ADMIN_PASSWORD": ADMIN_PASSWORD,
+            "DATA_ROOT": str(data / "data"),
+            "LOGS_ROOT": str(data / "logs"),
+            "WWW_ROOT": str(data / "www"),
+            "STORAGE_ENGINE": storage,
+            "RATE_BOX_COUNT_LIMIT": str(10**9),
+            "RATE_BOX_ERROR_LIMIT": str(10**9),
+            "RATE_FILE_SIZE_LIMIT": str(2**62),
+            "RATE_DOWNLOAD_SIZE_LIMIT": str(2**62),
+            "FILE_MAX_SIZE": str(2**62),
+        }
+    )
+    if s3_endpoint:
+        suffix = os.urandom(4).hex()
+        env.update(
+            {
+                "S3_ENDPOINT_URL": s3_endpoint,
+                "S3_ACCESS_KEY": env.get("S3_ACCESS_KEY") or "benchmark",
+                "S3_SECRET_KEY": env.get("S3_SECRET_KEY") or "benchmark",
+                "S3_DATA_BUCKET": f"fbox-bench-data-{suffix}",
+                "S3_LOGS_BUCKET": f"fbox-bench-logs-{suffix}",
+            }
+        )
+    (data / "www").mkdir(parents=True, exist_ok=True)
+    return env
+
+
+async def run_in_process(args) -> None:
+    from fbox.main import app
+    from fbox.database import db
+
+    await app.router.startup()
+    while not db.loaded:
+        await asyncio.sleep(0.05)
+
+    transport = httpx.ASGITransport(app=app)
+    async with FboxClient("http://fbox", args.concurrency, transport) as fbox:
+        results = await run_workloads(fbox, args, get_rss)
+
+    await app.router.shutdown()
+    print(json.dumps(results))
+
+
+class Server:
+    def __init__(self, env: dict, workers: int, log: Path) -> None:
+        self.env = env
+        self.workers = workers
+        self.log = log
+        self.port = get_free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.process: subprocess.Popen | None = None
+
+    def start(self) -> None:
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "fbox.main:app",
+            "--port",
+            str(self.port),
+            "--workers",
+            str(self.workers),
+            "--no-access-log",
+        ]
+        with open(self.log, "ab") as log:
+            self.process = subprocess.Popen(
+                command, cwd=BASE_DIR, env=self.env, stdout=log, stderr=log
+            )
+
+    async def wait_ready(self, timeout: float = 600) -> tuple[float, float]:
+        start = time.perf_counter()
+        ready = None
+        headers = {"token": ADMIN_PASSWORD}
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            while time.perf_counter() - start < timeout:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"fbox exited, see {self.log}")
+                try:
+                    r = await client.get(
+                        "/api/admin/stats?history=false", headers=headers
+                    )
+                except httpx.TransportError:
+                    await asyncio.sleep(0.05)
+                    continue
+                if ready is None:
+                    ready = time.perf_counter() - start
+                if r.status_code == 200 and r.json().get("loaded"):
+                    return ready, time.perf_counter() - start
+                await asyncio.sleep(0.05)
+        raise RuntimeError(f"fbox did not load in {timeout}s, see {self.log}")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(60)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def get_rss(self) -> int | None:
+        if self.process is None:
+            return None
+        return get_tree_rss(self.process.pid)
+
+
+async def run_uvicorn(args, env: dict, data: Path) -> dict:
+    server = Server(env, args.workers, data / "server.log")
+    server.start()
+    try:
+        await server.wait_ready()
+        async with FboxClient(server.base_url, args.concurrency) as fbox:
+            return await run_workloads(fbox, args, server.get_rss)
+    finally:
+        server.stop()
+
+
+async def bench_restart(args, env: dict, data: Path) -> dict:
+    server = Server(env, args.workers, data / "restart.log")
+    server.start()
+    try:
+        await server.wait_ready()
+        async with FboxClient(server.base_url, args.concurrency) as fbox:
+            async def create(i: int) -> int:
+                await fbox.create_box({f"restart-{i}.bin": 1024})
+                return 0
+
+            seed = await run_pool(args.restart_boxes, args.concurrency, create)
+    finally:
+        server.stop()
+
+    server.start()
+    try:
+        ready, loaded = await server.wait_ready()
+        rss = server.get_rss()
+    finally:
+        server.stop()
+
+    return {
+        "boxes": args.restart_boxes,
+        "seed": seed,
+        "ready_seconds": round(ready, 3),
+        "loaded_seconds": round(loaded, 3),
+        "rss_bytes": rss,
+    }
+
+
+def start_s3(args):
+    if args.s3_endpoint:
+        return args.s3_endpoint, None
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        return None, None
+
+    port = get_free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return f"http://127.0.0.1:{port}", server
+
+
+async def run(args) -> dict:
+    s3_endpoint, s3_server = start_s3(args)
+    runs = []
+    try:
+        for storage in args.storage.split(","):
+            for mode in args.mode.split(","):
+                print(f"{storage} {mode}", file=sys.stderr)
+                entry = {
+                    "storage": storage,
+                    "mode": mode,
+                    "metadata": os.environ.get("METADATA_ENGINE", "json"),
+                }
+                runs.append(entry)
+                if storage in S3_ENGINES and not s3_endpoint:
+                    entry["skipped"] = "install moto or pass --s3-endpoint"
+                    continue
+
+                data = Path(tempfile.mkdtemp(prefix="fbox-bench-"))
+                env = make_env(args, storage, data, s3_endpoint)
+                try:
+                    if mode == "asgi":
+                        entry["workloads"] = run_child(args, env, storage, data)
+                    else:
+                        entry["workloads"] = await run_uvicorn(args, env, data)
+
+                    if "restart" in args.workloads.split(","):
+                        print("  restart", file=sys.stderr)
+                        restart = Path(tempfile.mkdtemp(prefix="fbox-bench-"))
+                        env = make_env(args, storage, restart, s3_endpoint)
+                        try:
+                            entry["workloads"]["restart"] = await bench_restart(
+                                args, env, restart
+                            )
+                        finally:
+                            if not args.keep:
+                                shutil.rmtree(restart, ignore_errors=True)
+                finally:
+                    if not args.keep:
+                        shutil.rmtree(data, ignore_errors=True)
+    finally:
+        if s3_server is not None:
+            s3_server.stop()
+
+    return {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": int(time.time()),
+        "runs": runs,
+    }
+
+
+def run_child(args, env: dict, storage: str, data: Path) -> dict:
+    command = [sys.executable, "-m", "benchmarks.load", *sys.argv[1:]]
+    command += ["--in-process", "--storage", storage]
+    with open(data / "asgi.log", "wb") as log:
+        r = subprocess.run(
+            command, cwd=BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=log
+        )
+    if r.returncode != 0:
+        raise RuntimeError(f"in-process run failed, see {data / 'asgi.log'}")
+    return json.loads(r.stdout)
+
+
+def print_summary(report: dict) -> None:
+    print(
+        f"{'run':<22} {'workload':<16} {'req':>7} {'err':>5} {'rps':>9} "
+        f"{'MB/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8}",
+        file=sys.stderr,
+    )
+    for entry in report["runs"]:
+        name = f"{entry['storage']}/{entry['mode']}"
+        if "skipped" in entry:
+            print(f"{name:<22} skipped: {entry['skipped']}", file=sys.stderr)
+            continue
+        for workload, result in entry["workloads"].items():
+            rows = [(workload, result)]
+            if workload == "upload":
+                rows = [
+                    (f"upload {label}", r)
+                    for label, r in result.items()
+                    if isinstance(r, dict)
+                ]
+            elif workload == "restart":
+                rows = [("restart seed", result["seed"])]
+            for label, r in rows:
+                rss = r.get("rss_bytes") or result.get("rss_bytes")
+                print(
+                    f"{name:<22} {label:<16} {r['requests']:>7} {r['errors']:>5} "
+                    f"{r['rps'] or 0:>9.1f} {r['mbps'] or 0:>8.1f} "
+                    f"{r['latency_ms']['p50'] or 0:>9.2f} "
+                    f"{r['latency_ms']['p99'] or 0:>9.2f} "
+                    f"{(rss or 0) / 1024**2:>8.1f}",
+                    file=sys.stderr,
+                )
+            if workload == "restart":
+                print(
+                    f"{name:<22} {'restart':<16} ready {result['ready_seconds']}s "
+                    f"loaded {result['loaded_seconds']}s",
+                    file=sys.stderr,
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("--storage", default="filesystem,s3remote,s3async")
+    parser.add_argument("--mode", default="asgi,uvicorn")
+    parser.add_argument("--workloads", default="create,upload,download,restart")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--burst", type=int, default=2000)
+    parser.add_argument("--upload-sizes", default="1M,64M,1G")
+    parser.add_argument("--upload-files", type=int, default=4)
+    parser.add_argument("--slice-size", type=parse_size, default="8M")
+    parser.add_argument("--slice-parallel", type=int, default=4)
+    parser.add_argument("--hot-boxes", type=int, default=8)
+    parser.add_argument("--download-size", default="4M")
+    parser.add_argument("--downloads", type=int, default=2000)
+    parser.add_argument("--restart-boxes", type=int, default=100_000)
+    parser.add_argument("--s3-endpoint")
+    parser.add_argument("--output")
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.in_process:
+        asyncio.run(run_in_process(args))
+        return
+
+    report = asyncio.run(run(args))
+    print_summary(report)
+    data = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os, sys, time, tracemalloc
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from fbox.files.models import Box, File
+from fbox.files.schemas import BoxSchema, FileSchema
+
+
+def make_box(i: int, files: int) -> Box:
+    return Box(
+        code=str(10_000_000 + i),
+        status=2,
+        level=1,
+        created=1_700_000_000 + i,
+        files={
+            f"file-{j}.jpg": File(
+                status=2, filename=f"file-{j}.jpg", size=4096, sha256="0" * 64
+            )
+            for j in range(files)
+        },
+    )
+
+
+def make_schema(i: int, files: int) -> BoxSchema:
+    return BoxSchema(
+        code=str(10_000_000 + i),
+        status=2,
+        level=1,
+        created=1_700_000_000 + i,
+        files={
+            f"file-{j}.jpg": FileSchema(
+                status=2, filename=f"file-{j}.jpg", size=4096, sha256="0" * 64
+            )
+            for j in range(files)
+        },
+    )
+
+
+def measure_memory(factory, count: int, files: int) -> float:
+    tracemalloc.start()
+    boxes = {str(i): factory(i, files) for i in range(count)}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del boxes
+    return size / count
+
+
+def measure_encoding(count: int, files: int) -> tuple[float, float, float, float]:
+    boxes = [make_box(i, files) for i in range(count)]
+    schemas = [make_schema(i, files) for i in range(count)]
+
+    start = time.perf_counter()
+    data = [box.to_json() for box in boxes]
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for raw in data:
+        Box.from_json(raw)
+    decode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = [schema.json() for schema in schemas]
+    schema_encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for raw in data:
+        BoxSchema.parse_raw(raw)
+    schema_decode = time.perf_counter() - start
+
+    return (
+        encode / count,
+        decode / count,
+        schema_encode / count,
+        schema_decode / count,
+    )
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    box_size = measure_memory(make_box, count, files)
+    schema_size = measure_memory(make_schema, min(count, 100_000), files)
+    print(f"{count} boxes with {files} files")
+    print(f"{'':>10} {'bytes/box':>10} {'encode':>10} {'decode':>10}")
+
+    encode, decode, schema_encode, schema_decode = measure_encoding(10_000, files)
+    print(
+        f"{'slots':>10} {box_size:>10.0f} "
+        f"{encode * 1e6:>7.2f} us {decode * 1e6:>7.2f} us"
+    )
+    print(
+        f"{'pydantic':>10} {schema_size:>10.0f} "
+        f"{schema_encode * 1e6:>7.2f} us {schema_decode * 1e6:>7.2f} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse, asyncio, json, os, platform, socket, subprocess, sys, time
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("S3_ACCESS_KEY", "benchmark")
+os.environ.setdefault("S3_SECRET_KEY", "benchmark")
+
+from fbox import settings
+from fbox.files.models import Box, File
+from fbox.files.choices import StatusChoice
+from fbox.cards.choices import LevelChoice
+from fbox.storage.s3_async import S3AsyncStorage
+from fbox.storage.s3_remote import S3RemoteStorage
+from benchmarks.load import get_free_port, get_version, run_pool
+
+
+ENGINES = {
+    "s3remote": S3RemoteStorage,
+    "s3async": S3AsyncStorage,
+}
+
+
+def make_box(code: str) -> Box:
+    return Box(
+        code=code,
+        status=StatusChoice.complete,
+        level=LevelChoice.visitor,
+        created=int(time.time()),
+        files={
+            "file.jpg": File(
+                status=StatusChoice.complete,
+                filename="file.jpg",
+                size=4096,
+                sha256="0" * 64,
+            )
+        },
+    )
+
+
+def start_moto() -> tuple[str, subprocess.Popen]:
+    port = get_free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            return f"http://127.0.0.1:{port}", process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("moto server did not start")
+
+
+async def bench_engine(name: str, args) -> dict:
+    suffix = os.urandom(4).hex()
+    settings.S3_DATA_BUCKET = f"fbox-bench-data-{suffix}"
+    settings.S3_LOGS_BUCKET = f"fbox-bench-logs-{suffix}"
+    storage = ENGINES[name]()
+    await storage.init()
+
+    codes = [str(10_000_000 + i) for i in range(args.calls)]
+    workloads = {
+        "save_box": lambda i: storage.save_box(make_box(codes[i])),
+        "get_box": lambda i: storage.get_box(codes[i]),
+        "save_dummy_file": lambda i: storage.save_dummy_file(
+            codes[i], "file.jpg", 64_000_000
+        ),
+        "get_url": lambda i: storage.get_url(codes[i], "file.jpg"),
+    }
+
+    results = {}
+    try:
+        for concurrency in args.concurrency:
+            for workload, func in workloads.items():
+
+                async def call(i: int) -> int:
+                    await func(i)
+                    return 0
+
+                cpu = time.process_time()
+                result = await run_pool(args.calls, concurrency, call)
+                result["cpu_ms"] = round(
+                    (time.process_time() - cpu) / args.calls * 1000, 3
+                )
+                results[f"{workload} c{concurrency}"] = result
+                print(
+                    f"{name:<10} {workload:<16} c{concurrency:<4} "
+                    f"{result['rps']:>9.1f} {result['latency_ms']['p50']:>9.2f} "
+                    f"{result['latency_ms']['p99']:>9.2f} {result['cpu_ms']:>8.3f}",
+                    file=sys.stderr,
+                )
+
+        start = time.perf_counter()
+        await storage.get_dir_modified("box")
+        results["get_dir_modified"] = {
+            "boxes": args.calls,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    finally:
+        await storage.close()
+    return results
+
+
+async def run(args) -> dict:
+    server = None
+    endpoint = args.s3_endpoint
+    if not endpoint:
+        endpoint, server = start_moto()
+    settings.S3_ENDPOINT_URL = endpoint
+
+    print(
+        f"{'engine':<10} {'workload':<16} {'conc':<5} {'rps':>9} {'p50 ms':>9} "
+        f"{'p99 ms':>9} {'cpu ms':>8}",
+        file=sys.stderr,
+    )
+    engines = {}
+    try:
+        for name in args.engines.split(","):
+            engines[name] = await bench_engine(name, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    return {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "endpoint": "moto" if server is not None else endpoint,
+        "calls": args.calls,
+        "engines": engines,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.storage")
+    parser.add_argument("--engines", default="s3remote,s3async")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(c) for c in value.split(",")],
+        default=[1, 16, 64],
+    )
+    parser.add_argument("--s3-endpoint")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import base64
+
+from fastapi import HTTPException
+
+
+def encode_cursor(after: tuple[int, str]) -> str:
+    created, code = after
+    return base64.urlsafe_b64encode(f"{created}:{code}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, str]:
+    try:
+        created, code = base64.urlsafe_b64decode(cursor).decode().split(":")
+        return int(created), code
+    except ValueError:
+        raise HTTPException(status_code=400)
@@ -1,27 +1,121 @@
+import asyncio
 from fastapi import (
     APIRouter,
     HTTPException,
     Depends,
+    Query,
+    Request,
+    Response,
 )
+from fastapi.responses import PlainTextResponse
 
+from fbox import settings
 from fbox.database import db
+from fbox.stats import stats
+from fbox.profiling import profiler
 from fbox.files.models import Box
+from fbox.files.schemas import BoxSchema
+from fbox.files.choices import StatusChoice
+from fbox.cards.choices import LevelChoice
 from fbox.admin.depends import token_required
+from fbox.admin.utils import encode_cursor, decode_cursor
 
 router = APIRouter(tags=["Admin"], dependencies=[Depends(token_required)])
 
 
-@router.get("/admin/boxes/", response_model=list[Box])
-async def get_boxes(expired: bool = False) -> list[Box]:
-    boxes = db.get_boxes(expired)
-    if len(boxes) > 100:
-        return boxes[:100]
+@router.get("/admin/boxes/", response_model=list[BoxSchema])
+async def get_boxes(
+    request: Request,
+    response: Response,
+    expired: bool = False,
+    status: StatusChoice | None = None,
+    level: LevelChoice | None = None,
+    created_from: int | None = None,
+    created_to: int | None = None,
+    size_min: int | None = None,
+    size_max: int | None = None,
+    order: str = Query("desc", regex="^(asc|desc)$"),
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+) -> list[Box]:
+    await db.sync()
+    boxes, after = db.list_boxes(
+        expired=expired,
+        status=status,
+        level=level,
+        created_from=created_from,
+        created_to=created_to,
+        size_min=size_min,
+        size_max=size_max,
+        reverse=order == "desc",
+        after=decode_cursor(cursor) if cursor else None,
+        limit=limit,
+    )
+    if after is not None:
+        url = request.url.include_query_params(cursor=encode_cursor(after))
+        response.headers["link"] = f'<{url}>; rel="next"'
     return boxes
 
 
-@router.get("/admin/boxes/{code}", response_model=Box)
+@router.get("/admin/boxes/{code}", response_model=BoxSchema)
 async def get_box(code: str) -> Box:
+    await db.sync()
     box = db.get_box(code)
     if box is None:
         raise HTTPException(status_code=404)
     return box
+
+
+@router.get("/admin/writes")
+async def get_writes() -> dict:
+    return db.get_write_stats()
+
+
+@router.get("/admin/stats")
+async def get_stats(history: bool = True) -> dict:
+    data = {
+        "gauges": {
+            **stats.gauges,
+            "ip_users": len(db.ip_users),
+            "loading_boxes": len(db.loading_boxes),
+            "loading_cards": len(db.loading_cards),
+        },
+        "totals": stats.totals,
+        "loaded": db.loaded,
+    }
+    if history:
+        data["history"] = stats.get_history()
+    return data
+
+
+@router.post("/admin/profile")
+async def start_profile(
+    request: Request, route: str, seconds: int = Query(30, ge=1, le=600)
+) -> dict:
+    if not settings.PROFILE_ENABLED:
+        raise HTTPException(status_code=400)
+    for item in request.app.routes:
+        if getattr(item, "name", None) == route:
+            await asyncio.to_thread(profiler.start, item, seconds)
+            return profiler.get_status()
+    raise HTTPException(status_code=404)
+
+
+@router.delete("/admin/profile")
+async def stop_profile() -> dict:
+    await asyncio.to_thread(profiler.stop)
+    return profiler.get_status()
+
+
+@router.get("/admin/profile")
+async def get_profile() -> dict:
+    return profiler.get_status()
+
+
+@router.get("/admin/profile/folded", response_class=PlainTextResponse)
+async def get_profile_folded():
+    filename = f"fbox-{profiler.name or 'profile'}.folded"
+    return PlainTextResponse(
+        profiler.dump(),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
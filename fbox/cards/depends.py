@@ -1,15 +1,17 @@
-from fastapi import Depends
+from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
 from fbox import settings
 from fbox.database import db
+from fbox.profiling import profiled
 from fbox.cards.models import Card
 from fbox.cards.choices import LevelChoice
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="card/token/", auto_error=False)
 
 
+@profiled("get_card")
 async def get_card(token: str | None = Depends(oauth2_scheme)):
     any_card = Card(code="", level=LevelChoice.visitor, count=0, created=0)
     if token is None:
@@ -22,7 +24,10 @@ async def get_card(token: str | None = Depends(oauth2_scheme)):
         if code is None:
             return any_card
 
+        await db.sync()
         card = db.get_card(code)
+        if card is None and db.check_card_loading(code):
+            raise HTTPException(status_code=503)
         if card is None:
             return any_card
 
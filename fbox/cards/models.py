@@ -1,10 +1,34 @@
-from pydantic import BaseModel
+import json
 
 from fbox.cards.choices import LevelChoice
 
 
-class Card(BaseModel):
-    code: str
-    level: LevelChoice
-    count: int
-    created: int
+class Card:
+    __slots__ = ("code", "level", "count", "created")
+
+    def __init__(self, code: str, level: int, count: int, created: int) -> None:
+        self.code = code
+        self.level = LevelChoice(level)
+        self.count = count
+        self.created = created
+
+    def to_dict(self) -> dict:
+        return {
+            "code": self.code,
+            "level": self.level,
+            "count": self.count,
+            "created": self.created,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Card":
+        return cls(
+            data["code"], data["level"], int(data["count"]), int(data["created"])
+        )
+
+    @classmethod
+    def from_json(cls, data: str | bytes) -> "Card":
+        return cls.from_dict(json.loads(data))
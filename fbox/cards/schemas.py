@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+from fbox.cards.choices import LevelChoice
+
+
+class CardSchema(BaseModel):
+    code: str
+    level: LevelChoice
+    count: int
+    created: int
+
+    class Config:
+        orm_mode = True
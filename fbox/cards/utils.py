@@ -1,5 +1,3 @@
-from random import randint
-
 from jose import jwt
 
 from fbox import settings
@@ -15,7 +13,4 @@ def create_jwt(data: dict):
 
 
 def generate_card_code() -> str:
-    code = str(randint(100_000_000, 999_999_999))
-    while db.check_card_by_code(code):
-        code = str(randint(100_000_000, 999_999_999))
-    return code
+    return db.card_codes.allocate(db.check_card_by_code)
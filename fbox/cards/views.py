@@ -8,6 +8,7 @@ from fbox import settings
 from fbox.log import logger
 from fbox.database import db
 from fbox.cards.models import Card
+from fbox.cards.schemas import CardSchema
 from fbox.cards.choices import LevelChoice
 from fbox.cards.utils import generate_card_code, create_jwt
 from fbox.cards.depends import get_card
@@ -18,9 +19,11 @@ router = APIRouter(tags=["Cards"])
 
 @router.post("/cards/", status_code=201, dependencies=[Depends(token_required)])
 async def post_cards():
-    code = generate_card_code()
-    card = Card(code=code, level=LevelChoice.red, count=settings.CARD_VALID_COUNT, created=0 if settings.CARD_EXPIRE <= 0 else settings.CARD_EXPIRE)
-    await db.save_card(card)
+    while True:
+        code = generate_card_code()
+        card = Card(code=code, level=LevelChoice.red, count=settings.CARD_VALID_COUNT, created=0 if settings.CARD_EXPIRE <= 0 else settings.CARD_EXPIRE)
+        if await db.create_card(card):
+            break
 
     logger.info(f"Generated card {card.code}")
 
@@ -29,7 +32,7 @@ async def post_cards():
     return {"token": token}
 
 
-@router.get("/cards/detail")
+@router.get("/cards/detail", response_model=CardSchema)
 async def card_detail(card: Card = Depends(get_card)):
     if card.count == 0:
         raise HTTPException(404)
@@ -41,11 +44,16 @@ async def card_renew(card: Card = Depends(get_card)):
     if card.count == 0:
         raise HTTPException(404)
 
-    code = generate_card_code()
-    new_card = Card(
-        level=card.level, count=card.count - 1, code=code, created=card.created
-    )
-    await db.save_card(new_card)
+    while True:
+        code = generate_card_code()
+        new_card = Card(
+            level=card.level, count=card.count - 1, code=code, created=card.created
+        )
+        if await db.create_card(new_card):
+            break
+
+    card.count = 0
+    await db.save_card(card)
     db.expire_card(card)
 
     logger.info(f"Renew card {card.code} with card{new_card.code}")
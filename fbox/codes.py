@@ -0,0 +1,65 @@
+import hashlib, secrets
+from typing import Callable
+
+from fbox import settings
+from fbox.utils import get_now
+
+
+class CodeAllocator:
+    ROUNDS = 4
+
+    def __init__(self, low: int, high: int, name: str, cooldown: int) -> None:
+        self.low = low
+        self.size = high - low + 1
+        self.half_bits = ((self.size - 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        key = hashlib.sha256(f"{settings.SECRET_KEY}:{name}".encode()).digest()
+        self.rounds = [
+            hashlib.blake2b(key=key, salt=bytes([i]) * 16, digest_size=8)
+            for i in range(self.ROUNDS)
+        ]
+        self.counter = secrets.randbelow(self.size)
+        self.cooldown = cooldown
+        self.retired: dict[str, int] = {}
+
+    def allocate(self, check_used: Callable[[str], bool]) -> str:
+        while True:
+            code = str(self.low + self.permute(self.counter))
+            self.counter = (self.counter + 1) % self.size
+            if code not in self.retired and not check_used(code):
+                return code
+
+    def retire(self, code: str) -> None:
+        if self.cooldown <= 0:
+            return
+
+        self.retired.pop(code, None)
+        self.retired[code] = int(get_now().timestamp())
+
+    def check_retired(self, code: str) -> bool:
+        return code in self.retired
+
+    def clean(self) -> None:
+        if self.cooldown <= 0:
+            return
+
+        deadline = int(get_now().timestamp()) - self.cooldown
+        while self.retired:
+            code = next(iter(self.retired))
+            if self.retired[code] > deadline:
+                break
+            del self.retired[code]
+
+    def permute(self, value: int) -> int:
+        while True:
+            left, right = value >> self.half_bits, value & self.mask
+            for m in self.rounds:
+                left, right = right, left ^ self.round(m, right)
+            value = (left << self.half_bits) | right
+            if value < self.size:
+                return value
+
+    def round(self, m, value: int) -> int:
+        m = m.copy()
+        m.update(value.to_bytes(8, "big"))
+        return int.from_bytes(m.digest(), "big") & self.mask
@@ -1,70 +1,233 @@
+import asyncio, math, os, secrets, time, heapq
+from collections import OrderedDict
+from itertools import islice
+
 from fbox import settings
 from fbox.log import logger
 from fbox.utils import get_now
+from fbox.codes import CodeAllocator
+from fbox.index import SortedIndex
+from fbox.stats import stats
 from fbox.files.models import Box, File, IPUser
 from fbox.files.choices import StatusChoice
 from fbox.storage import storage
+from fbox.metadata import metadata
 from fbox.cards.models import Card
+from fbox.cards.choices import LevelChoice
 
 
 class BoxDatabaseMixin:
     boxes: dict[str, Box] = {}
     expired_boxes: list[Box] = []
+    box_codes = CodeAllocator(1000_0000, 9999_9999, "box", settings.CODE_COOLDOWN)
+    loading_boxes: set[str] = set()
+    expire_heap: list[tuple[float, str]] = []
+    expire_deadlines: dict[str, float] = {}
+    box_index: dict[tuple[int, int], SortedIndex] = {}
+    box_keys: dict[str, tuple[int, int, int, int, int]] = {}
 
     async def init_boxes(self) -> None:
         logger.info(f"Initialize boxes")
-        box_codes = await storage.get_dir_filenames("box")
-
-        for box_code in box_codes:
-            box = await storage.get_box(box_code)
-            if box is None:
-                await storage.remove_box(box_code)
+        box_codes = await metadata.get_box_codes()
+        self.loading_boxes.update(box_codes)
+        logger.info(f"Initialize boxes finishied, {len(box_codes)} to load")
+
+    async def load_boxes(self) -> None:
+        start = time.monotonic()
+        box_codes = list(self.loading_boxes)
+        total = len(box_codes)
+
+        for i in range(0, total, settings.INIT_BATCH_SIZE):
+            batch = box_codes[i : i + settings.INIT_BATCH_SIZE]
+            boxes = await self.load_batch(metadata.get_boxes, batch)
+            if boxes is None:
                 continue
 
-            if self.check_box_expire(box):
-                logger.debug(f"Box {box.code} expire")
-                self.expire_box(box)
-                continue
+            for box in boxes:
+                if self.check_box_expire(box):
+                    logger.debug(f"Box {box.code} expire")
+                    self.expire_box(box)
+                    continue
+
+                logger.debug(f"Box {box.code} valid")
+                self.boxes[box.code] = box
+                self.schedule_box_expire(box)
 
-            logger.debug(f"Box {box.code} valid")
-            self.boxes[box.code] = box
+            self.loading_boxes.difference_update(batch)
+            logger.info(f"Load boxes {i + len(batch)}/{total}")
 
-        logger.info(f"Initialize boxes finishied")
+        self.rebuild_box_index()
+        logger.info(f"Load boxes finished in {time.monotonic() - start:.2f}s")
 
     async def clean_expired_boxes(self) -> None:
-        logger.info(f"Check {len(self.boxes)} box")
-        box_codes = list(self.boxes.keys())
-        for code in box_codes:
-            box = self.boxes[code]
-            if self.check_box_expire(box):
-                self.expire_box(box)
+        now = int(get_now().timestamp())
+        logger.info(f"Check {len(self.expire_heap)} box deadlines")
+        while self.expire_heap and self.expire_heap[0][0] <= now:
+            deadline, code = heapq.heappop(self.expire_heap)
+            box = self.boxes.get(code)
+            if box is None or self.expire_deadlines.get(code) != deadline:
+                continue
+            self.expire_box(box)
 
         logger.info(f"Box count {len(self.boxes)}, expired {len(self.expired_boxes)}")
-        for box in self.expired_boxes:
-            await storage.archive_box(box)
+        if not self.leader:
+            self.expired_boxes.clear()
+
+        async with self.write_lock:
+            for box in self.expired_boxes:
+                self.write_queue.pop(("box", box.code), None)
+                await storage.archive_box(box)
+                await metadata.remove_box(box.code)
 
         self.expired_boxes.clear()
+        self.box_codes.clean()
+        self.card_codes.clean()
         logger.info(f"Clean box finished")
 
     def check_box_expire(self, box: Box) -> bool:
-        now = int(get_now().timestamp())
-        passed = now - box.created
-
-        logger.debug(f"Box {box.code} with status {box.status} passed {passed} seconds")
+        deadline = self.expire_deadlines.get(box.code)
+        if deadline is None:
+            deadline = self.get_box_deadline(box)
+        return time.time() >= deadline
+
+    def get_box_deadline(self, box: Box) -> float:
+        if box.status == StatusChoice.waiting:
+            return box.created + settings.BOX_EXPIRE / 10
+        if box.status == StatusChoice.complete:
+            return box.created + settings.BOX_EXPIRE
+        return float("inf")
+
+    def schedule_box_expire(self, box: Box) -> None:
+        deadline = self.get_box_deadline(box)
+        if self.expire_deadlines.get(box.code) != deadline:
+            self.expire_deadlines[box.code] = deadline
+            heapq.heappush(self.expire_heap, (deadline, box.code))
+
+    def get_box_key(self, box: Box) -> tuple[int, int, int, int, int]:
+        size = waiting = 0
+        for f in box.files.values():
+            size += f.size
+            waiting += f.status == StatusChoice.waiting
+        return (box.status, box.level, box.created, size, waiting)
+
+    def track_box(self, box: Box) -> None:
+        key = self.get_box_key(box)
+        old = self.box_keys.get(box.code)
+        if old == key:
+            return
+        if old is not None:
+            self.untrack_box(box.code)
+            if old[0] == StatusChoice.waiting and key[0] == StatusChoice.complete:
+                stats.incr("boxes_completed")
+            if old[4] > key[4]:
+                stats.incr("files_completed", old[4] - key[4])
+
+        index = self.box_index.get(key[:2])
+        if index is None:
+            index = self.box_index[key[:2]] = SortedIndex()
+        index.add((box.created, box.code))
+        self.box_keys[box.code] = key
+        self.count_box(key, 1)
+
+    def untrack_box(self, code: str) -> None:
+        key = self.box_keys.pop(code, None)
+        if key is None:
+            return
+
+        self.count_box(key, -1)
+        self.box_index[key[:2]].remove((key[2], code))
+
+    def count_box(self, key: tuple[int, int, int, int, int], sign: int) -> None:
+        status, level, _, size, waiting = key
+        stats.add(f"boxes_{StatusChoice(status).name}", sign)
+        stats.add(f"boxes_{LevelChoice(level).name}", sign)
+        stats.add(f"bytes_{LevelChoice(level).name}", sign * size)
+        stats.add("files_waiting", sign * waiting)
+
+    def rebuild_box_index(self) -> None:
+        for code in list(self.box_keys):
+            self.untrack_box(code)
+
+        index: dict[tuple[int, int], list[tuple[int, str]]] = {}
+        for box in self.boxes.values():
+            key = self.get_box_key(box)
+            index.setdefault(key[:2], []).append((box.created, box.code))
+            self.box_keys[box.code] = key
+            self.count_box(key, 1)
+
+        self.box_index.clear()
+        for key, items in index.items():
+            self.box_index[key] = SortedIndex(items)
+
+    def list_boxes(
+        self,
+        expired: bool = False,
+        status: int | None = None,
+        level: int | None = None,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        size_min: int | None = None,
+        size_max: int | None = None,
+        reverse: bool = True,
+        after: tuple[int, str] | None = None,
+        limit: int = 100,
+    ) -> tuple[list[Box], tuple[int, str] | None]:
+        if expired:
+            boxes = {box.code: box for box in self.expired_boxes}
+            groups: dict[tuple[int, int], list[tuple[int, str]]] = {}
+            for box in boxes.values():
+                groups.setdefault((box.status, box.level), []).append(
+                    (box.created, box.code)
+                )
+            index = {key: SortedIndex(items) for key, items in groups.items()}
+        else:
+            boxes, index = self.boxes, self.box_index
+
+        def scan(items: SortedIndex):
+            lo, hi = items.begin(), items.end()
+            if created_from is not None:
+                lo = items.bisect_left((created_from, ""))
+            if created_to is not None:
+                hi = items.bisect_left((created_to + 1, ""))
+            if after is not None and reverse:
+                hi = min(hi, items.bisect_left(after))
+            elif after is not None:
+                lo = max(lo, items.bisect_right(after))
+            return items.iterate(lo, hi, reverse)
+
+        scans = [
+            scan(items)
+            for (box_status, box_level), items in index.items()
+            if (status is None or box_status == status)
+            and (level is None or box_level == level)
+        ]
+
+        results = []
+        for created, code in heapq.merge(*scans, reverse=reverse):
+            box = boxes.get(code)
+            if box is None or (not expired and self.check_box_expire(box)):
+                continue
+            if size_min is not None or size_max is not None:
+                size = sum(f.size for f in box.files.values())
+                if size_min is not None and size < size_min:
+                    continue
+                if size_max is not None and size > size_max:
+                    continue
+
+            results.append(box)
+            if len(results) == limit:
+                return results, (created, code)
+        return results, None
 
-        waiting_expire = box.status == StatusChoice.waiting and passed >= (
-            settings.BOX_EXPIRE / 10
-        )
-        complete_expire = (
-            box.status == StatusChoice.complete and passed >= settings.BOX_EXPIRE
+    def check_box_by_code(self, code: str) -> bool:
+        return (
+            code in self.boxes
+            or code in self.loading_boxes
+            or self.box_codes.check_retired(code)
         )
 
-        if waiting_expire or complete_expire:
-            return True
-        return False
-
-    def check_box_by_code(self, code: str) -> bool:
-        return code in self.boxes or code in self.expired_boxes
+    def check_box_loading(self, code: str) -> bool:
+        return code in self.loading_boxes
 
     def get_box(self, code: str) -> Box | None:
         box = self.boxes.get(code)
@@ -80,13 +243,51 @@ class BoxDatabaseMixin:
 
     async def save_box(self, box: Box) -> None:
         self.boxes[box.code] = box
-        await storage.save_box(box)
+        self.schedule_box_expire(box)
+        self.track_box(box)
+        if self.check_write_behind():
+            self.queue_write("box", box)
+        else:
+            await metadata.save_box(box)
+
+    async def create_box(self, box: Box) -> bool:
+        if self.check_write_behind():
+            self.queue_write("box", box)
+        elif not await metadata.create_box(box):
+            return False
+        self.boxes[box.code] = box
+        self.schedule_box_expire(box)
+        self.track_box(box)
+        stats.incr("boxes_created")
+        return True
+
+    async def save_file(self, box: Box, filename: str) -> None:
+        self.boxes[box.code] = box
+        self.track_box(box)
+        if self.check_write_behind():
+            self.queue_write("box", box)
+        else:
+            await metadata.save_file(box, filename)
+
+    def apply_box(self, code: str, box: Box | None) -> None:
+        self.loading_boxes.discard(code)
+        if box is not None:
+            self.boxes[code] = box
+            self.schedule_box_expire(box)
+            self.track_box(box)
+        elif self.boxes.pop(code, None) is not None:
+            self.box_codes.retire(code)
+            self.expire_deadlines.pop(code, None)
+            self.untrack_box(code)
 
     def expire_box(self, box: Box) -> None:
+        if box.code in self.boxes:
+            stats.incr("boxes_expired")
         self.expired_boxes.append(box)
-
-        if self.check_box_by_code(box.code):
-            del self.boxes[box.code]
+        self.box_codes.retire(box.code)
+        self.boxes.pop(box.code, None)
+        self.expire_deadlines.pop(box.code, None)
+        self.untrack_box(box.code)
 
     def get_file(self, code: str, filename: str) -> File | None:
         box = self.boxes.get(code)
@@ -113,28 +314,41 @@ class BoxDatabaseMixin:
 
 class CardDatabaseMixin:
     cards: dict[str, Card] = {}
-    expired_cards: list[str] = []
+    card_codes = CodeAllocator(
+        100_000_000, 999_999_999, "card", settings.CODE_COOLDOWN
+    )
+    loading_cards: set[str] = set()
 
     async def init_cards(self) -> None:
         logger.info(f"Initialize cards")
-
-        card_json_names = await storage.get_dir_filenames("card")
-
-        for card_json_name in card_json_names:
-            card_code = card_json_name.split(".")[0]
-            card = await storage.get_card(card_code)
-            if card is None:
+        card_codes = await metadata.get_card_codes()
+        self.loading_cards.update(card_codes)
+        logger.info(f"Initialize cards finishied, {len(card_codes)} to load")
+
+    async def load_cards(self) -> None:
+        start = time.monotonic()
+        card_codes = list(self.loading_cards)
+        total = len(card_codes)
+
+        for i in range(0, total, settings.INIT_BATCH_SIZE):
+            batch = card_codes[i : i + settings.INIT_BATCH_SIZE]
+            cards = await self.load_batch(metadata.get_cards, batch)
+            if cards is None:
                 continue
 
-            if self.check_card_expire(card):
-                logger.debug(f"Card {card.code} expire")
-                self.expire_card(card)
-                continue
+            for card in cards:
+                if self.check_card_expire(card):
+                    logger.debug(f"Card {card.code} expire")
+                    self.expire_card(card)
+                    continue
+
+                logger.debug(f"Card {card.code} valid")
+                self.track_card(card)
 
-            logger.debug(f"Card {card.code} valid")
-            self.cards[card.code] = card
+            self.loading_cards.difference_update(batch)
+            logger.info(f"Load cards {i + len(batch)}/{total}")
 
-        logger.info(f"Initialize cards finishied")
+        logger.info(f"Load cards finished in {time.monotonic() - start:.2f}s")
 
     def check_card_expire(self, card: Card) -> bool:
         now = int(get_now().timestamp())
@@ -152,7 +366,14 @@ class CardDatabaseMixin:
         return False
 
     def check_card_by_code(self, code: str) -> bool:
-        return code in self.cards or code in self.expired_cards
+        return (
+            code in self.cards
+            or code in self.loading_cards
+            or self.card_codes.check_retired(code)
+        )
+
+    def check_card_loading(self, code: str) -> bool:
+        return code in self.loading_cards
 
     def get_card(self, code: str) -> Card | None:
         card = self.cards.get(code)
@@ -161,72 +382,334 @@ class CardDatabaseMixin:
             return None
         return card
 
-    async def save_card(self, card: Card) -> None:
+    def track_card(self, card: Card) -> None:
+        if card.code not in self.cards:
+            stats.add(f"cards_{card.level.name}", 1)
         self.cards[card.code] = card
-        await storage.save_card(card)
 
-    def expire_card(self, card: Card) -> None:
-        self.expired_cards.append(card.code)
+    def untrack_card(self, code: str) -> Card | None:
+        card = self.cards.pop(code, None)
+        if card is not None:
+            stats.add(f"cards_{card.level.name}", -1)
+        return card
 
-        if self.check_card_by_code(card.code):
-            del self.cards[card.code]
+    async def save_card(self, card: Card) -> None:
+        self.track_card(card)
+        if self.check_write_behind():
+            self.queue_write("card", card)
+        else:
+            await metadata.save_card(card)
+
+    async def create_card(self, card: Card) -> bool:
+        if self.check_write_behind():
+            self.queue_write("card", card)
+        elif not await metadata.create_card(card):
+            return False
+        self.track_card(card)
+        stats.incr("cards_created")
+        return True
+
+    def apply_card(self, code: str, card: Card | None) -> None:
+        self.loading_cards.discard(code)
+        if card is not None:
+            self.track_card(card)
+        elif self.untrack_card(code) is not None:
+            self.card_codes.retire(code)
+
+    def expire_card(self, card: Card) -> None:
+        self.card_codes.retire(card.code)
+        self.untrack_card(card.code)
 
 
 class IPUserDatabaseMixin:
-    ip_users: dict[str, IPUser] = {}
-
-    def clean_expire_ip_user(self) -> None:
+    ip_users: OrderedDict[str, IPUser] = OrderedDict()
+    ip_user_heap: list[tuple[int, str]] = []
+    ip_user_evict_scan = 16
+    dirty_ip_users: set[str] = set()
+    removed_ip_users: set[str] = set()
+
+    async def init_ip_users(self) -> None:
+        for ip_user in await metadata.get_ip_users():
+            self.save_ip_user(ip_user)
+        self.dirty_ip_users.clear()
+        self.removed_ip_users.clear()
+
+    async def clean_expire_ip_user(self) -> None:
         now = int(get_now().timestamp())
         logger.info(f"IP users count {len(self.ip_users)}")
         logger.info(f"Clean ip users")
-        expired = []
+        expired = 0
 
-        for ip_user in self.ip_users.values():
-            error_expire = (now - ip_user.error_from) > 3600
-            box_expire = (now - ip_user.box_from) > 3600
-            file_expire = (now - ip_user.file_from) > 3600
-
-            logger.debug(
-                f"{ip_user.ip} error {error_expire}, box {box_expire}, file {file_expire}"
-            )
-
-            if error_expire and box_expire and file_expire:
-                expired.append(ip_user.ip)
-            else:
-                if error_expire:
-                    ip_user.error_count = 0
-                    ip_user.error_from = 0
-
-                if box_expire:
-                    ip_user.box_count = 0
-                    ip_user.box_from = 0
-
-                if file_expire:
-                    ip_user.file_count = 0
-                    ip_user.file_from = 0
-
-                self.save_ip_user(ip_user)
-
-        for ip in expired:
-            del self.ip_users[ip]
+        while self.ip_user_heap and self.ip_user_heap[0][0] < now:
+            expire, ip = heapq.heappop(self.ip_user_heap)
+            ip_user = self.ip_users.get(ip)
+            if ip_user is None or ip_user.expire != expire:
+                continue
 
-        logger.info(f"Clean {len(expired)} ip users finishied")
+            self.remove_ip_user(ip)
+            expired += 1
+
+        if not settings.SHARED_STATE:
+            await self.save_ip_users()
+        else:
+            self.dirty_ip_users.clear()
+            self.removed_ip_users.clear()
+            if self.leader:
+                await metadata.clean_ip_users(now)
+
+        logger.info(f"Clean {expired} ip users finishied")
+
+    async def save_ip_users(self) -> None:
+        ip_users = [self.ip_users[ip] for ip in self.dirty_ip_users]
+        removed = list(self.removed_ip_users)
+        self.dirty_ip_users.clear()
+        self.removed_ip_users.clear()
+        await metadata.save_ip_users(ip_users, removed)
+
+    async def load_ip_user(self, ip: str) -> IPUser | None:
+        if not settings.SHARED_STATE:
+            return self.get_ip_user(ip)
+
+        shared = await metadata.get_ip_user(ip)
+        ip_user = self.get_ip_user(ip)
+        if shared is None:
+            return ip_user
+        if ip_user is None:
+            ip_user = shared
+        else:
+            ip_user.tats.update(shared.tats)
+        self.save_ip_user(ip_user)
+        return ip_user
+
+    async def update_ip_user(
+        self, ip: str, name: str, now: float, interval: float
+    ) -> IPUser:
+        ip_user = self.get_ip_user(ip) or IPUser(ip=ip)
+        if settings.SHARED_STATE:
+            tat = await metadata.update_ip_user(ip, name, now, interval)
+        else:
+            tat = max(ip_user.tats.get(name, 0.0), now) + interval
+        ip_user.tats[name] = tat
+        self.save_ip_user(ip_user)
+        return ip_user
 
     def get_ip_user(self, ip: str) -> IPUser | None:
-        return self.ip_users.get(ip)
+        ip_user = self.ip_users.get(ip)
+        if ip_user is not None:
+            self.ip_users.move_to_end(ip)
+        return ip_user
 
     def save_ip_user(self, ip_user: IPUser) -> None:
         self.ip_users[ip_user.ip] = ip_user
+        self.ip_users.move_to_end(ip_user.ip)
+        self.dirty_ip_users.add(ip_user.ip)
+        self.removed_ip_users.discard(ip_user.ip)
+        if len(self.ip_users) > settings.IP_USER_MAX_COUNT:
+            self.evict_ip_user()
+
+        expire = math.ceil(max(ip_user.tats.values(), default=0))
+        if ip_user.expire != expire:
+            ip_user.expire = expire
+            heapq.heappush(self.ip_user_heap, (expire, ip_user.ip))
+
+        if len(self.ip_user_heap) > 2 * settings.IP_USER_MAX_COUNT:
+            self.ip_user_heap = [(u.expire, u.ip) for u in self.ip_users.values()]
+            heapq.heapify(self.ip_user_heap)
+
+    def evict_ip_user(self) -> None:
+        now = time.time()
+        oldest = next(iter(self.ip_users))
+        scan = min(self.ip_user_evict_scan, len(self.ip_users) - 1)
+        for ip, ip_user in islice(self.ip_users.items(), scan):
+            if ip_user.limited <= now:
+                break
+        else:
+            ip = oldest
+        self.remove_ip_user(ip)
+
+    def remove_ip_user(self, ip: str) -> None:
+        del self.ip_users[ip]
+        self.dirty_ip_users.discard(ip)
+        self.removed_ip_users.add(ip)
+
+
+class WriteQueueDatabaseMixin:
+    write_queue: dict[tuple[str, str], tuple[Box | Card, float]] = {}
+    write_task: asyncio.Task | None = None
+    write_lock = asyncio.Lock()
+    write_stats = {
+        "queued": 0,
+        "coalesced": 0,
+        "flushed": 0,
+        "failed": 0,
+        "flushes": 0,
+        "last_lag": 0.0,
+        "last_duration": 0.0,
+    }
+
+    def check_write_behind(self) -> bool:
+        return settings.WRITE_BEHIND_WINDOW > 0 and not settings.SHARED_STATE
+
+    def queue_write(self, kind: str, item: Box | Card) -> None:
+        key = (kind, item.code)
+        queued = self.write_queue.get(key)
+        if queued is None:
+            self.write_queue[key] = (item, time.monotonic())
+            self.write_stats["queued"] += 1
+        else:
+            self.write_queue[key] = (item, queued[1])
+            self.write_stats["coalesced"] += 1
+
+        if self.write_task is None:
+            self.write_task = asyncio.create_task(self.flush_writes_later())
+
+    async def flush_writes_later(self) -> None:
+        await asyncio.sleep(settings.WRITE_BEHIND_WINDOW)
+        self.write_task = None
+        await self.flush_writes()
+
+    async def flush_writes(self) -> None:
+        async with self.write_lock:
+            if not self.write_queue:
+                return
+
+            queue = self.write_queue.copy()
+            self.write_queue.clear()
+
+            start = time.monotonic()
+            boxes = [item for (kind, _), (item, _) in queue.items() if kind == "box"]
+            cards = [item for (kind, _), (item, _) in queue.items() if kind == "card"]
+            try:
+                await metadata.save_boxes(boxes)
+                await metadata.save_cards(cards)
+            except Exception as e:
+                logger.error(f"Flush {len(queue)} writes failed: {e!r}")
+                self.write_stats["failed"] += len(queue)
+                for key, value in queue.items():
+                    self.write_queue.setdefault(key, value)
+                if self.write_task is None:
+                    self.write_task = asyncio.create_task(self.flush_writes_later())
+                return
+
+            end = time.monotonic()
+            self.write_stats["flushed"] += len(queue)
+            self.write_stats["flushes"] += 1
+            self.write_stats["last_lag"] = end - min(t for _, t in queue.values())
+            self.write_stats["last_duration"] = end - start
+
+    def get_write_stats(self) -> dict:
+        now = time.monotonic()
+        oldest = min((t for _, t in self.write_queue.values()), default=now)
+        return {
+            **self.write_stats,
+            "depth": len(self.write_queue),
+            "lag": now - oldest,
+        }
+
+    async def close_writes(self) -> None:
+        if self.write_task is not None:
+            self.write_task.cancel()
+            self.write_task = None
+        await self.flush_writes()
+
+
+class Database(
+    BoxDatabaseMixin,
+    CardDatabaseMixin,
+    IPUserDatabaseMixin,
+    WriteQueueDatabaseMixin,
+):
+    LOAD_RETRIES = 3
+    LOAD_RETRY_DELAY = 1.0
+
+    snapshot_at: int = 0
+    loaded: bool = False
+    change_id: int = 0
+    leader: bool = not settings.SHARED_STATE
+    worker_id: str = f"{os.getpid()}-{secrets.token_hex(4)}"
 
-
-class Database(BoxDatabaseMixin, CardDatabaseMixin, IPUserDatabaseMixin):
     async def init(self) -> None:
+        if settings.SHARED_STATE and settings.METADATA_ENGINE != "sqlite":
+            raise RuntimeError("SHARED_STATE requires METADATA_ENGINE sqlite")
+
         await storage.init()
+        await metadata.init()
+        await self.sync()
 
         await self.init_boxes()
         await self.init_cards()
+        await self.init_ip_users()
+
+    async def load(self) -> None:
+        await self.load_cards()
+        await self.load_boxes()
+        if self.loading_cards or self.loading_boxes:
+            logger.warning(
+                f"{len(self.loading_boxes)} boxes and {len(self.loading_cards)} "
+                f"cards not loaded, retry in {settings.BOX_CLEAN_PERIOD}s"
+            )
+            return
+        self.loaded = True
+
+    async def load_batch(self, get_items, codes: list[str]) -> list | None:
+        for attempt in range(1, self.LOAD_RETRIES + 1):
+            try:
+                return await get_items(codes)
+            except Exception:
+                logger.exception(f"Load {len(codes)} items failed, attempt {attempt}")
+            if attempt < self.LOAD_RETRIES:
+                await asyncio.sleep(attempt * self.LOAD_RETRY_DELAY)
+
+        logger.error(
+            f"Keep {len(codes)} items loading after {self.LOAD_RETRIES} attempts"
+        )
+        return None
+
+    async def sync(self) -> None:
+        if not settings.SHARED_STATE:
+            return
+
+        change_id, boxes, cards = await metadata.get_changes(self.change_id)
+        if change_id <= self.change_id:
+            return
+
+        self.change_id = change_id
+        for code, box in boxes.items():
+            self.apply_box(code, box)
+        for code, card in cards.items():
+            self.apply_card(code, card)
+
+    async def elect(self) -> None:
+        if not settings.SHARED_STATE:
+            return
+
+        ttl = 3 * settings.BOX_CLEAN_PERIOD
+        leader = await metadata.acquire_lease("cleaner", self.worker_id, ttl)
+        if leader != self.leader:
+            logger.info(f"Worker {self.worker_id} leader {leader}")
+        self.leader = leader
+
+        if leader:
+            await metadata.clean_changes()
+
+    async def save_snapshot(self, force: bool = False) -> None:
+        if settings.SNAPSHOT_PERIOD <= 0 or not self.loaded:
+            return
+
+        now = int(get_now().timestamp())
+        if not force and now - self.snapshot_at < settings.SNAPSHOT_PERIOD:
+            return
+
+        self.snapshot_at = now
+        await self.flush_writes()
+        boxes = list(self.boxes.values())
+        cards = list(self.cards.values())
+        await metadata.save_snapshot(boxes, cards)
 
     async def close(self) -> None:
+        await self.close_writes()
+        await self.save_snapshot(force=True)
+        await metadata.close()
         await storage.close()
 
 
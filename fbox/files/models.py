@@ -1,33 +1,84 @@
-from pydantic import BaseModel
+import json, sys
 
 from fbox.files.choices import StatusChoice
 from fbox.cards.choices import LevelChoice
 
 
-class File(BaseModel):
-    status: StatusChoice
-    filename: str
-    size: int
+class File:
+    __slots__ = ("status", "filename", "size", "sha256")
 
+    def __init__(
+        self, status: int, filename: str, size: int, sha256: str = ""
+    ) -> None:
+        self.status = StatusChoice(status)
+        self.filename = sys.intern(filename)
+        self.size = size
+        self.sha256 = sha256
 
-class FileCreate(BaseModel):
-    name: str
-    size: int
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": self.sha256,
+        }
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "File":
+        return cls(
+            data["status"], data["filename"], int(data["size"]), data.get("sha256", "")
+        )
 
-class Box(BaseModel):
-    code: str
-    status: StatusChoice
-    level: LevelChoice
-    created: int
-    files: dict[str, File]
 
+class Box:
+    __slots__ = ("code", "status", "level", "created", "files")
 
-class IPUser(BaseModel):
-    ip: str
-    error_count: int = 0
-    error_from: int = 0
-    box_count: int = 0
-    box_from: int = 0
-    file_count: int = 0
-    file_from: int = 0
+    def __init__(
+        self,
+        code: str,
+        status: int,
+        level: int,
+        created: int,
+        files: dict[str, File],
+    ) -> None:
+        self.code = code
+        self.status = StatusChoice(status)
+        self.level = LevelChoice(level)
+        self.created = created
+        self.files = files
+
+    def to_dict(self) -> dict:
+        return {
+            "code": self.code,
+            "status": self.status,
+            "level": self.level,
+            "created": self.created,
+            "files": {name: file.to_dict() for name, file in self.files.items()},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Box":
+        files = {}
+        for value in data["files"].values():
+            file = File.from_dict(value)
+            files[file.filename] = file
+        return cls(
+            data["code"], data["status"], data["level"], int(data["created"]), files
+        )
+
+    @classmethod
+    def from_json(cls, data: str | bytes) -> "Box":
+        return cls.from_dict(json.loads(data))
+
+
+class IPUser:
+    __slots__ = ("ip", "tats", "expire", "limited")
+
+    def __init__(self, ip: str, tats: dict[str, float] | None = None) -> None:
+        self.ip = ip
+        self.tats = tats or {}
+        self.expire = 0
+        self.limited = 0.0
@@ -0,0 +1,279 @@
+import asyncio, os, secrets
+from mimetypes import guess_type
+from pathlib import PurePath
+from urllib.parse import quote
+
+from fastapi.responses import Response, FileResponse
+from starlette.datastructures import Headers
+from starlette.types import Scope, Receive, Send
+
+from fbox import settings
+from fbox.shaping import Shaper
+
+
+ACCEL_HEADERS = ("x-accel-redirect", "x-sendfile")
+
+if settings.DOWNLOAD_ACCEL and settings.DOWNLOAD_ACCEL not in ACCEL_HEADERS:
+    raise ValueError(f"Unknown DOWNLOAD_ACCEL {settings.DOWNLOAD_ACCEL!r}")
+
+
+def match_etag(value: str | None, etag: str) -> bool:
+    if value is None:
+        return False
+    if value.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in value.split(",")]
+    return etag in tags
+
+
+def parse_ranges(
+    value: str, size: int, max_ranges: int
+) -> list[tuple[int, int]] | None:
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    specs = spec.split(",")
+    if len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for s in specs:
+        first, sep, last = s.strip().partition("-")
+        if not sep or not (first or last):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), size
+            if last:
+                if int(last) < start:
+                    return None
+                end = min(int(last) + 1, size)
+
+        if start < end:
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged: list[tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class AccelFileResponse(Response):
+    max_ranges = 16
+
+    def __init__(
+        self,
+        filepath: PurePath,
+        filename: str,
+        size: int,
+        etag: str,
+        request_headers: Headers,
+    ) -> None:
+        media_type = guess_type(filename)[0] or "application/octet-stream"
+        super().__init__(media_type=media_type)
+        self.size = self.get_sent_size(size, etag, request_headers)
+
+        if settings.DOWNLOAD_ACCEL == "x-sendfile":
+            path = os.path.abspath(settings.DATA_ROOT / filepath)
+            self.headers["x-sendfile"] = path
+        elif settings.DOWNLOAD_ACCEL == "x-accel-redirect":
+            prefix = settings.DOWNLOAD_ACCEL_PREFIX.rstrip("/")
+            self.headers["x-accel-redirect"] = f"{prefix}/{quote(filepath.as_posix())}"
+            if settings.BANDWIDTH_DOWNLOAD_IP > 0:
+                self.headers["x-accel-limit-rate"] = str(settings.BANDWIDTH_DOWNLOAD_IP)
+
+        quoted = quote(filename)
+        if quoted != filename:
+            disposition = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            disposition = f'attachment; filename="{filename}"'
+        self.headers["content-disposition"] = disposition
+
+        if etag:
+            self.headers["etag"] = etag
+
+    def get_sent_size(self, size: int, etag: str, request_headers: Headers) -> int:
+        if etag and match_etag(request_headers.get("if-none-match"), etag):
+            return 0
+
+        if_range = request_headers.get("if-range")
+        range_header = request_headers.get("range")
+        if range_header is None or (if_range is not None and if_range != etag):
+            return size
+
+        ranges = parse_ranges(range_header, size, self.max_ranges)
+        if ranges is None:
+            return size
+        return sum(end - start for start, end in ranges)
+
+
+class RangeFileResponse(FileResponse):
+    chunk_size = 256 * 1024
+    max_ranges = 16
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        filename: str,
+        size: int,
+        etag: str,
+        request_headers: Headers,
+        method: str | None = None,
+    ) -> None:
+        super().__init__(path, filename=filename, method=method)
+        self.size = size
+        self.parts: list[tuple[bytes, int, int]] = [(b"", 0, size)]
+        self.epilogue = b""
+
+        self.headers["accept-ranges"] = "bytes"
+        if etag:
+            self.headers["etag"] = etag
+
+        if etag and match_etag(request_headers.get("if-none-match"), etag):
+            self.status_code = 304
+            self.parts = []
+            return
+
+        if_range = request_headers.get("if-range")
+        range_header = request_headers.get("range")
+        if range_header is None or (if_range is not None and if_range != etag):
+            self.headers["content-length"] = str(size)
+            return
+
+        ranges = parse_ranges(range_header, size, self.max_ranges)
+        if ranges is None:
+            self.headers["content-length"] = str(size)
+        elif not ranges:
+            self.status_code = 416
+            self.parts = []
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self.parts = [(b"", start, end)]
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            self.headers["content-length"] = str(end - start)
+        else:
+            self.set_multipart(ranges)
+
+    def set_multipart(self, ranges: list[tuple[int, int]]) -> None:
+        boundary = secrets.token_hex(16)
+        self.status_code = 206
+        self.parts = []
+
+        length = 0
+        for i, (start, end) in enumerate(ranges):
+            prefix = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{self.size}\r\n\r\n"
+            ).encode("latin-1")
+            if i > 0:
+                prefix = b"\r\n" + prefix
+            self.parts.append((prefix, start, end))
+            length += len(prefix) + end - start
+
+        self.epilogue = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        length += len(self.epilogue)
+
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+
+        if self.send_header_only or not self.parts:
+            await self.send_body(send, b"", False)
+        else:
+            zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+            file = await asyncio.to_thread(open, self.path, "rb")
+            try:
+                for prefix, start, end in self.parts:
+                    if prefix:
+                        await self.send_body(send, prefix, True)
+                    await self.send_range(send, file, start, end, zerocopy)
+                await self.send_body(send, self.epilogue, False)
+            finally:
+                await asyncio.to_thread(file.close)
+
+        if self.background is not None:
+            await self.background()
+
+    async def send_range(
+        self, send: Send, file, start: int, end: int, zerocopy: bool
+    ) -> None:
+        if zerocopy:
+            await send(
+                {
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": start,
+                    "count": end - start,
+                    "more_body": True,
+                }
+            )
+            return
+
+        fd = file.fileno()
+        while start < end:
+            n = min(self.chunk_size, end - start)
+            chunk = await asyncio.to_thread(os.pread, fd, n, start)
+            if not chunk:
+                break
+            await self.send_body(send, chunk, True)
+            start += len(chunk)
+
+    async def send_body(self, send: Send, body: bytes, more_body: bool) -> None:
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+class ShapedFileResponse(RangeFileResponse):
+    def __init__(
+        self, *args, shaper: Shaper, ip: str, weight: int = 1, **kwargs
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.shaper = shaper
+        self.ip = ip
+        self.weight = weight
+        self.chunk_size = shaper.CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.flow = self.shaper.open(self.ip, self.weight)
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.flow.close()
+
+    async def send_range(
+        self, send: Send, file, start: int, end: int, zerocopy: bool
+    ) -> None:
+        if not zerocopy:
+            await super().send_range(send, file, start, end, zerocopy)
+            return
+
+        while start < end:
+            n = min(self.chunk_size, end - start)
+            await self.flow.acquire(n)
+            await super().send_range(send, file, start, start + n, zerocopy)
+            start += n
+
+    async def send_body(self, send: Send, body: bytes, more_body: bool) -> None:
+        if body:
+            await self.flow.acquire(len(body))
+        await super().send_body(send, body, more_body)
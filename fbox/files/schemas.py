@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+
+from fbox.files.choices import StatusChoice
+from fbox.cards.choices import LevelChoice
+
+
+class FileCreate(BaseModel):
+    name: str
+    size: int
+
+
+class FileSchema(BaseModel):
+    status: StatusChoice
+    filename: str
+    size: int
+    sha256: str = ""
+
+    class Config:
+        orm_mode = True
+
+
+class BoxSchema(BaseModel):
+    code: str
+    status: StatusChoice
+    level: LevelChoice
+    created: int
+    files: dict[str, FileSchema]
+
+    class Config:
+        orm_mode = True
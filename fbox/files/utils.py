@@ -1,76 +1,60 @@
-from random import randint
+import ipaddress
 
 from fastapi import Request, HTTPException
 
 from fbox import settings
-from fbox.utils import get_now
 from fbox.database import db
-from fbox.files.models import IPUser, Box, File
-from fbox.files.choices import UploadFailChoice
+from fbox.limiter import check_rate, update_rate
+from fbox.profiling import profiled
+from fbox.files.models import Box, File
+from fbox.cards.choices import LevelChoice
 
 
-async def get_ip(request: Request) -> IPUser:
+def get_ip_key(ip: str) -> str:
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+
+    if address.version == 6:
+        if address.ipv4_mapped:
+            return str(address.ipv4_mapped)
+        return str(ipaddress.ip_network((address, 64), strict=False))
+    return ip
+
+
+@profiled("get_ip")
+async def get_ip(request: Request) -> str:
     x_real_ip = request.headers.get("X-Real-Ip")
     cf_connecting_ip = request.headers.get("CF-Connecting-IP")
     ip = cf_connecting_ip or x_real_ip or request.get("client")[0]
-
-    ip_user = db.get_ip_user(ip)
-    if ip_user is None:
-        ip_user = IPUser(ip=ip)
-        db.save_ip_user(ip_user)
-    return ip_user
+    return get_ip_key(ip)
 
 
 def generate_code() -> str:
-    code = str(randint(1000_0000, 9999_9999))
-    while db.check_box_by_code(code):
-        code = str(randint(1000_0000, 9999_9999))
-    return code
-
-
-def check_rate(ip_user: IPUser, name: str) -> None:
-    now = int(get_now().timestamp())
-    name_count = f"{name}_count"
-    name_from = f"{name}_from"
+    return db.box_codes.allocate(db.check_box_by_code)
 
-    count = getattr(ip_user, name_count)
-    start = getattr(ip_user, name_from)
-    if count > 0 and (now - start) < (3600):
-        raise HTTPException(status_code=400, detail=f"{UploadFailChoice.too_fast}")
-    else:
-        setattr(ip_user, name_count, 0)
-        setattr(ip_user, name_from, 0)
-        db.save_ip_user(ip_user)
 
+async def get_box_or_404(ip: str, code) -> Box:
+    await check_rate(ip, "error")
 
-def update_rate(ip_user: IPUser, name: str, limit: int, step=1):
-    name_count = f"{name}_count"
-    name_from = f"{name}_from"
-
-    count = getattr(ip_user, name_count) + step
-    setattr(ip_user, name_count, count)
-    if count > limit:
-        setattr(ip_user, name_from, int(get_now().timestamp()))
-    db.save_ip_user(ip_user)
-
-
-def get_box_or_404(ip_user: IPUser, code) -> Box:
-    check_rate(ip_user, "box")
-
+    await db.sync()
     box = db.get_box(code)
+    if box is None and db.check_box_loading(code):
+        raise HTTPException(status_code=503)
     if box is None:
-        update_rate(ip_user, "box", settings.RATE_BOX_ERROR_LIMIT)
+        await update_rate(ip, "error")
         raise HTTPException(status_code=404)
 
     return box
 
 
-def get_file_or_404(ip_user: IPUser, code: str, filename: str) -> File:
-    check_rate(ip_user, "file")
+async def get_file_or_404(ip: str, code: str, filename: str) -> File:
+    await check_rate(ip, "error")
 
     file = db.get_file(code, filename)
     if file is None:
-        update_rate(ip_user, "file", settings.RATE_FILE_SIZE_LIMIT, settings.FILE_MAX_SIZE)
+        await update_rate(ip, "error")
         raise HTTPException(status_code=404)
 
     return file
@@ -79,3 +63,9 @@ def get_file_or_404(ip_user: IPUser, code: str, filename: str) -> File:
 def get_box_files(code: str) -> list[File]:
     files = db.get_files(code)
     return files
+
+
+def get_shaping_weight(box: Box) -> int:
+    if box.level == LevelChoice.red:
+        return settings.BANDWIDTH_RED_WEIGHT
+    return 1
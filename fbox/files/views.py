@@ -4,20 +4,27 @@ from fastapi import (
     HTTPException,
     Body,
     Form,
+    Header,
     Depends,
     Request,
 )
-from fastapi.responses import FileResponse
 
 from fbox import settings
 from fbox.log import logger
 from fbox.utils import get_now
 from fbox.database import db
+from fbox.stats import stats
 from fbox.cards.choices import LevelChoice
 from fbox.cards.models import Card
 from fbox.cards.depends import get_card
-from fbox.files.models import Box, FileCreate, IPUser, File
+from fbox.files.models import Box, File
+from fbox.files.schemas import FileCreate
 from fbox.files.choices import UploadFailChoice, StatusChoice
+from fbox.files.responses import (
+    RangeFileResponse,
+    ShapedFileResponse,
+    AccelFileResponse,
+)
 from fbox.storage import storage, LocalStorage
 from fbox.files.utils import (
     generate_code,
@@ -25,9 +32,10 @@ from fbox.files.utils import (
     get_box_or_404,
     get_file_or_404,
     get_box_files,
-    check_rate,
-    update_rate,
+    get_shaping_weight,
 )
+from fbox.limiter import check_rate, update_rate
+from fbox.shaping import download_shaper, upload_shaper
 
 
 router = APIRouter(tags=["Files"])
@@ -43,7 +51,7 @@ async def get_capacity():
 async def post_box(
     files: list[FileCreate],
     card: Card = Depends(get_card),
-    ip_user: IPUser = Depends(get_ip),
+    ip: str = Depends(get_ip),
 ):
     now = int(get_now().timestamp())
 
@@ -52,11 +60,12 @@ async def post_box(
     if card.level == LevelChoice.red:
         card.count -= 1
         await db.save_card(card)
+        stats.incr("cards_used")
 
         files_count_max = settings.FILE_RED_MAX_COUNT
         files_size_max = settings.FILE_RED_MAX_SIZE
 
-    check_rate(ip_user, "box")
+    await check_rate(ip, "box")
 
     if not files:
         raise HTTPException(status_code=400, detail=f"{UploadFailChoice.empty_file}")
@@ -78,29 +87,30 @@ async def post_box(
             status_code=400, detail=f"{UploadFailChoice.too_much_error}"
         )
 
-    code = generate_code()
+    while True:
+        code = generate_code()
+        box_files = {
+            f.name: File(status=StatusChoice.waiting, filename=f.name, size=f.size)
+            for f in files
+        }
+        box = Box(
+            code=code,
+            status=StatusChoice.waiting,
+            created=now,
+            level=card.level,
+            files=box_files,
+        )
+        if await db.create_box(box):
+            break
 
-    box_files = {}
     uploads = {}
     for f in files:
-        file = File(status=StatusChoice.waiting, filename=f.name, size=f.size)
-        box_files[f.name] = file
-
         upload_urls = await storage.save_dummy_file(code, f.name, f.size)
         uploads[f.name] = upload_urls
 
-    box = Box(
-        code=code,
-        status=StatusChoice.waiting,
-        created=now,
-        level=card.level,
-        files=box_files,
-    )
-    await db.save_box(box)
-
     logger.info(f"Created box {box.code} with {len(files)} files")
 
-    update_rate(ip_user, "box", settings.RATE_BOX_COUNT_LIMIT)
+    await update_rate(ip, "box")
 
     return {
         "code": code,
@@ -113,9 +123,9 @@ async def post_box(
 @router.get("/files/{code}")
 async def get_box(
     code: str,
-    ip_user: IPUser = Depends(get_ip),
+    ip: str = Depends(get_ip),
 ):
-    box = get_box_or_404(ip_user, code)
+    box = await get_box_or_404(ip, code)
     if box.status != StatusChoice.complete:
         raise HTTPException(status_code=404)
 
@@ -137,10 +147,10 @@ async def get_box(
 async def patch_box(
     request: Request,
     code: str,
-    ip_user: IPUser = Depends(get_ip),
+    ip: str = Depends(get_ip),
 ):
     now = int(get_now().timestamp())
-    box = get_box_or_404(ip_user, code)
+    box = await get_box_or_404(ip, code)
     if box.status != StatusChoice.waiting:
         raise HTTPException(status_code=404)
 
@@ -164,22 +174,45 @@ async def patch_box(
 
 @router.get("/files/{code}/{filename}")
 async def get_file(
+    request: Request,
     code: str,
     filename: str,
-    ip_user: IPUser = Depends(get_ip),
+    ip: str = Depends(get_ip),
 ):
     if not isinstance(storage, LocalStorage):
         raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
 
-    box = get_box_or_404(ip_user, code)
+    box = await get_box_or_404(ip, code)
     if box.status != StatusChoice.complete:
         raise HTTPException(status_code=404)
 
-    file = get_file_or_404(ip_user, code, filename)
+    file = await get_file_or_404(ip, code, filename)
     if file and file.status == StatusChoice.complete:
         filepath = await storage.get_filepath(code, filename)
+        etag = f'"{file.sha256}"' if file.sha256 else ""
+        if settings.DOWNLOAD_ACCEL:
+            response = AccelFileResponse(
+                filepath, file.filename, file.size, etag, request.headers
+            )
+            await check_rate(ip, "download", response.size)
+            await update_rate(ip, "download", response.size)
+            stats.incr("downloaded_bytes", response.size)
+            return response
+
         path = settings.DATA_ROOT / filepath
-        return FileResponse(path, filename=file.filename)
+        args = (path, file.filename, file.size, etag, request.headers, request.method)
+        if download_shaper.enabled:
+            weight = get_shaping_weight(box)
+            response = ShapedFileResponse(
+                *args, shaper=download_shaper, ip=ip, weight=weight
+            )
+        else:
+            response = RangeFileResponse(*args)
+        size = int(response.headers.get("content-length", 0))
+        await check_rate(ip, "download", size)
+        await update_rate(ip, "download", size)
+        stats.incr("downloaded_bytes", size)
+        return response
 
     raise HTTPException(status_code=404)
 
@@ -191,16 +224,16 @@ async def post_file(
     file: UploadFile,
     offset: int = Form(),
     sha256: str = Form(),
-    ip_user: IPUser = Depends(get_ip),
+    ip: str = Depends(get_ip),
 ):
     if not isinstance(storage, LocalStorage):
         raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
 
-    box = get_box_or_404(ip_user, code)
+    box = await get_box_or_404(ip, code)
     if box.status != StatusChoice.waiting:
         raise HTTPException(status_code=404)
 
-    box_file = get_file_or_404(ip_user, code, filename)
+    box_file = await get_file_or_404(ip, code, filename)
     if box_file.status != StatusChoice.waiting:
         raise HTTPException(status_code=404)
 
@@ -208,15 +241,70 @@ async def post_file(
     if offset < 0 or (offset + file_size) > box_file.size:
         raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
 
-    check_rate(ip_user, "file")
+    await check_rate(ip, "upload", file_size)
 
-    file_sha256 = await storage.get_sha256(file.file)
-    if file_sha256 != sha256:
-        raise HTTPException(status_code=400, detail=f"UploadFailChoice.invalid_file")
+    stats.add("uploads_active", 1)
+    try:
+        file_saved = await storage.save_file_slice(
+            code, filename, file, offset, sha256
+        )
+    finally:
+        stats.add("uploads_active", -1)
+    if not file_saved:
+        raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
 
-    await storage.save_file_slice(code, filename, file, offset)
+    await update_rate(ip, "upload", file_size)
+    stats.incr("uploaded_bytes", file_size)
 
-    update_rate(ip_user, "file", settings.RATE_FILE_SIZE_LIMIT, file_size)
+    return {"code": code, "filename": filename, "detail": "20001"}
+
+
+@router.put("/files/{code}/{filename}")
+async def put_file(
+    request: Request,
+    code: str,
+    filename: str,
+    offset: int,
+    sha256: str,
+    content_length: int = Header(),
+    ip: str = Depends(get_ip),
+):
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
+
+    box = await get_box_or_404(ip, code)
+    if box.status != StatusChoice.waiting:
+        raise HTTPException(status_code=404)
+
+    box_file = await get_file_or_404(ip, code, filename)
+    if box_file.status != StatusChoice.waiting:
+        raise HTTPException(status_code=404)
+
+    if offset < 0 or content_length <= 0 or (offset + content_length) > box_file.size:
+        raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
+
+    await check_rate(ip, "upload", content_length)
+
+    stream = request.stream()
+    flow = None
+    if upload_shaper.enabled:
+        flow = upload_shaper.open(ip, get_shaping_weight(box))
+        stream = flow.shape(stream)
+
+    stats.add("uploads_active", 1)
+    try:
+        file_saved = await storage.save_file_stream(
+            code, filename, stream, offset, content_length, sha256
+        )
+    finally:
+        stats.add("uploads_active", -1)
+        if flow is not None:
+            flow.close()
+    if not file_saved:
+        raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
+
+    await update_rate(ip, "upload", content_length)
+    stats.incr("uploaded_bytes", content_length)
 
     return {"code": code, "filename": filename, "detail": "20001"}
 
@@ -227,13 +315,13 @@ async def patch_file(
     filename: str,
     extra: dict,
     sha256: str = Body(embed=True),
-    ip_user: IPUser = Depends(get_ip),
+    ip: str = Depends(get_ip),
 ):
-    box = get_box_or_404(ip_user, code)
+    box = await get_box_or_404(ip, code)
     if box.status != StatusChoice.waiting:
         raise HTTPException(status_code=404)
 
-    box_file = get_file_or_404(ip_user, code, filename)
+    box_file = await get_file_or_404(ip, code, filename)
     if box_file.status != StatusChoice.waiting:
         raise HTTPException(status_code=404)
 
@@ -243,8 +331,9 @@ async def patch_file(
         raise HTTPException(status_code=400, detail=f"{UploadFailChoice.invalid_file}")
 
     box_file.status = StatusChoice.complete
+    box_file.sha256 = sha256
     box.files[filename] = box_file
-    await db.save_box(box)
+    await db.save_file(box, filename)
 
     logger.info(f"Completed box {box.code} file {filename}")
 
@@ -0,0 +1,93 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Iterable, Iterator
+
+
+class SortedIndex:
+    CHUNK_SIZE = 1000
+
+    def __init__(self, items: Iterable = ()) -> None:
+        items = sorted(items)
+        size = self.CHUNK_SIZE
+        self.chunks = [items[i : i + size] for i in range(0, len(items), size)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.length = len(items)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator:
+        for chunk in self.chunks:
+            yield from chunk
+
+    def add(self, item) -> None:
+        self.length += 1
+        if not self.chunks:
+            self.chunks.append([item])
+            self.maxes.append(item)
+            return
+
+        i = min(bisect_left(self.maxes, item), len(self.chunks) - 1)
+        chunk = self.chunks[i]
+        insort(chunk, item)
+        self.maxes[i] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            self.chunks.insert(i + 1, chunk[self.CHUNK_SIZE :])
+            del chunk[self.CHUNK_SIZE :]
+            self.maxes.insert(i, chunk[-1])
+
+    def remove(self, item) -> bool:
+        i = bisect_left(self.maxes, item)
+        if i == len(self.chunks):
+            return False
+
+        chunk = self.chunks[i]
+        j = bisect_left(chunk, item)
+        if chunk[j] != item:
+            return False
+
+        self.length -= 1
+        del chunk[j]
+        if chunk:
+            self.maxes[i] = chunk[-1]
+        else:
+            del self.chunks[i]
+            del self.maxes[i]
+        return True
+
+    def begin(self) -> tuple[int, int]:
+        return (0, 0)
+
+    def end(self) -> tuple[int, int]:
+        return (len(self.chunks), 0)
+
+    def bisect_left(self, item) -> tuple[int, int]:
+        i = bisect_left(self.maxes, item)
+        if i == len(self.chunks):
+            return self.end()
+        return (i, bisect_left(self.chunks[i], item))
+
+    def bisect_right(self, item) -> tuple[int, int]:
+        i = bisect_right(self.maxes, item)
+        if i == len(self.chunks):
+            return self.end()
+        return (i, bisect_right(self.chunks[i], item))
+
+    def iterate(
+        self, start: tuple[int, int], stop: tuple[int, int], reverse: bool = False
+    ) -> Iterator:
+        (i, j), (k, l) = start, stop
+        if not reverse:
+            while (i, j) < (k, l):
+                chunk = self.chunks[i]
+                yield from chunk[j : l if i == k else len(chunk)]
+                i, j = i + 1, 0
+            return
+
+        while (k, l) > (i, j):
+            if l == 0:
+                k -= 1
+                l = len(self.chunks[k])
+                continue
+            begin = j if k == i else 0
+            yield from reversed(self.chunks[k][begin:l])
+            l = begin
@@ -0,0 +1,114 @@
+import math
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fbox import settings
+from fbox.utils import get_now
+from fbox.database import db
+from fbox.stats import stats
+from fbox.profiling import profiled
+from fbox.files.choices import UploadFailChoice
+
+
+class Policy:
+    __slots__ = ("name", "limit", "period", "interval", "tolerance")
+
+    def __init__(self, name: str, limit: int, period: int) -> None:
+        self.name = name
+        self.limit = max(limit, 1)
+        self.period = period
+        self.interval = period / self.limit
+        self.tolerance = period - self.interval
+
+    def get_headers(self, tat: float, now: float) -> dict[str, str]:
+        used = max(tat - now, 0.0)
+        remaining = max(self.limit - math.ceil(used / self.interval), 0)
+        return {
+            "RateLimit-Policy": f"{self.limit};w={self.period}",
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(remaining),
+            "RateLimit-Reset": str(math.ceil(used)),
+        }
+
+
+policies = {
+    "box": Policy("box", settings.RATE_BOX_COUNT_LIMIT, settings.RATE_PERIOD),
+    "error": Policy("error", settings.RATE_BOX_ERROR_LIMIT, settings.RATE_PERIOD),
+    "upload": Policy("upload", settings.RATE_FILE_SIZE_LIMIT, settings.RATE_PERIOD),
+    "download": Policy(
+        "download", settings.RATE_DOWNLOAD_SIZE_LIMIT, settings.RATE_PERIOD
+    ),
+}
+
+rate_headers: ContextVar[dict[str, str] | None] = ContextVar(
+    "rate_headers", default=None
+)
+
+
+def set_rate_headers(headers: dict[str, str]) -> None:
+    current = rate_headers.get()
+    if current is not None:
+        current.clear()
+        current.update(headers)
+
+
+@profiled("check_rate")
+async def check_rate(ip: str, name: str, cost: int = 1) -> None:
+    policy = policies[name]
+    ip_user = await db.load_ip_user(ip)
+    tat = ip_user.tats.get(name, 0.0) if ip_user is not None else 0.0
+    now = get_now().timestamp()
+
+    set_rate_headers(policy.get_headers(tat, now))
+    tat = max(tat, now) + (min(cost, policy.limit) - 1) * policy.interval
+    if tat - now > policy.tolerance:
+        stats.incr(f"rate_limited_{name}")
+        retry_after = math.ceil(tat - now - policy.tolerance)
+        raise HTTPException(
+            status_code=400,
+            detail=f"{UploadFailChoice.too_fast}",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+@profiled("update_rate")
+async def update_rate(ip: str, name: str, cost: int = 1) -> None:
+    policy = policies[name]
+    now = get_now().timestamp()
+
+    ip_user = await db.update_ip_user(ip, name, now, cost * policy.interval)
+    tat = ip_user.tats[name]
+    ip_user.limited = max(ip_user.limited, tat - policy.tolerance)
+
+    set_rate_headers(policy.get_headers(tat, now))
+
+
+class RateLimitHeadersMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers: dict[str, str] = {}
+        token = rate_headers.set(headers)
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start" and headers:
+                raw = list(message.get("headers", []))
+                names = {name.lower() for name, _ in raw}
+                for name, value in headers.items():
+                    key = name.lower().encode("latin-1")
+                    if key not in names:
+                        raw.append((key, value.encode("latin-1")))
+                message["headers"] = raw
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            rate_headers.reset(token)
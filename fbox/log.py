@@ -1,4 +1,4 @@
-import logging
+import logging, logging.config
 
 from pydantic import BaseModel
 
@@ -1,39 +1,77 @@
-import asyncio
+import asyncio, time
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
 from fbox import settings
 from fbox.log import logger
+from fbox import metrics, profiling
 from fbox.database import db
+from fbox.monitor import loop_monitor
+from fbox.storage import storage
+from fbox.metadata import metadata
+from fbox.limiter import RateLimitHeadersMiddleware
 from fbox.preload import router as preload_router
 from fbox.files.views import router as files_router
 from fbox.cards.views import router as cards_router
 from fbox.admin.views import router as admin_router
 
 
+load_task: asyncio.Task | None = None
+
+
 async def clean_data():
     while True:
-        logger.info("Running clean data")
+        if not db.loaded:
+            await load_data()
 
-        await db.clean_expired_boxes()
-        db.clean_expire_ip_user()
+        logger.info("Running clean data")
+        start = time.perf_counter()
 
-        logger.info("Clean data finished")
+        try:
+            await db.sync()
+            await db.elect()
+            await db.clean_expired_boxes()
+            await db.clean_expire_ip_user()
+            await db.save_snapshot()
+        except Exception:
+            logger.exception("Clean data failed")
+        else:
+            metrics.clean_duration.observe(time.perf_counter() - start)
+            logger.info("Clean data finished")
         await asyncio.sleep(settings.BOX_CLEAN_PERIOD)
 
 
+async def load_data():
+    try:
+        await db.load()
+    except Exception:
+        logger.exception("Load database failed")
+    else:
+        if db.loaded:
+            logger.info("Load database complete")
+
+
 async def startup():
     logger.info("Running startup task")
 
+    if settings.METRICS_ENABLED:
+        asyncio.get_running_loop().set_default_executor(metrics.executor)
+
+    loop_monitor.start()
+
     await db.init()
     logger.info("Init database complete")
 
-    asyncio.create_task(clean_data())
+    global load_task
+    load_task = asyncio.create_task(clean_data())
 
     logger.info("Startup task finished")
 
 
 async def shutdown():
+    if load_task is not None:
+        load_task.cancel()
+    loop_monitor.close()
     await db.close()
 
 
@@ -46,6 +84,19 @@ app = FastAPI(
     on_shutdown=[shutdown],
 )
 
+app.add_middleware(RateLimitHeadersMiddleware)
+
+if settings.METRICS_ENABLED:
+    metrics.instrument(storage, metrics.storage_duration, metrics.storage_errors)
+    metrics.instrument(metadata, metrics.metadata_duration, metrics.metadata_errors)
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(metrics.router, prefix="")
+
+if settings.PROFILE_ENABLED:
+    profiling.instrument(storage, "storage")
+    profiling.instrument(metadata, "metadata")
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 app.include_router(preload_router, prefix="")
 app.include_router(files_router, prefix="/api")
 app.include_router(cards_router, prefix="/api")
@@ -0,0 +1,62 @@
+import argparse, asyncio
+
+from fbox import settings
+from fbox.log import logger
+from fbox.storage import storage
+from fbox.storage.filesystem import FileSystemStorage
+from fbox.metadata.json_storage import JSONStorageMetadata
+from fbox.metadata.sqlite import SQLiteMetadata
+
+
+def migrate_layout(args: argparse.Namespace) -> None:
+    if not isinstance(storage, FileSystemStorage):
+        logger.error(f"Storage {settings.STORAGE_ENGINE} has no directory layout")
+        return
+
+    logger.info(f"Migrate to fan-out {settings.DATA_FANOUT}")
+    count = storage.migrate_layout()
+    logger.info(f"Migrate {count} entries finished")
+
+
+async def _import_json() -> None:
+    source = JSONStorageMetadata()
+    target = SQLiteMetadata()
+    await storage.init()
+    await target.init()
+
+    boxes = await source.get_boxes(await source.get_box_codes())
+    for box in boxes:
+        await target.save_box(box)
+    logger.info(f"Imported {len(boxes)} boxes")
+
+    cards = await source.get_cards(await source.get_card_codes())
+    for card in cards:
+        await target.save_card(card)
+    logger.info(f"Imported {len(cards)} cards")
+
+    await target.close()
+    await storage.close()
+
+
+def import_json(args: argparse.Namespace) -> None:
+    logger.info(f"Import json metadata to {settings.METADATA_SQLITE_PATH}")
+    asyncio.run(_import_json())
+
+
+parser = argparse.ArgumentParser(prog="python -m fbox.manage")
+commands = parser.add_subparsers(required=True)
+
+command = commands.add_parser(
+    "migrate-layout", help="move data from any DATA_FANOUT to the current one"
+)
+command.set_defaults(func=migrate_layout)
+
+command = commands.add_parser(
+    "import-json", help="copy box.json and card json files into the sqlite metadata"
+)
+command.set_defaults(func=import_json)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,11 @@
+from fbox import settings
+from fbox.metadata.abc import Metadata
+from fbox.metadata.json_storage import JSONStorageMetadata
+from fbox.metadata.sqlite import SQLiteMetadata
+
+metadata_engines = {
+    "json": JSONStorageMetadata,
+    "sqlite": SQLiteMetadata,
+}
+
+metadata = metadata_engines[settings.METADATA_ENGINE]()
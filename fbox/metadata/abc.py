@@ -0,0 +1,104 @@
+from abc import ABC, abstractmethod
+
+from fbox.files.models import Box, IPUser
+from fbox.cards.models import Card
+
+
+class Metadata(ABC):
+    @abstractmethod
+    async def init(self) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get_box_codes(self) -> list[str]:
+        pass
+
+    @abstractmethod
+    async def get_boxes(self, codes: list[str]) -> list[Box]:
+        pass
+
+    @abstractmethod
+    async def save_box(self, box: Box) -> None:
+        pass
+
+    @abstractmethod
+    async def save_boxes(self, boxes: list[Box]) -> None:
+        pass
+
+    @abstractmethod
+    async def create_box(self, box: Box) -> bool:
+        pass
+
+    @abstractmethod
+    async def save_file(self, box: Box, filename: str) -> None:
+        pass
+
+    @abstractmethod
+    async def remove_box(self, code: str) -> None:
+        pass
+
+    @abstractmethod
+    async def get_card_codes(self) -> list[str]:
+        pass
+
+    @abstractmethod
+    async def get_cards(self, codes: list[str]) -> list[Card]:
+        pass
+
+    @abstractmethod
+    async def save_card(self, card: Card) -> None:
+        pass
+
+    @abstractmethod
+    async def save_cards(self, cards: list[Card]) -> None:
+        pass
+
+    @abstractmethod
+    async def create_card(self, card: Card) -> bool:
+        pass
+
+    @abstractmethod
+    async def get_ip_users(self) -> list[IPUser]:
+        pass
+
+    @abstractmethod
+    async def save_ip_users(
+        self, ip_users: list[IPUser], removed: list[str]
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def get_ip_user(self, ip: str) -> IPUser | None:
+        pass
+
+    @abstractmethod
+    async def update_ip_user(
+        self, ip: str, name: str, now: float, interval: float
+    ) -> float:
+        pass
+
+    @abstractmethod
+    async def clean_ip_users(self, now: float) -> None:
+        pass
+
+    @abstractmethod
+    async def save_snapshot(self, boxes: list[Box], cards: list[Card]) -> None:
+        pass
+
+    @abstractmethod
+    async def get_changes(
+        self, since: int
+    ) -> tuple[int, dict[str, Box | None], dict[str, Card | None]]:
+        pass
+
+    @abstractmethod
+    async def clean_changes(self) -> None:
+        pass
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        pass
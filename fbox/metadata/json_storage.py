@@ -0,0 +1,190 @@
+import asyncio, gzip, json
+
+from fbox import settings
+from fbox.log import logger
+from fbox.utils import get_now
+from fbox.files.models import Box, IPUser
+from fbox.cards.models import Card
+from fbox.storage import storage
+from fbox.metadata.abc import Metadata
+
+
+class JSONStorageMetadata(Metadata):
+    SNAPSHOT_VERSION = 1
+    SNAPSHOT_SKEW = 60
+
+    def __init__(self) -> None:
+        self.snapshot_created = 0
+        self.snapshot_boxes: dict[str, Box] = {}
+        self.snapshot_cards: dict[str, Card] = {}
+
+    async def init(self) -> None:
+        data = await storage.get_snapshot()
+        if data is None:
+            return
+
+        try:
+            await asyncio.to_thread(self._load_snapshot, data)
+        except Exception as e:
+            logger.warning(f"Ignore invalid snapshot: {e!r}")
+            return
+
+        logger.info(
+            f"Loaded snapshot with {len(self.snapshot_boxes)} boxes "
+            f"and {len(self.snapshot_cards)} cards"
+        )
+
+    async def close(self) -> None:
+        pass
+
+    async def get_box_codes(self) -> list[str]:
+        modified = await storage.get_dir_modified("box")
+        self.snapshot_boxes = self._get_fresh(self.snapshot_boxes, modified)
+        return list(modified)
+
+    async def get_boxes(self, codes: list[str]) -> list[Box]:
+        semaphore = asyncio.Semaphore(settings.INIT_CONCURRENCY)
+
+        async def get_box(code: str) -> Box | None:
+            box = self.snapshot_boxes.pop(code, None)
+            if box is not None:
+                return box
+
+            async with semaphore:
+                box = await storage.get_box(code)
+                if box is None:
+                    await storage.remove_box(code)
+            return box
+
+        boxes = await asyncio.gather(*(get_box(code) for code in codes))
+        return [box for box in boxes if box is not None]
+
+    async def save_box(self, box: Box) -> None:
+        await storage.save_box(box)
+
+    async def save_boxes(self, boxes: list[Box]) -> None:
+        await self._gather(storage.save_box, boxes)
+
+    async def create_box(self, box: Box) -> bool:
+        await storage.save_box(box)
+        return True
+
+    async def save_file(self, box: Box, filename: str) -> None:
+        await storage.save_box(box)
+
+    async def remove_box(self, code: str) -> None:
+        pass
+
+    async def get_card_codes(self) -> list[str]:
+        card_json_modified = await storage.get_dir_modified("card")
+        modified = {
+            name.split(".")[0]: mtime for name, mtime in card_json_modified.items()
+        }
+        self.snapshot_cards = self._get_fresh(self.snapshot_cards, modified)
+        return list(modified)
+
+    async def get_cards(self, codes: list[str]) -> list[Card]:
+        semaphore = asyncio.Semaphore(settings.INIT_CONCURRENCY)
+
+        async def get_card(code: str) -> Card | None:
+            card = self.snapshot_cards.pop(code, None)
+            if card is not None:
+                return card
+
+            async with semaphore:
+                return await storage.get_card(code)
+
+        cards = await asyncio.gather(*(get_card(code) for code in codes))
+        return [card for card in cards if card is not None]
+
+    async def save_card(self, card: Card) -> None:
+        await storage.save_card(card)
+
+    async def save_cards(self, cards: list[Card]) -> None:
+        await self._gather(storage.save_card, cards)
+
+    async def create_card(self, card: Card) -> bool:
+        await storage.save_card(card)
+        return True
+
+    async def get_ip_users(self) -> list[IPUser]:
+        return []
+
+    async def save_ip_users(
+        self, ip_users: list[IPUser], removed: list[str]
+    ) -> None:
+        pass
+
+    async def get_ip_user(self, ip: str) -> IPUser | None:
+        return None
+
+    async def update_ip_user(
+        self, ip: str, name: str, now: float, interval: float
+    ) -> float:
+        return now + interval
+
+    async def clean_ip_users(self, now: float) -> None:
+        pass
+
+    async def save_snapshot(self, boxes: list[Box], cards: list[Card]) -> None:
+        created = int(get_now().timestamp())
+        data = await asyncio.to_thread(self._dump_snapshot, created, boxes, cards)
+        await storage.save_snapshot(data)
+        logger.info(f"Saved snapshot with {len(boxes)} boxes and {len(cards)} cards")
+
+    async def get_changes(
+        self, since: int
+    ) -> tuple[int, dict[str, Box | None], dict[str, Card | None]]:
+        return since, {}, {}
+
+    async def clean_changes(self) -> None:
+        pass
+
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        return True
+
+    async def _gather(self, func, items: list) -> None:
+        semaphore = asyncio.Semaphore(settings.INIT_CONCURRENCY)
+
+        async def run(item) -> None:
+            async with semaphore:
+                await func(item)
+
+        await asyncio.gather(*(run(item) for item in items))
+
+    def _get_fresh(self, items: dict, modified: dict[str, int]) -> dict:
+        deadline = self.snapshot_created - self.SNAPSHOT_SKEW
+        return {
+            code: item
+            for code, item in items.items()
+            if 0 < modified.get(code, 0) < deadline
+        }
+
+    def _load_snapshot(self, data: bytes) -> None:
+        if data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+
+        snapshot = json.loads(data)
+        if snapshot.get("version") != self.SNAPSHOT_VERSION:
+            raise ValueError(f"version {snapshot.get('version')}")
+
+        boxes = [Box.from_dict(box) for box in snapshot["boxes"]]
+        cards = [Card.from_dict(card) for card in snapshot["cards"]]
+
+        self.snapshot_created = snapshot["created"]
+        self.snapshot_boxes = {box.code: box for box in boxes}
+        self.snapshot_cards = {card.code: card for card in cards}
+
+    def _dump_snapshot(
+        self, created: int, boxes: list[Box], cards: list[Card]
+    ) -> bytes:
+        snapshot = {
+            "version": self.SNAPSHOT_VERSION,
+            "created": created,
+            "boxes": [box.to_dict() for box in boxes],
+            "cards": [card.to_dict() for card in cards],
+        }
+        data = json.dumps(snapshot, separators=(",", ":")).encode()
+        if settings.SNAPSHOT_COMPRESS:
+            data = gzip.compress(data)
+        return data
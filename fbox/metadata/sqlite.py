@@ -0,0 +1,361 @@
+import asyncio, json, sqlite3, time
+from concurrent.futures import ThreadPoolExecutor
+
+from fbox import settings
+from fbox.files.models import Box, File, IPUser
+from fbox.cards.models import Card
+from fbox.metadata.abc import Metadata
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boxes (
+    code TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    created INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxes_status_created ON boxes (status, created);
+CREATE TABLE IF NOT EXISTS files (
+    code TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (code, filename)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cards (
+    code TEXT PRIMARY KEY,
+    level INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    created INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    code TEXT NOT NULL,
+    created INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ip_users (
+    ip TEXT PRIMARY KEY,
+    tats TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteMetadata(Metadata):
+    BATCH_SIZE = 500
+    CHANGES_KEEP = 3600
+
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.connection: sqlite3.Connection | None = None
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def init(self) -> None:
+        await self.run(self._init)
+
+    async def close(self) -> None:
+        await self.run(self._close)
+        self.executor.shutdown()
+
+    async def get_box_codes(self) -> list[str]:
+        return await self.run(self._get_codes, "boxes")
+
+    async def get_boxes(self, codes: list[str]) -> list[Box]:
+        return await self.run(self._get_boxes, codes)
+
+    async def save_box(self, box: Box) -> None:
+        await self.run(self._save_box, box)
+
+    async def save_boxes(self, boxes: list[Box]) -> None:
+        await self.run(self._save_boxes, boxes)
+
+    async def create_box(self, box: Box) -> bool:
+        return await self.run(self._create_box, box)
+
+    async def save_file(self, box: Box, filename: str) -> None:
+        await self.run(self._save_file, box.code, box.files[filename])
+
+    async def remove_box(self, code: str) -> None:
+        await self.run(self._remove_box, code)
+
+    async def get_card_codes(self) -> list[str]:
+        return await self.run(self._get_codes, "cards")
+
+    async def get_cards(self, codes: list[str]) -> list[Card]:
+        return await self.run(self._get_cards, codes)
+
+    async def save_card(self, card: Card) -> None:
+        await self.run(self._save_card, card)
+
+    async def save_cards(self, cards: list[Card]) -> None:
+        await self.run(self._save_cards, cards)
+
+    async def create_card(self, card: Card) -> bool:
+        return await self.run(self._create_card, card)
+
+    async def get_ip_users(self) -> list[IPUser]:
+        return await self.run(self._get_ip_users)
+
+    async def save_ip_users(
+        self, ip_users: list[IPUser], removed: list[str]
+    ) -> None:
+        await self.run(self._save_ip_users, ip_users, removed)
+
+    async def get_ip_user(self, ip: str) -> IPUser | None:
+        return await self.run(self._get_ip_user, ip)
+
+    async def update_ip_user(
+        self, ip: str, name: str, now: float, interval: float
+    ) -> float:
+        return await self.run(self._update_ip_user, ip, name, now, interval)
+
+    async def clean_ip_users(self, now: float) -> None:
+        await self.run(self._clean_ip_users, now)
+
+    async def save_snapshot(self, boxes: list[Box], cards: list[Card]) -> None:
+        pass
+
+    async def get_changes(
+        self, since: int
+    ) -> tuple[int, dict[str, Box | None], dict[str, Card | None]]:
+        return await self.run(self._get_changes, since)
+
+    async def clean_changes(self) -> None:
+        await self.run(self._clean_changes)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        return await self.run(self._acquire_lease, name, owner, ttl)
+
+    def _init(self) -> None:
+        path = settings.METADATA_SQLITE_PATH
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        rows = self.connection.execute("PRAGMA table_info(ip_users)")
+        columns = [row[1] for row in rows]
+        if columns and "tats" not in columns:
+            self.connection.execute("DROP TABLE ip_users")
+
+        self.connection.executescript(SCHEMA)
+
+    def _close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _get_codes(self, table: str) -> list[str]:
+        rows = self.connection.execute(f"SELECT code FROM {table}")
+        return [code for code, in rows]
+
+    def _select_in(self, sql: str, codes: list[str]):
+        for i in range(0, len(codes), self.BATCH_SIZE):
+            batch = codes[i : i + self.BATCH_SIZE]
+            marks = ",".join("?" * len(batch))
+            yield from self.connection.execute(sql.format(marks), batch)
+
+    def _get_boxes(self, codes: list[str]) -> list[Box]:
+        files: dict[str, dict[str, File]] = {}
+        rows = self._select_in(
+            "SELECT code, filename, status, size, sha256 FROM files "
+            "WHERE code IN ({})",
+            codes,
+        )
+        for code, filename, status, size, sha256 in rows:
+            file = File(status=status, filename=filename, size=size, sha256=sha256)
+            files.setdefault(code, {})[filename] = file
+
+        boxes = []
+        rows = self._select_in(
+            "SELECT code, status, level, created FROM boxes WHERE code IN ({})", codes
+        )
+        for code, status, level, created in rows:
+            box = Box(
+                code=code,
+                status=status,
+                level=level,
+                created=created,
+                files=files.get(code, {}),
+            )
+            boxes.append(box)
+        return boxes
+
+    def _save_box(self, box: Box, replace: bool = True) -> None:
+        with self.connection:
+            self._insert_box(box, replace)
+
+    def _save_boxes(self, boxes: list[Box]) -> None:
+        with self.connection:
+            for box in boxes:
+                self._insert_box(box)
+
+    def _insert_box(self, box: Box, replace: bool = True) -> None:
+        self.connection.execute(
+            f"INSERT {'OR REPLACE ' if replace else ''}INTO boxes "
+            "(code, status, level, created) VALUES (?, ?, ?, ?)",
+            (box.code, box.status, box.level, box.created),
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO files (code, filename, status, size, sha256) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (box.code, f.filename, f.status, f.size, f.sha256)
+                for f in box.files.values()
+            ],
+        )
+        self._add_change("box", box.code)
+
+    def _create_box(self, box: Box) -> bool:
+        try:
+            self._save_box(box, replace=False)
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def _save_file(self, code: str, file: File) -> None:
+        with self.connection:
+            self.connection.execute(
+                "UPDATE files SET status = ?, sha256 = ? "
+                "WHERE code = ? AND filename = ?",
+                (file.status, file.sha256, code, file.filename),
+            )
+            self._add_change("box", code)
+
+    def _remove_box(self, code: str) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM files WHERE code = ?", (code,))
+            self.connection.execute("DELETE FROM boxes WHERE code = ?", (code,))
+            self._add_change("box", code)
+
+    def _get_cards(self, codes: list[str]) -> list[Card]:
+        rows = self._select_in(
+            "SELECT code, level, count, created FROM cards WHERE code IN ({})", codes
+        )
+        return [
+            Card(code=code, level=level, count=count, created=created)
+            for code, level, count, created in rows
+        ]
+
+    def _save_card(self, card: Card, replace: bool = True) -> None:
+        with self.connection:
+            self._insert_card(card, replace)
+
+    def _save_cards(self, cards: list[Card]) -> None:
+        with self.connection:
+            for card in cards:
+                self._insert_card(card)
+
+    def _insert_card(self, card: Card, replace: bool = True) -> None:
+        self.connection.execute(
+            f"INSERT {'OR REPLACE ' if replace else ''}INTO cards "
+            "(code, level, count, created) VALUES (?, ?, ?, ?)",
+            (card.code, card.level, card.count, card.created),
+        )
+        self._add_change("card", card.code)
+
+    def _create_card(self, card: Card) -> bool:
+        try:
+            self._save_card(card, replace=False)
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def _get_ip_users(self) -> list[IPUser]:
+        rows = self.connection.execute("SELECT ip, tats FROM ip_users")
+        return [IPUser(ip=ip, tats=json.loads(tats)) for ip, tats in rows]
+
+    def _save_ip_users(self, ip_users: list[IPUser], removed: list[str]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM ip_users WHERE ip = ?", [(ip,) for ip in removed]
+            )
+            self.connection.executemany(
+                "INSERT INTO ip_users (ip, tats) VALUES (?, ?) "
+                "ON CONFLICT (ip) DO UPDATE SET tats = excluded.tats",
+                [(u.ip, json.dumps(u.tats)) for u in ip_users],
+            )
+
+    def _get_ip_user(self, ip: str) -> IPUser | None:
+        row = self.connection.execute(
+            "SELECT tats FROM ip_users WHERE ip = ?", (ip,)
+        ).fetchone()
+        return IPUser(ip=ip, tats=json.loads(row[0])) if row else None
+
+    def _update_ip_user(self, ip: str, name: str, now: float, interval: float) -> float:
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            ip_user = self._get_ip_user(ip) or IPUser(ip=ip)
+            tat = max(ip_user.tats.get(name, 0.0), now) + interval
+            ip_user.tats[name] = tat
+            self.connection.execute(
+                "INSERT INTO ip_users (ip, tats) VALUES (?, ?) "
+                "ON CONFLICT (ip) DO UPDATE SET tats = excluded.tats",
+                (ip, json.dumps(ip_user.tats)),
+            )
+        return tat
+
+    def _clean_ip_users(self, now: float) -> None:
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM ip_users WHERE "
+                "(SELECT max(value) FROM json_each(ip_users.tats)) < ?",
+                (now,),
+            )
+
+    def _add_change(self, kind: str, code: str) -> None:
+        if settings.SHARED_STATE:
+            self.connection.execute(
+                "INSERT INTO changes (kind, code, created) VALUES (?, ?, ?)",
+                (kind, code, int(time.time())),
+            )
+
+    def _get_changes(
+        self, since: int
+    ) -> tuple[int, dict[str, Box | None], dict[str, Card | None]]:
+        rows = self.connection.execute(
+            "SELECT id, kind, code FROM changes WHERE id > ? ORDER BY id", (since,)
+        ).fetchall()
+        if not rows:
+            return since, {}, {}
+
+        box_codes = list({code for _, kind, code in rows if kind == "box"})
+        card_codes = list({code for _, kind, code in rows if kind == "card"})
+
+        boxes: dict[str, Box | None] = dict.fromkeys(box_codes)
+        boxes.update((box.code, box) for box in self._get_boxes(box_codes))
+        cards: dict[str, Card | None] = dict.fromkeys(card_codes)
+        cards.update((card.code, card) for card in self._get_cards(card_codes))
+        return rows[-1][0], boxes, cards
+
+    def _clean_changes(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM changes WHERE created < ?",
+                (int(time.time()) - self.CHANGES_KEEP,),
+            )
+
+    def _acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        now = int(time.time())
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET "
+                "owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, owner, now + ttl, now),
+            )
+            row = self.connection.execute(
+                "SELECT owner FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+        return row is not None and row[0] == owner
@@ -0,0 +1,367 @@
+import functools, inspect, threading, time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fbox.stats import stats
+from fbox.admin.depends import token_required
+from fbox.monitor import loop_monitor
+
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), func=None
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        self.func = func
+
+    def get_header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+    def render(self) -> list[str]:
+        lines = self.get_header()
+        values = self.func() if self.func is not None else self.values
+        for labels, value in list(values.items()):
+            lines.append(
+                f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels) -> None:
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def render(self) -> list[str]:
+        lines = self.get_header()
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                label = format_labels(names, labels + (format_value(le),))
+                lines.append(f"{self.name}_bucket{label} {cumulative}")
+            label = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label} {format_value(total)}")
+            lines.append(f"{self.name}_count{label} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.running = 0
+
+    def get_queued(self) -> int:
+        return self._work_queue.qsize()
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.perf_counter()
+
+        def run():
+            with self.lock:
+                self.running += 1
+                thread_wait.observe(time.perf_counter() - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+        return super().submit(run)
+
+
+registry = Registry()
+
+http_requests = registry.add(
+    Counter(
+        "fbox_http_requests_total",
+        "HTTP requests by route and status.",
+        ("method", "route", "status"),
+    )
+)
+
+http_duration = registry.add(
+    Histogram(
+        "fbox_http_request_duration_seconds",
+        "HTTP request duration including the response body.",
+        ("method", "route"),
+    )
+)
+
+http_received = registry.add(
+    Counter(
+        "fbox_http_received_bytes_total", "HTTP request body bytes.", ("route",)
+    )
+)
+
+http_sent = registry.add(
+    Counter("fbox_http_sent_bytes_total", "HTTP response body bytes.", ("route",))
+)
+
+storage_duration = registry.add(
+    Histogram(
+        "fbox_storage_duration_seconds", "Storage call duration.", ("method",)
+    )
+)
+
+storage_errors = registry.add(
+    Counter("fbox_storage_errors_total", "Storage calls that raised.", ("method",))
+)
+
+metadata_duration = registry.add(
+    Histogram(
+        "fbox_metadata_duration_seconds", "Metadata call duration.", ("method",)
+    )
+)
+
+metadata_errors = registry.add(
+    Counter("fbox_metadata_errors_total", "Metadata calls that raised.", ("method",))
+)
+
+thread_wait = registry.add(
+    Histogram(
+        "fbox_thread_wait_seconds",
+        "Time a to_thread call waited for a worker thread.",
+    )
+)
+
+clean_duration = registry.add(
+    Histogram(
+        "fbox_clean_duration_seconds",
+        "Cleaner sweep duration.",
+        buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+    )
+)
+
+executor = InstrumentedExecutor(thread_name_prefix="fbox")
+
+registry.add(
+    Gauge(
+        "fbox_thread_queued",
+        "to_thread calls waiting for a worker thread.",
+        func=lambda: {(): executor.get_queued()},
+    )
+)
+
+registry.add(
+    Gauge(
+        "fbox_thread_running",
+        "to_thread calls running on a worker thread.",
+        func=lambda: {(): executor.running},
+    )
+)
+
+registry.add(
+    Gauge(
+        "fbox_loop_lag_seconds",
+        "Event loop scheduling delay over the recent samples.",
+        ("quantile",),
+        func=lambda: {(q,): v for q, v in loop_monitor.get_quantiles().items()},
+    )
+)
+
+registry.add(
+    Counter(
+        "fbox_loop_stalls_total",
+        "Times the event loop was blocked longer than the threshold.",
+        func=lambda: {(): loop_monitor.stalls},
+    )
+)
+
+registry.add(
+    Gauge(
+        "fbox_state",
+        "Current values of the admin stats gauges.",
+        ("name",),
+        func=lambda: {(name,): value for name, value in stats.gauges.items()},
+    )
+)
+
+registry.add(
+    Counter(
+        "fbox_events_total",
+        "Totals of the admin stats events.",
+        ("name",),
+        func=lambda: {(name,): value for name, value in stats.totals.items()},
+    )
+)
+
+
+def timed(func, histogram: Histogram, errors: Counter, name: str):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+def instrument(obj, histogram: Histogram, errors: Counter) -> None:
+    for name, func in inspect.getmembers(obj, inspect.iscoroutinefunction):
+        if not name.startswith("_"):
+            setattr(obj, name, timed(func, histogram, errors, name))
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.routes: dict | None = None
+
+    def get_route(self, scope: Scope) -> str:
+        if self.routes is None:
+            self.routes = {}
+            for route in scope["app"].router.routes:
+                endpoint = getattr(route, "endpoint", None) or getattr(
+                    route, "app", None
+                )
+                self.routes.setdefault(endpoint, getattr(route, "path", "") or "/*")
+        return self.routes.get(scope.get("endpoint"), "other")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        received = 0
+        sent = 0
+
+        async def receive_with_count() -> Message:
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def send_with_count(message: Message) -> None:
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_count, send_with_count)
+        finally:
+            route = self.get_route(scope)
+            method = scope["method"]
+            http_requests.inc(method, route, status)
+            http_duration.observe(time.perf_counter() - start, method, route)
+            if received:
+                http_received.inc(route, value=received)
+            if sent:
+                http_sent.inc(route, value=sent)
+
+
+router = APIRouter(include_in_schema=False, dependencies=[Depends(token_required)])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,73 @@
+import asyncio, sys, threading, time, traceback
+from collections import deque
+
+from fbox import settings
+from fbox.log import logger
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, threshold: float, size: int = 1000) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: deque[float] = deque(maxlen=size)
+        self.due = 0.0
+        self.stalls = 0
+        self.thread_id: int | None = None
+        self.task: asyncio.Task | None = None
+        self.watchdog: threading.Thread | None = None
+        self.closed = False
+
+    def start(self) -> None:
+        if self.interval <= 0:
+            return
+        self.thread_id = threading.get_ident()
+        self.task = asyncio.create_task(self.run())
+        if self.threshold > 0:
+            self.watchdog = threading.Thread(
+                target=self.watch, name="fbox-watchdog", daemon=True
+            )
+            self.watchdog.start()
+
+    def close(self) -> None:
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self) -> None:
+        while True:
+            self.due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.monotonic() - self.due, 0.0))
+
+    def watch(self) -> None:
+        reported = 0.0
+        while not self.closed:
+            time.sleep(self.threshold / 2)
+            due = self.due
+            lag = time.monotonic() - due
+            if due == reported or lag <= self.threshold:
+                continue
+
+            reported = due
+            self.stalls += 1
+            frame = sys._current_frames().get(self.thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                "Event loop blocked for over %.1fms, current stack:\n%s",
+                lag * 1000,
+                stack,
+            )
+
+    def get_quantiles(self) -> dict[str, float]:
+        samples = sorted(self.samples)
+        if not samples:
+            return {}
+        n = len(samples)
+        return {
+            "0.5": samples[(n - 1) // 2],
+            "0.99": samples[min(int(n * 0.99), n - 1)],
+            "1": samples[-1],
+        }
+
+
+loop_monitor = LoopMonitor(settings.LOOP_LAG_INTERVAL, settings.LOOP_BLOCK_THRESHOLD)
@@ -0,0 +1,237 @@
+import asyncio, functools, inspect, os, sys, threading, time
+from contextvars import ContextVar
+
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fbox import settings
+from fbox.log import logger
+
+
+request_phases: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_phases", default=None
+)
+
+in_phase: ContextVar[bool] = ContextVar("in_phase", default=False)
+
+
+def add_phase(name: str, seconds: float) -> None:
+    phases = request_phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+def profiled(name: str):
+    def decorator(func):
+        if not settings.PROFILE_ENABLED:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if request_phases.get() is None or in_phase.get():
+                    return await func(*args, **kwargs)
+                token = in_phase.set(True)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    add_phase(name, time.perf_counter() - start)
+                    in_phase.reset(token)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if request_phases.get() is None or in_phase.get():
+                    return func(*args, **kwargs)
+                token = in_phase.set(True)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    add_phase(name, time.perf_counter() - start)
+                    in_phase.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument(obj, prefix: str) -> None:
+    for name, func in inspect.getmembers(obj, inspect.iscoroutinefunction):
+        if not name.startswith("_"):
+            setattr(obj, name, profiled(f"{prefix}.{name}")(func))
+
+
+def format_phases(phases: dict[str, float]) -> str:
+    return " ".join(f"{name}={value * 1000:.1f}ms" for name, value in phases.items())
+
+
+class Profiler:
+    IDLE_FRAMES = {
+        ("selectors.py", "select"),
+        ("thread.py", "_worker"),
+        ("runners.py", "run"),
+    }
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.route: BaseRoute | None = None
+        self.name = ""
+        self.tasks: set[asyncio.Task] = set()
+        self.started = 0.0
+        self.deadline = 0.0
+        self.samples = 0
+        self.stacks: dict[str, int] = {}
+        self.labels: dict = {}
+        self.thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, route: BaseRoute, seconds: int) -> None:
+        self.stop()
+        self.route = route
+        self.name = getattr(route, "name", "")
+        self.started = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.samples = 0
+        self.stacks = {}
+        self.thread = threading.Thread(
+            target=self.run, name="fbox-profiler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.route = None
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def matches(self, scope: Scope) -> bool:
+        route = self.route
+        return route is not None and route.matches(scope)[0] == Match.FULL
+
+    def get_label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            filename = os.path.basename(code.co_filename)
+            label = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+            self.labels[code] = label.replace(";", ":")
+        return self.labels[code]
+
+    def is_idle(self, frame) -> bool:
+        code = frame.f_code
+        return (os.path.basename(code.co_filename), code.co_name) in self.IDLE_FRAMES
+
+    def sample(self, own: int) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own or self.is_idle(frame):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.get_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.add_stack(reversed(stack))
+        for task in list(self.tasks):
+            stack = self.get_await_stack(task.get_coro())
+            if stack:
+                self.add_stack(["awaiting", *stack])
+        self.samples += 1
+
+    def add_stack(self, stack) -> None:
+        key = ";".join(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def get_await_stack(self, coro) -> list[str]:
+        stack = []
+        while coro is not None:
+            frame = (
+                getattr(coro, "cr_frame", None)
+                or getattr(coro, "gi_frame", None)
+                or getattr(coro, "ag_frame", None)
+            )
+            if frame is None:
+                return stack
+            stack.append(self.get_label(frame.f_code))
+            coro = (
+                getattr(coro, "cr_await", None)
+                or getattr(coro, "gi_yieldfrom", None)
+                or getattr(coro, "ag_await", None)
+            )
+        return []
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        while self.route is not None and time.monotonic() < self.deadline:
+            time.sleep(self.interval)
+            if self.tasks:
+                self.sample(own)
+        self.route = None
+
+    def get_status(self) -> dict:
+        return {
+            "route": self.name,
+            "running": self.running,
+            "started": int(self.started),
+            "samples": self.samples,
+            "interval": self.interval,
+        }
+
+    def dump(self) -> str:
+        stacks = sorted(list(self.stacks.items()))
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+profiler = Profiler(settings.PROFILE_INTERVAL)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        phases: dict[str, float] = {}
+        token = request_phases.set(phases)
+        start = time.perf_counter()
+        response_start = None
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal response_start
+            if message["type"] == "http.response.start":
+                response_start = time.perf_counter()
+            await send(message)
+
+        task = asyncio.current_task() if profiler.matches(scope) else None
+        if task is not None:
+            profiler.tasks.add(task)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if task is not None:
+                profiler.tasks.discard(task)
+            request_phases.reset(token)
+
+            end = time.perf_counter()
+            if response_start is not None:
+                phases["handler"] = response_start - start
+                phases["response"] = end - response_start
+
+            total = end - start
+            if total >= settings.PROFILE_SLOW_THRESHOLD:
+                logger.warning(
+                    "Slow request %s %s %.1fms: %s",
+                    scope["method"],
+                    scope["path"],
+                    total * 1000,
+                    format_phases(phases),
+                )
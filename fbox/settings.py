@@ -12,6 +12,8 @@ DEBUG = config("DEBUG", cast=bool, default=False)
 
 DATA_ROOT = config("DATA_ROOT", cast=Path, default=Path("data"))
 
+DATA_FANOUT = config("DATA_FANOUT", cast=int, default=0)
+
 LOGS_ROOT = config("LOGS_ROOT", cast=Path, default=Path("logs"))
 
 WWW_ROOT = config("WWW_ROOT", cast=Path, default=Path("www"))
@@ -32,10 +34,18 @@ RATE_BOX_ERROR_LIMIT = config("RATE_BOX_ERROR_LIMIT", cast=int, default=10)
 
 RATE_FILE_SIZE_LIMIT = config("RATE_FILE_SIZE_LIMIT", cast=int, default=10 * 1024 * 1024 * 1024)
 
+RATE_DOWNLOAD_SIZE_LIMIT = config("RATE_DOWNLOAD_SIZE_LIMIT", cast=int, default=100 * 1024 * 1024 * 1024)
+
+RATE_PERIOD = config("RATE_PERIOD", cast=int, default=3600)
+
+IP_USER_MAX_COUNT = config("IP_USER_MAX_COUNT", cast=int, default=100_000)
+
 BOX_EXPIRE = config("BOX_EXPIRE", cast=int, default=24 * 3600)
 
 BOX_CLEAN_PERIOD = config("BOX_CLEAN_PERIOD", cast=int, default=60)
 
+CODE_COOLDOWN = config("CODE_COOLDOWN", cast=int, default=BOX_EXPIRE)
+
 FILE_MAX_COUNT = config("FILE_MAX_COUNT", cast=int, default=5)
 
 FILE_MAX_SIZE = config("FILE_MAX_SIZE", cast=int, default=100 * 1000 * 1000)
@@ -48,6 +58,54 @@ CARD_EXPIRE = config("CARD_EXPIRE", cast=int, default=0)
 
 CARD_VALID_COUNT = config("CARD_VALID_COUNT", cast=int, default=10)
 
+DOWNLOAD_ACCEL = config("DOWNLOAD_ACCEL", cast=str, default="")
+
+DOWNLOAD_ACCEL_PREFIX = config("DOWNLOAD_ACCEL_PREFIX", cast=str, default="/internal/")
+
+BANDWIDTH_DOWNLOAD = config("BANDWIDTH_DOWNLOAD", cast=int, default=0)
+
+BANDWIDTH_DOWNLOAD_IP = config("BANDWIDTH_DOWNLOAD_IP", cast=int, default=0)
+
+BANDWIDTH_UPLOAD = config("BANDWIDTH_UPLOAD", cast=int, default=0)
+
+BANDWIDTH_UPLOAD_IP = config("BANDWIDTH_UPLOAD_IP", cast=int, default=0)
+
+BANDWIDTH_RED_WEIGHT = config("BANDWIDTH_RED_WEIGHT", cast=int, default=4)
+
+METADATA_ENGINE = config("METADATA_ENGINE", cast=str, default="json")
+
+METADATA_SQLITE_PATH = config(
+    "METADATA_SQLITE_PATH", cast=Path, default=DATA_ROOT / "fbox.sqlite3"
+)
+
+SHARED_STATE = config("SHARED_STATE", cast=bool, default=False)
+
+WRITE_BEHIND_WINDOW = config("WRITE_BEHIND_WINDOW", cast=float, default=1.0)
+
+STATS_BUCKET = config("STATS_BUCKET", cast=int, default=60)
+
+STATS_HISTORY = config("STATS_HISTORY", cast=int, default=60)
+
+METRICS_ENABLED = config("METRICS_ENABLED", cast=bool, default=False)
+
+PROFILE_ENABLED = config("PROFILE_ENABLED", cast=bool, default=False)
+
+PROFILE_SLOW_THRESHOLD = config("PROFILE_SLOW_THRESHOLD", cast=float, default=1.0)
+
+PROFILE_INTERVAL = config("PROFILE_INTERVAL", cast=float, default=0.005)
+
+LOOP_LAG_INTERVAL = config("LOOP_LAG_INTERVAL", cast=float, default=0.1)
+
+LOOP_BLOCK_THRESHOLD = config("LOOP_BLOCK_THRESHOLD", cast=float, default=0)
+
+INIT_CONCURRENCY = config("INIT_CONCURRENCY", cast=int, default=16)
+
+INIT_BATCH_SIZE = config("INIT_BATCH_SIZE", cast=int, default=1000)
+
+SNAPSHOT_PERIOD = config("SNAPSHOT_PERIOD", cast=int, default=600)
+
+SNAPSHOT_COMPRESS = config("SNAPSHOT_COMPRESS", cast=bool, default=True)
+
 STORAGE_ENGINE = config("STORAGE_ENGINE", cast=str, default="filesystem")
 
 S3_ENDPOINT_URL = config("S3_ENDPOINT_URL", cast=str, default="")
@@ -59,3 +117,13 @@ S3_SECRET_KEY = config("S3_SECRET_KEY", cast=str, default="")
 S3_DATA_BUCKET = config("S3_DATA_BUCKET", cast=str, default="data")
 
 S3_LOGS_BUCKET = config("S3_LOGS_BUCKET", cast=str, default="logs")
+
+S3_REGION = config("S3_REGION", cast=str, default="us-east-1")
+
+S3_MAX_CONNECTIONS = config("S3_MAX_CONNECTIONS", cast=int, default=64)
+
+S3_CONCURRENCY = config("S3_CONCURRENCY", cast=int, default=16)
+
+S3_MAX_RETRIES = config("S3_MAX_RETRIES", cast=int, default=3)
+
+S3_TIMEOUT = config("S3_TIMEOUT", cast=float, default=30.0)
@@ -0,0 +1,145 @@
+import asyncio, heapq, itertools
+from typing import AsyncIterator
+
+from fbox import settings
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: int, burst: int, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def get_full(self) -> float:
+        return self.updated + (self.burst - self.tokens) / self.rate
+
+    def reserve(self, n: int, now: float) -> float:
+        self.refill(now)
+        self.tokens -= n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class Flow:
+    __slots__ = ("shaper", "ip", "weight", "finish")
+
+    def __init__(self, shaper: "Shaper", ip: str, weight: int) -> None:
+        self.shaper = shaper
+        self.ip = ip
+        self.weight = weight
+        self.finish = 0.0
+
+    async def acquire(self, n: int) -> None:
+        await self.shaper.acquire(self, n)
+
+    async def shape(self, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in stream:
+            if chunk:
+                await self.acquire(len(chunk))
+            yield chunk
+
+    def close(self) -> None:
+        self.shaper.close(self)
+
+
+class Shaper:
+    CHUNK_SIZE = 64 * 1024
+    BURST_SECONDS = 0.25
+
+    def __init__(self, rate: int, ip_rate: int) -> None:
+        self.rate = rate
+        self.ip_rate = ip_rate
+        self.bucket: TokenBucket | None = None
+        self.ip_buckets: dict[str, tuple[TokenBucket, int]] = {}
+        self.ip_bucket_heap: list[tuple[float, str]] = []
+        self.queue: list[tuple[float, int, asyncio.Future, int]] = []
+        self.counter = itertools.count()
+        self.vtime = 0.0
+        self.pump_task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or self.ip_rate > 0
+
+    def get_burst(self, rate: int) -> int:
+        return max(int(rate * self.BURST_SECONDS), self.CHUNK_SIZE)
+
+    def open(self, ip: str, weight: int = 1) -> Flow:
+        if self.ip_rate > 0:
+            now = asyncio.get_running_loop().time()
+            self.clean(now)
+            bucket, count = self.ip_buckets.get(ip, (None, 0))
+            if bucket is None:
+                bucket = TokenBucket(self.ip_rate, self.get_burst(self.ip_rate), now)
+            self.ip_buckets[ip] = (bucket, count + 1)
+        return Flow(self, ip, weight)
+
+    def close(self, flow: Flow) -> None:
+        if flow.ip not in self.ip_buckets:
+            return
+        bucket, count = self.ip_buckets[flow.ip]
+        self.ip_buckets[flow.ip] = (bucket, count - 1)
+        if count == 1:
+            heapq.heappush(self.ip_bucket_heap, (bucket.get_full(), flow.ip))
+
+    def clean(self, now: float) -> None:
+        while self.ip_bucket_heap and self.ip_bucket_heap[0][0] <= now:
+            _, ip = heapq.heappop(self.ip_bucket_heap)
+            bucket, count = self.ip_buckets.get(ip, (None, 1))
+            if count == 0 and bucket.get_full() <= now:
+                del self.ip_buckets[ip]
+
+    async def acquire(self, flow: Flow, n: int) -> None:
+        loop = asyncio.get_running_loop()
+
+        if flow.ip in self.ip_buckets:
+            bucket, _ = self.ip_buckets[flow.ip]
+            delay = bucket.reserve(n, loop.time())
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if self.rate <= 0:
+            return
+
+        if self.bucket is None:
+            self.bucket = TokenBucket(self.rate, self.get_burst(self.rate), loop.time())
+
+        flow.finish = max(self.vtime, flow.finish) + n / flow.weight
+        future = loop.create_future()
+        heapq.heappush(self.queue, (flow.finish, next(self.counter), future, n))
+        if self.pump_task is None:
+            self.pump_task = asyncio.create_task(self.pump())
+        await future
+
+    async def pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while self.queue:
+                wait = self.bucket.get_wait(loop.time())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                finish, _, future, n = heapq.heappop(self.queue)
+                if future.done():
+                    continue
+                self.vtime = finish
+                self.bucket.reserve(n, loop.time())
+                future.set_result(None)
+        finally:
+            self.pump_task = None
+
+
+download_shaper = Shaper(settings.BANDWIDTH_DOWNLOAD, settings.BANDWIDTH_DOWNLOAD_IP)
+
+upload_shaper = Shaper(settings.BANDWIDTH_UPLOAD, settings.BANDWIDTH_UPLOAD_IP)
@@ -0,0 +1,49 @@
+import time
+
+from fbox import settings
+
+
+class Stats:
+    def __init__(self, bucket: int, size: int) -> None:
+        self.bucket = bucket
+        self.size = size
+        self.gauges: dict[str, int] = {}
+        self.totals: dict[str, int] = {}
+        self.history: dict[str, list[int]] = {}
+        self.epochs = [-1] * size
+
+    def add(self, name: str, value: int) -> None:
+        self.gauges[name] = self.gauges.get(name, 0) + value
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.totals[name] = self.totals.get(name, 0) + value
+
+        epoch = int(time.time()) // self.bucket
+        slot = epoch % self.size
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            for counts in self.history.values():
+                counts[slot] = 0
+
+        counts = self.history.get(name)
+        if counts is None:
+            counts = self.history[name] = [0] * self.size
+        counts[slot] += value
+
+    def get_history(self) -> dict:
+        epoch = int(time.time()) // self.bucket
+        epochs = range(epoch - self.size + 1, epoch + 1)
+        events = {}
+        for name, counts in self.history.items():
+            events[name] = [
+                counts[e % self.size] if self.epochs[e % self.size] == e else 0
+                for e in epochs
+            ]
+        return {
+            "bucket": self.bucket,
+            "start": epochs[0] * self.bucket,
+            "events": events,
+        }
+
+
+stats = Stats(settings.STATS_BUCKET, settings.STATS_HISTORY)
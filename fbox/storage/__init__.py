@@ -2,10 +2,12 @@ from fbox import settings
 from fbox.storage.abc import LocalStorage
 from fbox.storage.filesystem import FileSystemStorage
 from fbox.storage.s3_remote import S3RemoteStorage
+from fbox.storage.s3_async import S3AsyncStorage
 
 storage_engines = {
     "filesystem": FileSystemStorage,
     "s3remote": S3RemoteStorage,
+    "s3async": S3AsyncStorage,
 }
 
 storage = storage_engines[settings.STORAGE_ENGINE]()
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from pathlib import PurePath
-from typing import BinaryIO
+from typing import BinaryIO, AsyncIterator
 
 from fastapi import UploadFile, Request
 
@@ -43,6 +43,18 @@ class RemoteStorage(ABC):
     async def get_dir_filenames(self, dirname: str) -> list[str]:
         pass
 
+    @abstractmethod
+    async def get_dir_modified(self, dirname: str) -> dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def get_snapshot(self) -> bytes | None:
+        pass
+
+    @abstractmethod
+    async def save_snapshot(self, data: bytes) -> None:
+        pass
+
     @abstractmethod
     async def get_box(self, code: str) -> Box | None:
         pass
@@ -75,8 +87,20 @@ class LocalStorage(RemoteStorage):
 
     @abstractmethod
     async def save_file_slice(
-        self, code: str, filename: str, file: UploadFile, offset: int
-    ) -> None:
+        self, code: str, filename: str, file: UploadFile, offset: int, sha256: str
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    async def save_file_stream(
+        self,
+        code: str,
+        filename: str,
+        stream: AsyncIterator[bytes],
+        offset: int,
+        size: int,
+        sha256: str,
+    ) -> bool:
         pass
 
     @abstractmethod
@@ -1,31 +1,63 @@
 import asyncio, os, hashlib, shutil, json
-from typing import BinaryIO
+from typing import BinaryIO, AsyncIterator
 from pathlib import PurePath
 from shutil import disk_usage
 
 from fastapi import UploadFile, Request
 
 from fbox import settings
+from fbox.log import logger
 from fbox.utils import get_now
 from fbox.files.models import Box
 from fbox.cards.models import Card
 from fbox.storage.abc import LocalStorage
 
 
+class FileDigest:
+    def __init__(self) -> None:
+        self.offset = 0
+        self.version = 0
+        self.sha256 = hashlib.sha256()
+        self.writing: list[tuple[int, int]] = []
+
+    def reset(self) -> None:
+        self.offset = 0
+        self.version += 1
+        self.sha256 = hashlib.sha256()
+
+    def begin(self, offset: int, size: int) -> tuple:
+        end = offset + size
+        overlapped = offset < self.offset or any(
+            start < end and offset < stop for start, stop in self.writing
+        )
+        if overlapped:
+            self.reset()
+
+        sha256 = None
+        if not overlapped and offset == self.offset:
+            sha256 = self.sha256.copy()
+
+        self.writing.append((offset, end))
+        return (offset, end, self.version, sha256)
+
+    def end(self, ticket: tuple, ok: bool) -> None:
+        offset, end, version, sha256 = ticket
+        self.writing.remove((offset, end))
+        if not ok:
+            self.reset()
+        elif sha256 is not None and version == self.version:
+            self.offset = end
+            self.sha256 = sha256
+
+
 class FileSystemStorage(LocalStorage):
     CHUNK_SIZE = 256 * 1024
 
-    async def init(self) -> None:
-        data_root = settings.DATA_ROOT
-        box_data = data_root / "box"
-        card_data = data_root / "card"
+    def __init__(self) -> None:
+        self.digests: dict[str, dict[str, FileDigest]] = {}
 
-        box_data.mkdir(parents=True, exist_ok=True)
-        card_data.mkdir(parents=True, exist_ok=True)
-
-        logs_root = settings.LOGS_ROOT
-        box_logs = logs_root / "box"
-        box_logs.mkdir(parents=True, exist_ok=True)
+    async def init(self) -> None:
+        await asyncio.to_thread(self._init)
 
     async def close(self) -> None:
         pass
@@ -36,6 +68,7 @@ class FileSystemStorage(LocalStorage):
     async def save_dummy_file(self, code: str, filename: str, size: int) -> list[str]:
         filepath = await self.get_filepath(code, filename)
         await asyncio.to_thread(self._save_dummy, filepath, size)
+        self.digests.setdefault(code, {})[filename] = FileDigest()
         return [
             f"/api/files/{code}/{filename}",
         ]
@@ -43,8 +76,10 @@ class FileSystemStorage(LocalStorage):
     async def complete_file(
         self, code: str, filename: str, sha256: str, extra: dict
     ) -> bool:
-        file_sha256 = await self._get_file_sha256(code, filename)
+        digest = self._get_digest(code, filename)
+        file_sha256 = await self._get_file_sha256(code, filename, digest)
         if file_sha256 == sha256:
+            self.digests.get(code, {}).pop(filename, None)
             return True
         return False
 
@@ -57,11 +92,17 @@ class FileSystemStorage(LocalStorage):
 
     async def get_dir_filenames(self, dirname: str) -> list[str]:
         dirpath = settings.DATA_ROOT / dirname
-        filenames = []
-        for path in dirpath.iterdir():
-            filename = path.name
-            filenames.append(filename)
-        return filenames
+        paths = await asyncio.to_thread(self._walk, dirpath, settings.DATA_FANOUT)
+        return [os.path.basename(path) for path in paths]
+
+    async def get_dir_modified(self, dirname: str) -> dict[str, int]:
+        return await asyncio.to_thread(self._get_dir_modified, dirname)
+
+    async def get_snapshot(self) -> bytes | None:
+        return await asyncio.to_thread(self._get_snapshot)
+
+    async def save_snapshot(self, data: bytes) -> None:
+        await asyncio.to_thread(self._save_snapshot, data)
 
     async def get_box(self, code: str) -> Box | None:
         return await asyncio.to_thread(self._get_box, code)
@@ -70,9 +111,11 @@ class FileSystemStorage(LocalStorage):
         await asyncio.to_thread(self._save_box, box)
 
     async def remove_box(self, code: str) -> None:
+        self.digests.pop(code, None)
         await asyncio.to_thread(self._remove_box, code)
 
     async def archive_box(self, box: Box) -> None:
+        self.digests.pop(box.code, None)
         await asyncio.to_thread(self._archive_box, box)
 
     async def get_card(self, code: str) -> Card | None:
@@ -82,28 +125,161 @@ class FileSystemStorage(LocalStorage):
         await asyncio.to_thread(self._save_card, card)
 
     async def get_filepath(self, code: str, filename: str) -> PurePath:
-        return PurePath("box") / code / "files" / filename
+        return self._box_path(code) / "files" / filename
 
     async def save_file_slice(
-        self, code: str, filename: str, file: UploadFile, offset: int
-    ) -> None:
+        self, code: str, filename: str, file: UploadFile, offset: int, sha256: str
+    ) -> bool:
         filepath = await self.get_filepath(code, filename)
-        await asyncio.to_thread(self._save_slice, filepath, file.file, offset)
+        size = await self.get_size(file)
+        digest = self._get_digest(code, filename)
+        ticket = digest.begin(offset, size)
+        saved = False
+        try:
+            saved = await asyncio.to_thread(
+                self._save_slice, filepath, file.file, offset, sha256, ticket[3]
+            )
+        finally:
+            digest.end(ticket, saved)
+        return saved
+
+    async def save_file_stream(
+        self,
+        code: str,
+        filename: str,
+        stream: AsyncIterator[bytes],
+        offset: int,
+        size: int,
+        sha256: str,
+    ) -> bool:
+        path = settings.DATA_ROOT / await self.get_filepath(code, filename)
+        digest = self._get_digest(code, filename)
+        ticket = digest.begin(offset, size)
+        m = hashlib.sha256()
+        written = 0
+        saved = False
+
+        fd = await asyncio.to_thread(os.open, path, os.O_WRONLY)
+        try:
+            buffer = bytearray()
+            async for chunk in stream:
+                buffer += chunk
+                if written + len(buffer) > size:
+                    break
+                if len(buffer) >= self.CHUNK_SIZE:
+                    await asyncio.to_thread(
+                        self._write_chunk, fd, buffer, offset + written, m, ticket[3]
+                    )
+                    written += len(buffer)
+                    buffer = bytearray()
+            else:
+                if buffer:
+                    await asyncio.to_thread(
+                        self._write_chunk, fd, buffer, offset + written, m, ticket[3]
+                    )
+                    written += len(buffer)
+                saved = written == size and m.hexdigest() == sha256
+        finally:
+            await asyncio.to_thread(os.close, fd)
+            digest.end(ticket, saved)
+        return saved
 
     async def get_sha256(self, file: BinaryIO) -> str:
         return await asyncio.to_thread(self._sha256, file)
 
     async def get_size(self, file: UploadFile) -> int:
-        f = file.file
+        return await asyncio.to_thread(self._get_size, file.file)
+
+    def _init(self) -> None:
+        data_root = settings.DATA_ROOT
+        box_data = data_root / "box"
+        card_data = data_root / "card"
+
+        box_data.mkdir(parents=True, exist_ok=True)
+        card_data.mkdir(parents=True, exist_ok=True)
+
+        logs_root = settings.LOGS_ROOT
+        box_logs = logs_root / "box"
+        box_logs.mkdir(parents=True, exist_ok=True)
+
+    def _get_size(self, f: BinaryIO) -> int:
         f.seek(0, os.SEEK_END)
         size = f.tell()
         f.seek(0, os.SEEK_SET)
         return size
 
-    async def _get_file_sha256(self, code: str, filename: str) -> str:
+    def _shard(self, name: str, fanout: int | None = None) -> PurePath:
+        if fanout is None:
+            fanout = settings.DATA_FANOUT
+        parts = [name[i * 2 : i * 2 + 2] for i in range(fanout)]
+        return PurePath(*parts, name)
+
+    def _box_path(self, code: str) -> PurePath:
+        return PurePath("box") / self._shard(code)
+
+    def _card_path(self, code: str) -> PurePath:
+        return PurePath("card") / self._shard(f"{code}.json")
+
+    def _walk(self, dirpath: PurePath, depth: int) -> list[str]:
+        paths = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if depth == 0:
+                    paths.append(entry.path)
+                elif entry.is_dir():
+                    paths.extend(self._walk(entry.path, depth - 1))
+        return paths
+
+    def _find(self, dirpath: PurePath) -> list[str]:
+        paths = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if len(entry.name) == 2 and entry.is_dir():
+                    paths.extend(self._find(entry.path))
+                else:
+                    paths.append(entry.path)
+        return paths
+
+    def migrate_layout(self) -> int:
+        count = 0
+        for base in (
+            settings.DATA_ROOT / "box",
+            settings.DATA_ROOT / "card",
+            settings.LOGS_ROOT / "box",
+        ):
+            if not base.exists():
+                continue
+
+            for path in self._find(base):
+                target = base / self._shard(os.path.basename(path))
+                if PurePath(path) == target:
+                    continue
+                if os.path.exists(target):
+                    logger.warning(f"Skip {path}, {target} already exists")
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(path, target)
+                count += 1
+
+            for dirpath, dirnames, filenames in os.walk(base, topdown=False):
+                name = os.path.basename(dirpath)
+                if dirpath != str(base) and len(name) == 2 and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+        return count
+
+    def _get_digest(self, code: str, filename: str) -> FileDigest:
+        if settings.SHARED_STATE:
+            return FileDigest()
+        return self.digests.setdefault(code, {}).setdefault(filename, FileDigest())
+
+    async def _get_file_sha256(
+        self, code: str, filename: str, digest: FileDigest
+    ) -> str:
         path = settings.DATA_ROOT / await self.get_filepath(code, filename)
-        with open(path, "rb") as f:
-            return await asyncio.to_thread(self._sha256, f)
+        offset, sha256 = 0, None
+        if not digest.writing:
+            offset, sha256 = digest.offset, digest.sha256.copy()
+        return await asyncio.to_thread(self._file_sha256, path, offset, sha256)
 
     def _save_log(self, code: str, request: Request, now: int) -> None:
         r = {}
@@ -112,7 +288,7 @@ class FileSystemStorage(LocalStorage):
             r.update({k: v})
         res = json.dumps(r)
 
-        filepath = settings.DATA_ROOT / "box" / code / f"user.json"
+        filepath = settings.DATA_ROOT / self._box_path(code) / f"user.json"
         if not filepath.parent.exists():
             filepath.parent.mkdir(parents=True)
 
@@ -126,14 +302,41 @@ class FileSystemStorage(LocalStorage):
         with open(path, "wb") as f:
             f.truncate(size)
 
-    def _save_slice(self, filepath: PurePath, file: BinaryIO, offset: int):
-        path = settings.DATA_ROOT / filepath
-        with open(path, "r+b") as f:
-            f.seek(offset)
+    def _save_slice(
+        self, filepath: PurePath, file: BinaryIO, offset: int, sha256: str, digest=None
+    ) -> bool:
+        m = hashlib.sha256()
+        fd = os.open(settings.DATA_ROOT / filepath, os.O_WRONLY)
+        try:
             chunk = file.read(self.CHUNK_SIZE)
             while chunk:
-                f.write(chunk)
+                self._write_chunk(fd, chunk, offset, m, digest)
+                offset += len(chunk)
                 chunk = file.read(self.CHUNK_SIZE)
+        finally:
+            os.close(fd)
+        return m.hexdigest() == sha256
+
+    def _write_chunk(self, fd: int, chunk: bytes, offset: int, *hashes) -> None:
+        view = memoryview(chunk)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
+
+        for m in hashes:
+            if m is not None:
+                m.update(chunk)
+
+    def _file_sha256(self, path: PurePath, offset: int, sha256=None) -> str:
+        m = sha256 or hashlib.sha256()
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(self.CHUNK_SIZE)
+            while chunk:
+                m.update(chunk)
+                chunk = f.read(self.CHUNK_SIZE)
+        return m.hexdigest()
 
     def _sha256(self, file: BinaryIO):
         m = hashlib.sha256()
@@ -144,26 +347,52 @@ class FileSystemStorage(LocalStorage):
         file.seek(0, os.SEEK_SET)
         return m.hexdigest()
 
+    def _get_dir_modified(self, dirname: str) -> dict[str, int]:
+        modified = {}
+        for path in self._walk(settings.DATA_ROOT / dirname, settings.DATA_FANOUT):
+            name = os.path.basename(path)
+            if dirname == "box":
+                path = os.path.join(path, "box.json")
+            try:
+                modified[name] = int(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                modified[name] = 0
+        return modified
+
+    def _get_snapshot(self) -> bytes | None:
+        snapshot = settings.DATA_ROOT / "snapshot"
+        if snapshot.exists():
+            return snapshot.read_bytes()
+        return None
+
+    def _save_snapshot(self, data: bytes) -> None:
+        snapshot = settings.DATA_ROOT / "snapshot"
+        temp = snapshot.with_suffix(".tmp")
+        temp.write_bytes(data)
+        os.replace(temp, snapshot)
+
     def _get_box(self, code: str) -> Box | None:
-        box_json = settings.DATA_ROOT / "box" / code / "box.json"
+        box_json = settings.DATA_ROOT / self._box_path(code) / "box.json"
         if box_json.exists():
-            box = Box.parse_file(box_json)
+            box = Box.from_json(box_json.read_bytes())
             return box
         return None
 
     def _save_box(self, box: Box) -> None:
-        box_file = settings.DATA_ROOT / "box" / box.code / "box.json"
+        box_file = settings.DATA_ROOT / self._box_path(box.code) / "box.json"
+        if not box_file.parent.exists():
+            box_file.parent.mkdir(parents=True)
         with open(box_file, "w") as f:
-            f.write(box.json())
+            f.write(box.to_json())
 
     def _remove_box(self, code: str) -> None:
-        box_dir = settings.DATA_ROOT / "box" / code
+        box_dir = settings.DATA_ROOT / self._box_path(code)
         shutil.rmtree(box_dir)
 
     def _archive_box(self, box: Box) -> None:
         now = get_now().date().isoformat()
-        current = settings.DATA_ROOT / "box" / box.code
-        target = settings.LOGS_ROOT / "box" / box.code / now
+        current = settings.DATA_ROOT / self._box_path(box.code)
+        target = settings.LOGS_ROOT / self._box_path(box.code) / now
         target.mkdir(parents=True)
 
         for f in current.iterdir():
@@ -171,13 +400,15 @@ class FileSystemStorage(LocalStorage):
         current.rmdir()
 
     def _get_card(self, code: str) -> Card | None:
-        card_json = settings.DATA_ROOT / "card" / f"{code}.json"
+        card_json = settings.DATA_ROOT / self._card_path(code)
         if card_json.exists():
-            card = Card.parse_file(card_json)
+            card = Card.from_json(card_json.read_bytes())
             return card
         return None
 
     def _save_card(self, card: Card) -> None:
-        card_json = settings.DATA_ROOT / "card" / f"{card.code}.json"
+        card_json = settings.DATA_ROOT / self._card_path(card.code)
+        if not card_json.parent.exists():
+            card_json.parent.mkdir(parents=True)
         with open(card_json, "w") as f:
-            f.write(card.json())
+            f.write(card.to_json())
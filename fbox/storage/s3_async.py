@@ -0,0 +1,489 @@
+import asyncio, base64, datetime, hashlib, hmac, json, random, time
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import httpx
+from fastapi import Request
+
+from fbox import settings
+from fbox.stats import stats
+from fbox.utils import get_now
+from fbox.storage.abc import RemoteStorage
+from fbox.files.models import Box
+from fbox.cards.models import Card
+
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+THROTTLE_STATUS = {429, 503}
+
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+RETRY_BASE = 0.05
+
+RETRY_CAP = 5.0
+
+HASH_INLINE_SIZE = 1_000_000
+
+
+class S3Error(Exception):
+    def __init__(self, status: int, code: str) -> None:
+        super().__init__(f"{status} {code}")
+        self.status = status
+        self.code = code
+
+
+def encode_query(query: dict[str, str]) -> str:
+    return "&".join(
+        f"{quote(k, safe='')}={quote(v, safe='')}" for k, v in sorted(query.items())
+    )
+
+
+def parse_xml(content: bytes) -> ElementTree.Element:
+    root = ElementTree.fromstring(content)
+    for element in root.iter():
+        element.tag = element.tag.rpartition("}")[2]
+    return root
+
+
+def get_error_code(r: httpx.Response) -> str:
+    try:
+        return parse_xml(r.content).findtext("Code") or r.reason_phrase
+    except ElementTree.ParseError:
+        return r.reason_phrase
+
+
+class Signer:
+    def __init__(self, access_key: str, secret_key: str, region: str) -> None:
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.keys: dict[str, bytes] = {}
+
+    def get_key(self, date: str) -> bytes:
+        key = self.keys.get(date)
+        if key is None:
+            key = f"AWS4{self.secret_key}".encode()
+            for part in (date, self.region, "s3", "aws4_request"):
+                key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+            self.keys = {date: key}
+        return key
+
+    def get_scope(self, amz_date: str) -> str:
+        return f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+
+    def sign(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, str],
+        headers: dict[str, str],
+        payload_hash: str,
+        amz_date: str,
+    ) -> str:
+        names = sorted(headers)
+        canonical = "\n".join(
+            [
+                method,
+                path,
+                encode_query(query),
+                "".join(f"{name}:{headers[name].strip()}\n" for name in names),
+                ";".join(names),
+                payload_hash,
+            ]
+        )
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                self.get_scope(amz_date),
+                hashlib.sha256(canonical.encode()).hexdigest(),
+            ]
+        )
+        key = self.get_key(amz_date[:8])
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def get_authorization(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, str],
+        headers: dict[str, str],
+        payload_hash: str,
+        amz_date: str,
+    ) -> str:
+        signature = self.sign(method, path, query, headers, payload_hash, amz_date)
+        return (
+            f"AWS4-HMAC-SHA256 "
+            f"Credential={self.access_key}/{self.get_scope(amz_date)}, "
+            f"SignedHeaders={';'.join(sorted(headers))}, "
+            f"Signature={signature}"
+        )
+
+    def presign(
+        self, method: str, host: str, path: str, query: dict[str, str], expire: int
+    ) -> str:
+        amz_date = get_amz_date()
+        query = {
+            **query,
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{self.get_scope(amz_date)}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expire),
+            "X-Amz-SignedHeaders": "host",
+        }
+        query["X-Amz-Signature"] = self.sign(
+            method, path, query, {"host": host}, "UNSIGNED-PAYLOAD", amz_date
+        )
+        return f"{path}?{encode_query(query)}"
+
+
+def get_amz_date() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, maximum: int, cooldown: float = 1.0) -> None:
+        self.limit = float(max(min(limit, maximum), 1))
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.active = 0
+        self.decreased = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def __aexit__(self, *args) -> None:
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify(int(self.limit) - self.active)
+
+    def increase(self) -> None:
+        self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+    def decrease(self) -> None:
+        now = time.monotonic()
+        if now - self.decreased >= self.cooldown:
+            self.decreased = now
+            self.limit = max(self.limit / 2, 1.0)
+
+
+class S3AsyncStorage(RemoteStorage):
+    def __init__(self) -> None:
+        endpoint = settings.S3_ENDPOINT_URL or (
+            f"https://s3.{settings.S3_REGION}.amazonaws.com"
+        )
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.signer = Signer(
+            settings.S3_ACCESS_KEY, settings.S3_SECRET_KEY, settings.S3_REGION
+        )
+        self.limiter = ConcurrencyLimiter(
+            settings.S3_CONCURRENCY, settings.S3_MAX_CONNECTIONS
+        )
+        self.client: httpx.AsyncClient | None = None
+
+    async def init(self) -> None:
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.S3_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.S3_MAX_CONNECTIONS,
+            ),
+            timeout=settings.S3_TIMEOUT,
+        )
+
+        for bucket in (settings.S3_DATA_BUCKET, settings.S3_LOGS_BUCKET):
+            try:
+                await self._request("PUT", bucket)
+            except S3Error:
+                pass
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def save_log(self, code: str, request: Request, now: int) -> None:
+        key = f"box/{code}/user.json"
+        r = {}
+        r.update({"created": now})
+        for k, v in request.headers.items():
+            r.update({k: v})
+        res = json.dumps(r)
+
+        await self._request("PUT", settings.S3_LOGS_BUCKET, key, content=res.encode())
+
+    async def save_dummy_file(self, code: str, filename: str, size: int) -> list[str]:
+        key = f"box/{code}/files/{filename}"
+        r = await self._request("POST", settings.S3_DATA_BUCKET, key, {"uploads": ""})
+
+        upload_id = parse_xml(r.content).findtext("UploadId")
+        max_count = int(size / 10_000_000) + 1
+        expire = int(settings.BOX_EXPIRE / 10)
+        urls = []
+
+        for i in range(1, max_count + 1):
+            url = self.presign(
+                "PUT",
+                settings.S3_DATA_BUCKET,
+                key,
+                {"partNumber": str(i), "uploadId": upload_id},
+                expire,
+            )
+            urls.append(url)
+        return urls
+
+    async def complete_file(
+        self, code: str, filename: str, sha256: str, extra: dict
+    ) -> bool:
+        key = f"box/{code}/files/{filename}"
+
+        try:
+            parts = "".join(
+                f"<Part><ETag>{escape(str(part['ETag']))}</ETag>"
+                f"<PartNumber>{int(part['PartNumber'])}</PartNumber></Part>"
+                for part in extra["Parts"]
+            )
+            body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>"
+            r = await self._request(
+                "POST",
+                settings.S3_DATA_BUCKET,
+                key,
+                {"uploadId": str(extra["UploadId"])},
+                content=body.encode(),
+            )
+            if parse_xml(r.content).tag == "Error":
+                return False
+
+            r = await self._request("HEAD", settings.S3_DATA_BUCKET, key)
+            size = int(r.headers["Content-Length"])
+            if size != extra["size"]:
+                return False
+
+            return True
+        except Exception:
+            return False
+
+    async def get_url(self, code: str, filename: str) -> str:
+        key = f"box/{code}/files/{filename}"
+        expire = int(settings.BOX_EXPIRE / 10)
+        return self.presign("GET", settings.S3_DATA_BUCKET, key, {}, expire)
+
+    async def get_capacity(self) -> int:
+        return 1
+
+    async def get_dir_filenames(self, dirname: str) -> list[str]:
+        filenames = set()
+        for content in await self._list_objects(settings.S3_DATA_BUCKET, dirname):
+            key = content.findtext("Key")
+            filename = key.split("/")[1]
+            filenames.add(filename)
+        return list(filenames)
+
+    async def get_dir_modified(self, dirname: str) -> dict[str, int]:
+        contents = await self._list_objects(settings.S3_DATA_BUCKET, f"{dirname}/")
+
+        modified = {}
+        for content in contents:
+            key = content.findtext("Key")
+            name = key.split("/")[1]
+            mtime = datetime.datetime.fromisoformat(
+                content.findtext("LastModified").replace("Z", "+00:00")
+            )
+            if dirname != "box" or key.endswith("/box.json"):
+                modified[name] = int(mtime.timestamp())
+            else:
+                modified.setdefault(name, 0)
+        return modified
+
+    async def get_snapshot(self) -> bytes | None:
+        try:
+            r = await self._request("GET", settings.S3_DATA_BUCKET, "snapshot")
+            return r.content
+        except S3Error:
+            return None
+
+    async def save_snapshot(self, data: bytes) -> None:
+        await self._request("PUT", settings.S3_DATA_BUCKET, "snapshot", content=data)
+
+    async def get_box(self, code: str) -> Box | None:
+        key = f"box/{code}/box.json"
+        try:
+            r = await self._request("GET", settings.S3_DATA_BUCKET, key)
+            box = Box.from_json(r.content)
+            return box
+        except S3Error:
+            return None
+
+    async def save_box(self, box: Box) -> None:
+        key = f"box/{box.code}/box.json"
+        box_json = box.to_json()
+
+        await self._request(
+            "PUT", settings.S3_DATA_BUCKET, key, content=box_json.encode()
+        )
+
+    async def remove_box(self, code: str) -> None:
+        box_key = f"box/{code}"
+        contents = await self._list_objects(settings.S3_DATA_BUCKET, box_key)
+        keys = [content.findtext("Key") for content in contents]
+        await self._delete_objects(settings.S3_DATA_BUCKET, keys)
+
+    async def archive_box(self, box: Box) -> None:
+        box_key = f"box/{box.code}"
+        now = get_now().date().isoformat()
+        contents = await self._list_objects(settings.S3_DATA_BUCKET, box_key)
+
+        keys = []
+        copies = []
+        for content in contents:
+            key = content.findtext("Key")
+            size = int(content.findtext("Size"))
+            keys.append(key)
+
+            key_parts = key.split("/")
+            target_key_parts = ["box", key_parts[1], now]
+            target_key_parts.extend(key_parts[2:])
+            target_key = "/".join(target_key_parts)
+
+            if size < 5_000_000_000:
+                copy_source = quote(f"{settings.S3_DATA_BUCKET}/{key}")
+                copies.append(
+                    self._request(
+                        "PUT",
+                        settings.S3_LOGS_BUCKET,
+                        target_key,
+                        headers={"x-amz-copy-source": copy_source},
+                    )
+                )
+
+        await asyncio.gather(*copies)
+        await self._delete_objects(settings.S3_DATA_BUCKET, keys)
+
+    async def get_card(self, code: str) -> Card | None:
+        key = f"card/{code}.json"
+        try:
+            r = await self._request("GET", settings.S3_DATA_BUCKET, key)
+            card = Card.from_json(r.content)
+            return card
+        except S3Error:
+            return None
+
+    async def save_card(self, card: Card) -> None:
+        key = f"card/{card.code}.json"
+        card_json = card.to_json()
+
+        await self._request(
+            "PUT", settings.S3_DATA_BUCKET, key, content=card_json.encode()
+        )
+
+    def get_path(self, bucket: str, key: str) -> str:
+        return f"/{bucket}/{quote(key)}" if key else f"/{bucket}"
+
+    def presign(
+        self, method: str, bucket: str, key: str, query: dict[str, str], expire: int
+    ) -> str:
+        path = self.get_path(bucket, key)
+        return self.endpoint + self.signer.presign(
+            method, self.host, path, query, expire
+        )
+
+    async def _request(
+        self,
+        method: str,
+        bucket: str,
+        key: str = "",
+        query: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+        content: bytes = b"",
+    ) -> httpx.Response:
+        query = query or {}
+        path = self.get_path(bucket, key)
+        url = self.endpoint + path
+        if query:
+            url = f"{url}?{encode_query(query)}"
+
+        if len(content) < HASH_INLINE_SIZE:
+            payload_hash = hashlib.sha256(content).hexdigest()
+        else:
+            payload_hash = await asyncio.to_thread(
+                lambda: hashlib.sha256(content).hexdigest()
+            )
+        idempotent = method != "POST" or "delete" in query
+
+        for attempt in range(settings.S3_MAX_RETRIES + 1):
+            amz_date = get_amz_date()
+            signed = {
+                **(headers or {}),
+                "host": self.host,
+                "x-amz-content-sha256": payload_hash,
+                "x-amz-date": amz_date,
+            }
+            authorization = self.signer.get_authorization(
+                method, path, query, signed, payload_hash, amz_date
+            )
+
+            try:
+                async with self.limiter:
+                    r = await self.client.request(
+                        method,
+                        url,
+                        headers={**signed, "authorization": authorization},
+                        content=content,
+                    )
+            except httpx.TransportError as e:
+                if attempt == settings.S3_MAX_RETRIES:
+                    raise
+                if not idempotent and not isinstance(e, UNSENT_ERRORS):
+                    raise
+                throttled = False
+            else:
+                if r.status_code not in RETRY_STATUS:
+                    self.limiter.increase()
+                    if r.status_code >= 300:
+                        raise S3Error(r.status_code, get_error_code(r))
+                    return r
+                if attempt == settings.S3_MAX_RETRIES or (
+                    not idempotent and r.status_code != 429
+                ):
+                    raise S3Error(r.status_code, get_error_code(r))
+                throttled = r.status_code in THROTTLE_STATUS
+
+            if throttled:
+                self.limiter.decrease()
+                stats.incr("s3_throttled")
+            stats.incr("s3_retries")
+            delay = min(RETRY_CAP, RETRY_BASE * 2**attempt)
+            await asyncio.sleep(random.uniform(0, delay))
+
+    async def _list_objects(
+        self, bucket: str, prefix: str
+    ) -> list[ElementTree.Element]:
+        query = {"list-type": "2", "prefix": prefix}
+        contents = []
+        while True:
+            r = await self._request("GET", bucket, query=query)
+            root = parse_xml(r.content)
+            contents.extend(root.findall("Contents"))
+            token = root.findtext("NextContinuationToken")
+            if root.findtext("IsTruncated") != "true" or not token:
+                return contents
+            query = {**query, "continuation-token": token}
+
+    async def _delete_objects(self, bucket: str, keys: list[str]) -> None:
+        for i in range(0, len(keys), 1000):
+            objects = "".join(
+                f"<Object><Key>{escape(key)}</Key></Object>"
+                for key in keys[i : i + 1000]
+            )
+            body = f"<Delete><Quiet>true</Quiet>{objects}</Delete>".encode()
+            md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+            await self._request(
+                "POST",
+                bucket,
+                query={"delete": ""},
+                headers={"content-md5": md5},
+                content=body,
+            )
@@ -12,30 +12,10 @@ from fbox.cards.models import Card
 
 class S3RemoteStorage(RemoteStorage):
     async def init(self) -> None:
-        s = session.get_session()
-        self.client = s.create_client(
-            "s3",
-            aws_access_key_id=settings.S3_ACCESS_KEY,
-            aws_secret_access_key=settings.S3_SECRET_KEY,
-            endpoint_url=settings.S3_ENDPOINT_URL,
-        )
-
-        try:
-            self.client.create_bucket(
-                Bucket=settings.S3_DATA_BUCKET,
-            )
-        except:
-            pass
-
-        try:
-            self.client.create_bucket(
-                Bucket=settings.S3_LOGS_BUCKET,
-            )
-        except:
-            pass
+        await asyncio.to_thread(self._init)
 
     async def close(self) -> None:
-        self.client.close()
+        await asyncio.to_thread(self.client.close)
 
     async def save_log(self, code: str, request: Request, now: int) -> None:
         await asyncio.to_thread(self._save_log, code, request, now)
@@ -59,6 +39,15 @@ class S3RemoteStorage(RemoteStorage):
     async def get_dir_filenames(self, dirname: str) -> list[str]:
         return await asyncio.to_thread(self._get_dir_filenames, dirname)
 
+    async def get_dir_modified(self, dirname: str) -> dict[str, int]:
+        return await asyncio.to_thread(self._get_dir_modified, dirname)
+
+    async def get_snapshot(self) -> bytes | None:
+        return await asyncio.to_thread(self._get_snapshot)
+
+    async def save_snapshot(self, data: bytes) -> None:
+        await asyncio.to_thread(self._save_snapshot, data)
+
     async def get_box(self, code: str) -> Box | None:
         return await asyncio.to_thread(self._get_box, code)
 
@@ -72,11 +61,34 @@ class S3RemoteStorage(RemoteStorage):
         await asyncio.to_thread(self._archive_box, box)
 
     async def get_card(self, code: str) -> Card | None:
-        await asyncio.to_thread(self._get_card, code)
+        return await asyncio.to_thread(self._get_card, code)
 
     async def save_card(self, card: Card) -> None:
         await asyncio.to_thread(self._save_card, card)
 
+    def _init(self) -> None:
+        s = session.get_session()
+        self.client = s.create_client(
+            "s3",
+            aws_access_key_id=settings.S3_ACCESS_KEY,
+            aws_secret_access_key=settings.S3_SECRET_KEY,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+        )
+
+        try:
+            self.client.create_bucket(
+                Bucket=settings.S3_DATA_BUCKET,
+            )
+        except:
+            pass
+
+        try:
+            self.client.create_bucket(
+                Bucket=settings.S3_LOGS_BUCKET,
+            )
+        except:
+            pass
+
     def _save_log(self, code: str, request: Request, now: int) -> None:
         key = f"box/{code}/user.json"
         r = {}
@@ -170,6 +182,45 @@ class S3RemoteStorage(RemoteStorage):
                 filenames.add(filename)
         return list(filenames)
 
+    def _get_dir_modified(self, dirname: str) -> dict[str, int]:
+        paginator = self.client.get_paginator("list_objects")
+        page_iterator = paginator.paginate(
+            Bucket=settings.S3_DATA_BUCKET, Prefix=f"{dirname}/"
+        )
+
+        modified = {}
+        for page in page_iterator:
+            contents = page.get("Contents")
+            if contents is None:
+                break
+
+            for content in contents:
+                key = content["Key"]
+                name = key.split("/")[1]
+                mtime = int(content["LastModified"].timestamp())
+                if dirname != "box" or key.endswith("/box.json"):
+                    modified[name] = mtime
+                else:
+                    modified.setdefault(name, 0)
+        return modified
+
+    def _get_snapshot(self) -> bytes | None:
+        try:
+            r = self.client.get_object(
+                Bucket=settings.S3_DATA_BUCKET,
+                Key="snapshot",
+            )
+            return r["Body"].read()
+        except:
+            return None
+
+    def _save_snapshot(self, data: bytes) -> None:
+        self.client.put_object(
+            Body=data,
+            Bucket=settings.S3_DATA_BUCKET,
+            Key="snapshot",
+        )
+
     def _get_box(self, code: str) -> Box | None:
         key = f"box/{code}/box.json"
         try:
@@ -178,14 +229,14 @@ class S3RemoteStorage(RemoteStorage):
                 Key=key,
             )
             box_json = r["Body"].read()
-            box = Box.parse_raw(box_json)
+            box = Box.from_json(box_json)
             return box
         except:
             return None
 
     def _save_box(self, box: Box) -> None:
         key = f"box/{box.code}/box.json"
-        box_json = box.json()
+        box_json = box.to_json()
 
         self.client.put_object(
             Body=box_json,
@@ -267,14 +318,14 @@ class S3RemoteStorage(RemoteStorage):
                 Key=key,
             )
             card_json = r["Body"].read()
-            card = Card.parse_raw(card_json)
+            card = Card.from_json(card_json)
             return card
         except:
             return None
 
     def _save_card(self, card: Card) -> None:
         key = f"card/{card.code}.json"
-        card_json = card.json()
+        card_json = card.to_json()
 
         self.client.put_object(
             Body=card_json,
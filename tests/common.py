@@ -1,3 +1,10 @@
+import secrets
+
+
 BASE_URL = "http://127.0.0.1:8000"
 
 ADMIN_PASSWORD = "password"
+
+
+def random_ip() -> str:
+    return f"2001:db8:{secrets.token_hex(2)}:{secrets.token_hex(2)}::1"
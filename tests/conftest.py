@@ -1,7 +1,37 @@
+import os
+from collections import OrderedDict
+
 import pytest, httpx
 
+os.environ.setdefault("SECRET_KEY", "test")
+
 
 @pytest.fixture()
 def client():
     with httpx.Client() as client:
         yield client
+
+
+@pytest.fixture()
+def state(monkeypatch):
+    from fbox.database import db
+
+    for name, value in [
+        ("boxes", {}),
+        ("expired_boxes", []),
+        ("loading_boxes", set()),
+        ("expire_heap", []),
+        ("expire_deadlines", {}),
+        ("box_index", {}),
+        ("box_keys", {}),
+        ("cards", {}),
+        ("loading_cards", set()),
+        ("ip_users", OrderedDict()),
+        ("ip_user_heap", []),
+        ("dirty_ip_users", set()),
+        ("removed_ip_users", set()),
+        ("loaded", False),
+        ("LOAD_RETRY_DELAY", 0),
+    ]:
+        monkeypatch.setattr(db, name, value)
+    return db
@@ -0,0 +1,29 @@
+from fbox.codes import CodeAllocator
+
+
+def test_permute_bijection():
+    codes = CodeAllocator(0, 999, "test", 60)
+    assert sorted(codes.permute(i) for i in range(1000)) == list(range(1000))
+
+
+def test_allocate_skips_retired_and_used():
+    codes = CodeAllocator(100, 199, "test", 60)
+    codes.counter = 0
+    order = [str(100 + codes.permute(i)) for i in range(5)]
+
+    codes.retire(order[0])
+    assert codes.allocate(lambda code: code == order[1]) == order[2]
+    assert codes.check_retired(order[0])
+
+    codes.clean()
+    assert codes.check_retired(order[0])
+
+    codes.retired[order[0]] -= 61
+    codes.clean()
+    assert not codes.check_retired(order[0])
+
+
+def test_retire_without_cooldown():
+    codes = CodeAllocator(100, 199, "test", 0)
+    codes.retire("123")
+    assert not codes.retired
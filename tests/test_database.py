@@ -0,0 +1,108 @@
+import asyncio, time
+
+import pytest
+from fastapi import HTTPException
+
+from fbox import database
+from fbox.files.models import Box, File
+from fbox.files.choices import StatusChoice
+from fbox.files.utils import get_box_or_404
+from fbox.cards.choices import LevelChoice
+
+
+class FakeMetadata:
+    def __init__(self, boxes: list[Box], failures: int) -> None:
+        self.boxes = {box.code: box for box in boxes}
+        self.failures = failures
+
+    async def get_boxes(self, codes: list[str]) -> list[Box]:
+        if self.failures:
+            self.failures -= 1
+            raise OSError("metadata unavailable")
+        return [self.boxes[code] for code in codes if code in self.boxes]
+
+    async def get_cards(self, codes: list[str]) -> list:
+        return []
+
+
+def make_box(code: str, created: int | None = None) -> Box:
+    file = File(status=StatusChoice.complete, filename="a.txt", size=10)
+    return Box(
+        code=code,
+        status=StatusChoice.complete,
+        level=LevelChoice.visitor,
+        created=int(time.time()) if created is None else created,
+        files={file.filename: file},
+    )
+
+
+def get_status(code: str) -> int:
+    try:
+        asyncio.run(get_box_or_404("203.0.113.1", code))
+    except HTTPException as e:
+        return e.status_code
+    return 200
+
+
+@pytest.mark.parametrize("failures, status", [(0, 200), (2, 200), (3, 503), (5, 503)])
+def test_load_boxes(state, monkeypatch, failures, status):
+    monkeypatch.setattr(
+        database, "metadata", FakeMetadata([make_box("12345678")], failures)
+    )
+    state.loading_boxes.update(["12345678", "87654321"])
+    assert get_status("12345678") == 503
+
+    asyncio.run(state.load())
+    assert state.loaded == (status == 200)
+    assert get_status("12345678") == status
+    assert get_status("87654321") == (404 if status == 200 else 503)
+
+    asyncio.run(state.load())
+    asyncio.run(state.load())
+    assert not state.loading_boxes and not state.loading_cards
+    assert state.loaded
+    assert get_status("12345678") == 200
+    assert get_status("87654321") == 404
+
+
+class FakeStorage:
+    def __init__(self) -> None:
+        self.archived: list[str] = []
+
+    async def archive_box(self, box: Box) -> None:
+        self.archived.append(box.code)
+
+
+class FakeRemoveMetadata:
+    async def remove_box(self, code: str) -> None:
+        pass
+
+
+def test_expire_heap(state, monkeypatch):
+    storage = FakeStorage()
+    monkeypatch.setattr(database, "storage", storage)
+    monkeypatch.setattr(database, "metadata", FakeRemoveMetadata())
+    monkeypatch.setattr(state, "leader", True)
+
+    now = int(time.time())
+    expire = database.settings.BOX_EXPIRE
+    old = make_box("11111111", now - expire - 1)
+    fresh = make_box("22222222", now)
+    waiting = make_box("33333333", now - expire // 5)
+    waiting.status = StatusChoice.waiting
+    for box in (old, fresh, waiting):
+        state.apply_box(box.code, box)
+
+    assert state.check_box_expire(old)
+    assert not state.check_box_expire(fresh)
+    assert state.check_box_expire(waiting)
+
+    waiting.status = StatusChoice.complete
+    state.apply_box(waiting.code, waiting)
+    assert not state.check_box_expire(waiting)
+    assert len(state.expire_heap) == 4
+
+    asyncio.run(state.clean_expired_boxes())
+    assert storage.archived == ["11111111"]
+    assert set(state.boxes) == {"22222222", "33333333"}
+    assert [code for _, code in state.expire_heap] == ["33333333", "22222222"]
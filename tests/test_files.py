@@ -1,10 +1,10 @@
-import hashlib, base64
+import hashlib, base64, time
 from io import BytesIO
 from urllib.parse import urlparse, parse_qs
 
 from httpx import Client
 
-from tests.common import BASE_URL, ADMIN_PASSWORD
+from tests.common import BASE_URL, ADMIN_PASSWORD, random_ip
 
 
 def test_create_waiting_box(client: Client):
@@ -116,7 +116,7 @@ def test_s3remote_create_complete_box(client: Client):
     upload_urls = res["uploads"][filename]
     print(upload_urls)
 
-    if storage != "s3remote":
+    if storage not in ("s3remote", "s3async"):
         return
 
     content = b"12345678" * 512
@@ -149,3 +149,449 @@ def test_s3remote_create_complete_box(client: Client):
     r = client.patch(f"{BASE_URL}/api/files/{code}")
     print(r.text)
     assert r.status_code == 200
+
+
+def test_filesystem_reject_invalid_slice(client: Client):
+    filename = "test-invalid-slice.jpg"
+    data = [
+        {"name": filename, "size": 2048},
+    ]
+    r = client.post(f"{BASE_URL}/api/files/", json=data)
+    res = r.json()
+    code = res["code"]
+    storage = res["storage"]
+
+    if storage != "filesystem":
+        return
+
+    content = b"12345678" * 256
+    content_hash = hashlib.sha256(content).hexdigest()
+    files = {"file": (filename, BytesIO(content))}
+    data = {
+        "offset": 0,
+        "sha256": hashlib.sha256(b"invalid").hexdigest(),
+    }
+
+    r = client.post(f"{BASE_URL}/api/files/{code}/{filename}", files=files, data=data)
+    assert r.status_code == 400
+
+    files = {"file": (filename, BytesIO(content))}
+    data["sha256"] = content_hash
+    r = client.post(f"{BASE_URL}/api/files/{code}/{filename}", files=files, data=data)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": content_hash, "extra": {}},
+    )
+    assert r.status_code == 200
+
+
+def test_filesystem_invalid_retry(client: Client):
+    filename = "test-invalid-retry.jpg"
+    data = [
+        {"name": filename, "size": 2048},
+    ]
+    r = client.post(f"{BASE_URL}/api/files/", json=data)
+    res = r.json()
+    code = res["code"]
+    storage = res["storage"]
+
+    if storage != "filesystem":
+        return
+
+    content = b"12345678" * 256
+    content_hash = hashlib.sha256(content).hexdigest()
+    files = {"file": (filename, BytesIO(content))}
+    data = {
+        "offset": 0,
+        "sha256": content_hash,
+    }
+    r = client.post(f"{BASE_URL}/api/files/{code}/{filename}", files=files, data=data)
+    assert r.status_code == 200
+
+    files = {"file": (filename, BytesIO(b"87654321" * 256))}
+    r = client.post(f"{BASE_URL}/api/files/{code}/{filename}", files=files, data=data)
+    assert r.status_code == 400
+
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": content_hash, "extra": {}},
+    )
+    assert r.status_code == 400
+
+    files = {"file": (filename, BytesIO(content))}
+    r = client.post(f"{BASE_URL}/api/files/{code}/{filename}", files=files, data=data)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": content_hash, "extra": {}},
+    )
+    assert r.status_code == 200
+
+
+def test_filesystem_put_complete_file(client: Client):
+    filename = "test-put-file.jpg"
+    data = [
+        {"name": filename, "size": 4096},
+    ]
+    r = client.post(f"{BASE_URL}/api/files/", json=data)
+    res = r.json()
+    code = res["code"]
+    storage = res["storage"]
+    upload_urls = res["uploads"][filename]
+
+    if storage != "filesystem":
+        return
+
+    content = b"12345678" * 256
+    content_hash = hashlib.sha256(content).hexdigest()
+    m = hashlib.sha256()
+
+    for i in range(2):
+        m.update(content)
+        params = {
+            "offset": i * 2048,
+            "sha256": content_hash,
+        }
+        r = client.put(f"{BASE_URL}{upload_urls[0]}", params=params, content=content)
+        assert r.status_code == 200
+
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": m.hexdigest(), "extra": {}},
+    )
+    assert r.status_code == 200
+
+
+def test_filesystem_put_invalid_retry(client: Client):
+    filename = "test-put-invalid-retry.jpg"
+    data = [
+        {"name": filename, "size": 2048},
+    ]
+    r = client.post(f"{BASE_URL}/api/files/", json=data)
+    res = r.json()
+    code = res["code"]
+    storage = res["storage"]
+    upload_urls = res["uploads"][filename]
+
+    if storage != "filesystem":
+        return
+
+    content = b"12345678" * 256
+    content_hash = hashlib.sha256(content).hexdigest()
+    params = {
+        "offset": 0,
+        "sha256": content_hash,
+    }
+    r = client.put(f"{BASE_URL}{upload_urls[0]}", params=params, content=content)
+    assert r.status_code == 200
+
+    invalid = b"87654321" * 256
+    r = client.put(f"{BASE_URL}{upload_urls[0]}", params=params, content=invalid)
+    assert r.status_code == 400
+
+    r = client.put(
+        f"{BASE_URL}{upload_urls[0]}", params=params, content=invalid + b"x"
+    )
+    assert r.status_code == 400
+
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": content_hash, "extra": {}},
+    )
+    assert r.status_code == 400
+
+    r = client.put(f"{BASE_URL}{upload_urls[0]}", params=params, content=content)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": content_hash, "extra": {}},
+    )
+    assert r.status_code == 200
+
+
+def test_filesystem_range_file(client: Client):
+    filename = "test-range-file.jpg"
+    data = [
+        {"name": filename, "size": 4096},
+    ]
+    r = client.post(f"{BASE_URL}/api/files/", json=data)
+    res = r.json()
+    code = res["code"]
+    storage = res["storage"]
+
+    if storage != "filesystem":
+        return
+
+    content = bytes(range(256)) * 16
+    content_hash = hashlib.sha256(content).hexdigest()
+    files = {"file": (filename, BytesIO(content))}
+    data = {
+        "offset": 0,
+        "sha256": content_hash,
+    }
+    r = client.post(f"{BASE_URL}/api/files/{code}/{filename}", files=files, data=data)
+    r = client.patch(
+        f"{BASE_URL}/api/files/{code}/{filename}",
+        json={"sha256": content_hash, "extra": {}},
+    )
+    r = client.patch(f"{BASE_URL}/api/files/{code}")
+    assert r.status_code == 200
+
+    url = f"{BASE_URL}/api/files/{code}/{filename}"
+    r = client.get(url)
+    assert r.status_code == 200
+    assert r.content == content
+    etag = r.headers["ETag"]
+    assert etag == f'"{content_hash}"'
+
+    r = client.get(url, headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.headers["Content-Range"] == "bytes 100-199/4096"
+    assert r.content == content[100:200]
+
+    r = client.get(url, headers={"Range": "bytes=-10", "If-Range": etag})
+    assert r.status_code == 206
+    assert r.content == content[-10:]
+
+    r = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert r.status_code == 200
+
+    r = client.get(url, headers={"Range": "bytes=0-9,20-29"})
+    assert r.status_code == 206
+    assert r.headers["Content-Type"].startswith("multipart/byteranges")
+    assert content[0:10] in r.content and content[20:30] in r.content
+
+    r = client.get(url, headers={"Range": "bytes=5000-"})
+    assert r.status_code == 416
+
+    r = client.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+
+
+def test_rate_limit_code_guessing(client: Client):
+    headers = {"X-Real-Ip": random_ip()}
+    r = client.get(f"{BASE_URL}/api/files/00000000", headers=headers)
+    assert r.status_code == 404
+
+    limit = int(r.headers["ratelimit-limit"])
+    assert int(r.headers["ratelimit-remaining"]) == limit - 1
+
+    for _ in range(limit - 1):
+        r = client.get(f"{BASE_URL}/api/files/00000000", headers=headers)
+        assert r.status_code == 404
+
+    r = client.get(f"{BASE_URL}/api/files/00000000", headers=headers)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "40005"
+    assert int(r.headers["retry-after"]) > 0
+    assert r.headers["ratelimit-remaining"] == "0"
+
+    r = client.get(f"{BASE_URL}/api/files/00000000")
+    assert r.status_code == 404
+
+
+def test_rate_limit_fresh_clients():
+    headers = {"X-Real-Ip": random_ip()}
+    with Client() as client:
+        r = client.get(f"{BASE_URL}/api/files/00000000", headers=headers)
+    assert r.status_code == 404
+
+    for _ in range(int(r.headers["ratelimit-limit"]) - 1):
+        with Client() as client:
+            r = client.get(f"{BASE_URL}/api/files/00000000", headers=headers)
+        assert r.status_code == 404
+
+    with Client() as client:
+        r = client.get(f"{BASE_URL}/api/files/00000000", headers=headers)
+    assert r.status_code == 400
+
+
+def test_filesystem_fresh_clients():
+    filename = "test-fresh-file.jpg"
+    content = b"12345678" * 512
+    content_hash = hashlib.sha256(content).hexdigest()
+    data = [
+        {"name": filename, "size": len(content)},
+    ]
+    with Client() as client:
+        r = client.post(f"{BASE_URL}/api/files/", json=data)
+    res = r.json()
+    code = res["code"]
+
+    if res["storage"] != "filesystem":
+        return
+
+    for i in range(2):
+        slice = content[i * 2048 : (i + 1) * 2048]
+        params = {
+            "offset": i * 2048,
+            "sha256": hashlib.sha256(slice).hexdigest(),
+        }
+        with Client() as client:
+            r = client.put(
+                f"{BASE_URL}/api/files/{code}/{filename}", params=params, content=slice
+            )
+        assert r.status_code == 200
+
+    with Client() as client:
+        r = client.patch(
+            f"{BASE_URL}/api/files/{code}/{filename}",
+            json={"sha256": content_hash, "extra": {}},
+        )
+    assert r.status_code == 200
+
+    with Client() as client:
+        r = client.patch(f"{BASE_URL}/api/files/{code}")
+    assert r.status_code == 200
+
+    for _ in range(8):
+        with Client() as client:
+            r = client.get(f"{BASE_URL}/api/files/{code}")
+        assert r.status_code == 200
+        assert r.json()["count"] == 1
+
+        with Client() as client:
+            r = client.get(f"{BASE_URL}/api/files/{code}/{filename}")
+        assert r.content == content
+
+
+def test_admin_list_boxes(client: Client):
+    ip = random_ip()
+    for i in range(3):
+        data = [{"name": f"test-list-file-{i}.jpg", "size": 1024}]
+        r = client.post(f"{BASE_URL}/api/files/", json=data, headers={"X-Real-Ip": ip})
+        assert r.status_code == 201
+
+    headers = {"token": ADMIN_PASSWORD}
+    r = client.get(
+        f"{BASE_URL}/api/admin/boxes/", params={"limit": 1000}, headers=headers
+    )
+    assert r.status_code == 200
+    expected = [box["code"] for box in r.json()]
+    created = [box["created"] for box in r.json()]
+    assert created == sorted(created, reverse=True)
+
+    codes = []
+    url = f"{BASE_URL}/api/admin/boxes/?limit=2"
+    while url:
+        r = client.get(url, headers=headers)
+        assert r.status_code == 200
+        assert len(r.json()) <= 2
+        codes += [box["code"] for box in r.json()]
+        url = r.links.get("next", {}).get("url")
+    assert codes == expected
+
+    r = client.get(
+        f"{BASE_URL}/api/admin/boxes/",
+        params={"status": 1, "order": "asc", "size_max": 1024},
+        headers=headers,
+    )
+    assert r.status_code == 200
+    for box in r.json():
+        assert box["status"] == 1
+        assert sum(f["size"] for f in box["files"].values()) <= 1024
+
+
+def test_admin_stats(client: Client):
+    headers = {"token": ADMIN_PASSWORD}
+    r = client.get(f"{BASE_URL}/api/admin/stats", headers=headers)
+    assert r.status_code == 200
+    before = r.json()
+
+    data = [{"name": "test-stats-file.jpg", "size": 1024}]
+    r = client.post(
+        f"{BASE_URL}/api/files/", json=data, headers={"X-Real-Ip": random_ip()}
+    )
+    assert r.status_code == 201
+
+    r = client.get(
+        f"{BASE_URL}/api/admin/stats", params={"history": False}, headers=headers
+    )
+    after = r.json()
+    assert "history" not in after
+
+    gauges = before["gauges"]
+    assert after["gauges"]["boxes_waiting"] == gauges.get("boxes_waiting", 0) + 1
+    assert after["gauges"]["files_waiting"] == gauges.get("files_waiting", 0) + 1
+    assert after["totals"]["boxes_created"] == (
+        before["totals"].get("boxes_created", 0) + 1
+    )
+
+
+def test_metrics(client: Client):
+    r = client.get(f"{BASE_URL}/metrics", headers={"token": "wrong"})
+    if r.status_code == 404:
+        return
+    assert r.status_code == 400
+
+    headers = {"token": ADMIN_PASSWORD}
+    found = False
+    for _ in range(5):
+        r = client.get(f"{BASE_URL}/metrics", headers=headers)
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/plain")
+
+        lines = r.text.splitlines()
+        assert "# TYPE fbox_storage_duration_seconds histogram" in lines
+        assert any(
+            line.startswith('fbox_loop_lag_seconds{quantile="0.99"}') for line in lines
+        )
+        assert any(
+            line.startswith('fbox_storage_duration_seconds_count{method="init"}')
+            for line in lines
+        )
+        if any(
+            line.startswith(
+                'fbox_http_requests_total{method="GET",route="/metrics",status="200"}'
+            )
+            for line in lines
+        ):
+            found = True
+            break
+    assert found
+
+
+def test_admin_profile(client: Client):
+    headers = {"token": ADMIN_PASSWORD}
+    r = client.post(
+        f"{BASE_URL}/api/admin/profile",
+        params={"route": "get_capacity", "seconds": 5},
+        headers=headers,
+    )
+    if r.status_code == 400:
+        return
+    assert r.status_code == 200
+    assert r.json()["route"] == "get_capacity"
+
+    r = client.post(
+        f"{BASE_URL}/api/admin/profile",
+        params={"route": "no_such_route"},
+        headers=headers,
+    )
+    assert r.status_code == 404
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        for _ in range(20):
+            client.get(f"{BASE_URL}/api/files/capacity")
+        r = client.get(f"{BASE_URL}/api/admin/profile/folded", headers=headers)
+        if "get_capacity" in r.text:
+            break
+
+    r = client.delete(f"{BASE_URL}/api/admin/profile", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["running"] is False
+    assert r.json()["samples"] > 0
+
+    r = client.get(f"{BASE_URL}/api/admin/profile/folded", headers=headers)
+    assert r.status_code == 200
+    assert "get_capacity.folded" in r.headers["content-disposition"]
+    lines = r.text.splitlines()
+    assert any("get_capacity" in line for line in lines)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack and int(count) > 0
@@ -0,0 +1,43 @@
+import random
+from bisect import bisect_left, bisect_right
+
+from fbox.index import SortedIndex
+
+
+def test_sorted_index(monkeypatch):
+    monkeypatch.setattr(SortedIndex, "CHUNK_SIZE", 4)
+    rng = random.Random(0)
+    items = [(rng.randrange(50), str(rng.randrange(10))) for _ in range(200)]
+    index = SortedIndex(items[:100])
+    expected = sorted(items[:100])
+
+    for item in items[100:]:
+        index.add(item)
+        expected.append(item)
+    for item in rng.sample(items, 120):
+        assert index.remove(item)
+        expected.remove(item)
+    assert not index.remove((99, "x"))
+
+    expected.sort()
+    assert list(index) == expected
+    assert len(index) == len(expected)
+    assert all(len(chunk) <= 8 for chunk in index.chunks)
+
+    for _ in range(200):
+        lo, hi = sorted(rng.choice(items + [(-1, ""), (99, "")]) for _ in range(2))
+        start, stop = index.bisect_left(lo), index.bisect_right(hi)
+        found = expected[bisect_left(expected, lo) : bisect_right(expected, hi)]
+        assert list(index.iterate(start, stop)) == found
+        assert list(index.iterate(start, stop, reverse=True)) == found[::-1]
+
+    assert list(index.iterate(index.begin(), index.end(), True)) == expected[::-1]
+
+
+def test_sorted_index_empty():
+    index = SortedIndex()
+    assert list(index.iterate(index.begin(), index.end())) == []
+    assert not index.remove((1, "a"))
+    index.add((1, "a"))
+    assert index.remove((1, "a"))
+    assert list(index) == [] and index.chunks == []
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from fbox import settings, database
+from fbox.utils import get_now
+from fbox.limiter import Policy, policies, check_rate, update_rate
+from fbox.files.utils import get_ip_key
+from fbox.metadata.sqlite import SQLiteMetadata
+
+
+@pytest.mark.parametrize(
+    "ip, key",
+    [
+        ("203.0.113.7", "203.0.113.7"),
+        ("2001:db8:1:2:3:4:5:6", "2001:db8:1:2::/64"),
+        ("2001:db8:1:2:ffff::1", "2001:db8:1:2::/64"),
+        ("2001:db8:1:3::1", "2001:db8:1:3::/64"),
+        ("::ffff:203.0.113.7", "203.0.113.7"),
+        ("unknown", "unknown"),
+    ],
+)
+def test_ip_key(ip, key):
+    assert get_ip_key(ip) == key
+
+
+def test_evict_unlimited_first(state, monkeypatch):
+    monkeypatch.setattr(settings, "IP_USER_MAX_COUNT", 4)
+    limit = policies["error"].limit
+
+    async def run() -> None:
+        await update_rate("203.0.113.1", "error", limit + 1)
+        for i in range(2, 10):
+            await update_rate(f"203.0.113.{i}", "error")
+
+    asyncio.run(run())
+    assert len(state.ip_users) == 4
+    assert "203.0.113.1" in state.ip_users
+    assert list(state.ip_users)[1:] == ["203.0.113.7", "203.0.113.8", "203.0.113.9"]
+
+
+def test_evict_all_limited(state, monkeypatch):
+    monkeypatch.setattr(settings, "IP_USER_MAX_COUNT", 2)
+    limit = policies["error"].limit
+
+    async def run() -> None:
+        for i in range(1, 4):
+            await update_rate(f"203.0.113.{i}", "error", limit + 1)
+
+    asyncio.run(run())
+    assert list(state.ip_users) == ["203.0.113.2", "203.0.113.3"]
+
+
+def test_check_rate_cost(state, monkeypatch):
+    policy = Policy("upload", 100, 3600)
+    monkeypatch.setitem(policies, "upload", policy)
+    ip = "203.0.113.1"
+
+    async def run() -> None:
+        await check_rate(ip, "upload", policy.limit)
+        await check_rate(ip, "upload", policy.limit * 2)
+
+        await update_rate(ip, "upload", policy.limit // 2)
+        await check_rate(ip, "upload", policy.limit - policy.limit // 2)
+        with pytest.raises(HTTPException) as e:
+            await check_rate(ip, "upload", policy.limit - policy.limit // 2 + 1)
+        assert int(e.value.headers["Retry-After"]) > 0
+        await check_rate(ip, "upload")
+
+    asyncio.run(run())
+
+
+def test_shared_state(state, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SHARED_STATE", True)
+    monkeypatch.setattr(settings, "METADATA_SQLITE_PATH", tmp_path / "fbox.db")
+    limit = policies["error"].limit
+    ip = "203.0.113.1"
+
+    async def run() -> None:
+        workers = [SQLiteMetadata() for _ in range(2)]
+        for metadata in workers:
+            await metadata.init()
+
+        for i in range(limit):
+            monkeypatch.setattr(database, "metadata", workers[i % 2])
+            state.ip_users.clear()
+            await check_rate(ip, "error")
+            await update_rate(ip, "error")
+
+        state.ip_users.clear()
+        with pytest.raises(HTTPException):
+            await check_rate(ip, "error")
+
+        await database.metadata.clean_ip_users(get_now().timestamp())
+        assert await database.metadata.get_ip_user(ip) is not None
+        await database.metadata.clean_ip_users(get_now().timestamp() + 3600)
+        assert await database.metadata.get_ip_user(ip) is None
+
+        for metadata in workers:
+            await metadata.close()
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from fbox import settings
+from fbox.files.models import Box, File, IPUser
+from fbox.files.choices import StatusChoice
+from fbox.cards.models import Card
+from fbox.cards.choices import LevelChoice
+from fbox.metadata.sqlite import SQLiteMetadata
+
+
+@pytest.fixture()
+def metadata(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "METADATA_SQLITE_PATH", tmp_path / "fbox.db")
+    metadata = SQLiteMetadata()
+    metadata._init()
+    yield metadata
+    metadata._close()
+
+
+def make_box(code: str) -> Box:
+    file = File(status=StatusChoice.waiting, filename="a.txt", size=10)
+    return Box(
+        code=code,
+        status=StatusChoice.waiting,
+        level=LevelChoice.visitor,
+        created=1000,
+        files={file.filename: file},
+    )
+
+
+def test_box_round_trip(metadata):
+    box = make_box("12345678")
+    assert metadata._create_box(box)
+    assert not metadata._create_box(box)
+    assert metadata._get_codes("boxes") == ["12345678"]
+
+    box.files["a.txt"].status = StatusChoice.complete
+    box.files["a.txt"].sha256 = "0" * 64
+    metadata._save_file(box.code, box.files["a.txt"])
+    box.status = StatusChoice.complete
+    metadata._save_box(box)
+
+    [saved] = metadata._get_boxes(["12345678", "87654321"])
+    assert saved.to_dict() == box.to_dict()
+
+    metadata._remove_box(box.code)
+    assert metadata._get_boxes(["12345678"]) == []
+
+
+def test_card_round_trip(metadata):
+    card = Card(code="123456789", level=LevelChoice.red, count=3, created=1000)
+    assert metadata._create_card(card)
+    assert not metadata._create_card(card)
+
+    card.count = 2
+    metadata._save_cards([card])
+    [saved] = metadata._get_cards(["123456789"])
+    assert saved.to_dict() == card.to_dict()
+
+
+def test_ip_users_round_trip(metadata):
+    a = IPUser(ip="203.0.113.1", tats={"box": 10.0})
+    b = IPUser(ip="203.0.113.2", tats={"error": 20.0})
+    metadata._save_ip_users([a, b], [])
+
+    a.tats["box"] = 30.0
+    metadata._save_ip_users([a], ["203.0.113.2", "203.0.113.3"])
+
+    saved = {u.ip: u.tats for u in metadata._get_ip_users()}
+    assert saved == {"203.0.113.1": {"box": 30.0}}
+
+
+def test_database_saves_dirty_ip_users(metadata, monkeypatch):
+    from fbox import database
+
+    monkeypatch.setattr(database, "metadata", metadata)
+    monkeypatch.setattr(settings, "IP_USER_MAX_COUNT", 2)
+    db = database.Database()
+    monkeypatch.setattr(db, "ip_users", type(db.ip_users)())
+    monkeypatch.setattr(db, "ip_user_heap", [])
+    monkeypatch.setattr(db, "dirty_ip_users", set())
+    monkeypatch.setattr(db, "removed_ip_users", set())
+
+    for i in range(3):
+        db.save_ip_user(IPUser(ip=f"203.0.113.{i}", tats={"box": 1e10}))
+    assert db.dirty_ip_users == {"203.0.113.1", "203.0.113.2"}
+    assert db.removed_ip_users == {"203.0.113.0"}
+
+    asyncio.run(db.save_ip_users())
+    assert not db.dirty_ip_users and not db.removed_ip_users
+    saved = {u.ip for u in metadata._get_ip_users()}
+    assert saved == {"203.0.113.1", "203.0.113.2"}
@@ -0,0 +1,131 @@
+import asyncio, os
+from pathlib import PurePath
+
+from starlette.datastructures import Headers
+
+from fbox import settings
+from fbox.shaping import Shaper
+from fbox.files.responses import (
+    AccelFileResponse,
+    RangeFileResponse,
+    ShapedFileResponse,
+)
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+def run_response(response, extensions: dict) -> list[dict]:
+    scope = {"type": "http", "method": "GET", "extensions": extensions}
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    return messages
+
+
+def make_response(tmp_path, range_header: str) -> RangeFileResponse:
+    path = tmp_path / "file.bin"
+    path.write_bytes(CONTENT)
+    headers = Headers({"range": range_header})
+    return RangeFileResponse(path, "file.bin", len(CONTENT), '"etag"', headers)
+
+
+def test_zerocopysend_range(tmp_path):
+    response = make_response(tmp_path, "bytes=100-199")
+    messages = run_response(response, {"http.response.zerocopysend": {}})
+
+    assert messages[0]["type"] == "http.response.start"
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == "http.response.zerocopysend"
+    assert messages[1]["offset"] == 100
+    assert messages[1]["count"] == 100
+    assert messages[1]["more_body"] is True
+    assert messages[1]["file"].name == str(tmp_path / "file.bin")
+    assert messages[2] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_zerocopysend_multipart(tmp_path):
+    response = make_response(tmp_path, "bytes=0-9,20-29")
+    messages = run_response(response, {"http.response.zerocopysend": {}})
+
+    sends = [m for m in messages if m["type"] == "http.response.zerocopysend"]
+    assert [(m["offset"], m["count"]) for m in sends] == [(0, 10), (20, 10)]
+
+
+def test_body_without_extension(tmp_path):
+    response = make_response(tmp_path, "bytes=100-199")
+    messages = run_response(response, {})
+
+    assert all(m["type"] != "http.response.zerocopysend" for m in messages)
+    body = b"".join(m["body"] for m in messages if m["type"] == "http.response.body")
+    assert body == CONTENT[100:200]
+
+
+def make_accel_response(monkeypatch, accel: str, headers: dict) -> AccelFileResponse:
+    monkeypatch.setattr(settings, "DOWNLOAD_ACCEL", accel)
+    filepath = PurePath("box", "12345678", "files", "a b.jpg")
+    return AccelFileResponse(filepath, "a b.jpg", 1024, '"etag"', Headers(headers))
+
+
+def test_accel_redirect(monkeypatch):
+    monkeypatch.setattr(settings, "DOWNLOAD_ACCEL_PREFIX", "/internal/")
+    response = make_accel_response(monkeypatch, "x-accel-redirect", {})
+
+    assert response.headers["x-accel-redirect"] == (
+        "/internal/box/12345678/files/a%20b.jpg"
+    )
+    assert "x-sendfile" not in response.headers
+    assert response.headers["etag"] == '"etag"'
+    assert "x-accel-limit-rate" not in response.headers
+    assert response.size == 1024
+
+    monkeypatch.setattr(settings, "BANDWIDTH_DOWNLOAD_IP", 1024)
+    response = make_accel_response(monkeypatch, "x-accel-redirect", {})
+    assert response.headers["x-accel-limit-rate"] == "1024"
+
+
+def test_accel_sendfile(monkeypatch):
+    response = make_accel_response(monkeypatch, "x-sendfile", {"range": "bytes=0-99"})
+
+    path = os.path.abspath(settings.DATA_ROOT / "box/12345678/files/a b.jpg")
+    assert response.headers["x-sendfile"] == path
+    assert "x-accel-redirect" not in response.headers
+    assert response.size == 100
+
+
+def test_accel_charged_size(monkeypatch):
+    headers = {"range": "bytes=0-9,-10"}
+    assert make_accel_response(monkeypatch, "x-sendfile", headers).size == 20
+
+    headers = {"range": "bytes=0-9", "if-range": '"other"'}
+    assert make_accel_response(monkeypatch, "x-sendfile", headers).size == 1024
+
+    headers = {"if-none-match": '"etag"'}
+    assert make_accel_response(monkeypatch, "x-sendfile", headers).size == 0
+
+
+def test_shaped_response(tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(CONTENT)
+    shaper = Shaper(0, 10_000)
+
+    for extensions in ({}, {"http.response.zerocopysend": {}}):
+        response = ShapedFileResponse(
+            path, "file.bin", len(CONTENT), "", Headers(), shaper=shaper, ip="a"
+        )
+        messages = run_response(response, extensions)
+        assert messages[0]["status"] == 200
+        if extensions:
+            assert sum(m.get("count", 0) for m in messages) == len(CONTENT)
+        else:
+            assert b"".join(m.get("body", b"") for m in messages) == CONTENT
+
+    bucket, count = shaper.ip_buckets["a"]
+    assert count == 0
+    assert bucket.tokens < bucket.burst - len(CONTENT)
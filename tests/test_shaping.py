@@ -0,0 +1,63 @@
+import asyncio
+
+from fbox.shaping import Shaper, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(100, 50, 0.0)
+    assert bucket.reserve(50, 0.0) == 0.0
+    assert bucket.reserve(10, 0.0) == 0.1
+    assert bucket.get_wait(0.05) == 0.05
+    assert bucket.get_wait(0.1) == 0.0
+    assert bucket.get_full() == 0.6
+
+    bucket.refill(100.0)
+    assert bucket.tokens == 50
+    assert bucket.reserve(80, 100.0) == 0.3
+
+
+def test_weighted_fair_share():
+    shaper = Shaper(8_000_000, 0)
+    sent = {1: 0, 3: 0}
+
+    async def send(weight: int) -> None:
+        flow = shaper.open("203.0.113.1", weight)
+        while sum(sent.values()) < 2_000_000:
+            await flow.acquire(16384)
+            sent[weight] += 16384
+        flow.close()
+
+    async def run() -> None:
+        await shaper.open("203.0.113.2").acquire(shaper.get_burst(shaper.rate))
+        await asyncio.gather(send(1), send(3))
+
+    asyncio.run(run())
+    assert 2.5 < sent[3] / sent[1] < 3.5
+
+
+def test_ip_bucket_kept_after_close():
+    shaper = Shaper(0, 1_000_000)
+    burst = shaper.get_burst(shaper.ip_rate)
+
+    async def run() -> float:
+        flow = shaper.open("203.0.113.1")
+        await flow.acquire(burst)
+        flow.close()
+        bucket, count = shaper.ip_buckets["203.0.113.1"]
+        assert count == 0
+
+        flow = shaper.open("203.0.113.1")
+        assert shaper.ip_buckets["203.0.113.1"] == (bucket, 1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await flow.acquire(burst)
+        flow.close()
+        return loop.time() - start
+
+    assert asyncio.run(run()) > 0.03
+
+    [(stale, _), (full, _)] = sorted(shaper.ip_bucket_heap)
+    shaper.clean(stale)
+    assert "203.0.113.1" in shaper.ip_buckets
+    shaper.clean(full)
+    assert not shaper.ip_buckets and not shaper.ip_bucket_heap
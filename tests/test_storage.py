@@ -0,0 +1,137 @@
+import asyncio, hashlib, os
+from io import BytesIO
+from pathlib import Path, PurePath
+
+import pytest
+
+from fbox import settings
+from fbox.storage.filesystem import FileSystemStorage
+
+
+class CountingFile(BytesIO):
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = super().read(size)
+        self.count += len(chunk)
+        return chunk
+
+
+CODES = ["12345678", "12999999", "34567890"]
+
+
+@pytest.fixture()
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATA_ROOT", tmp_path / "data")
+    monkeypatch.setattr(settings, "LOGS_ROOT", tmp_path / "logs")
+    monkeypatch.setattr(settings, "DATA_FANOUT", 0)
+    storage = FileSystemStorage()
+    storage._init()
+    return storage
+
+
+def create_data(storage: FileSystemStorage) -> None:
+    for code in CODES:
+        box = settings.DATA_ROOT / storage._box_path(code)
+        (box / "files").mkdir(parents=True)
+        (box / "box.json").write_text(code)
+        card = settings.DATA_ROOT / storage._card_path(code)
+        card.parent.mkdir(parents=True, exist_ok=True)
+        card.write_text(code)
+        logs = settings.LOGS_ROOT / storage._box_path(code) / "2023-01-01"
+        logs.mkdir(parents=True)
+
+
+def check_data(storage: FileSystemStorage, fanout: int) -> None:
+    for code in CODES:
+        box = settings.DATA_ROOT / storage._box_path(code)
+        assert (box / "box.json").read_text() == code
+        assert (settings.DATA_ROOT / storage._card_path(code)).read_text() == code
+        assert (settings.LOGS_ROOT / storage._box_path(code) / "2023-01-01").is_dir()
+
+    names = storage._walk(settings.DATA_ROOT / "box", fanout)
+    assert sorted(os.path.basename(path) for path in names) == CODES
+    names = storage._walk(settings.DATA_ROOT / "card", fanout)
+    assert sorted(os.path.basename(path) for path in names) == [
+        f"{code}.json" for code in CODES
+    ]
+
+
+def test_shard(storage):
+    assert storage._shard("12345678", 0) == PurePath("12345678")
+    assert storage._shard("12345678", 1) == PurePath("12", "12345678")
+    assert storage._shard("12345678", 2) == PurePath("12", "34", "12345678")
+    assert storage._card_path("12345678") == PurePath("card", "12345678.json")
+
+
+def test_migrate_layout(storage, monkeypatch):
+    create_data(storage)
+    check_data(storage, 0)
+
+    for fanout in (2, 1, 0, 2):
+        monkeypatch.setattr(settings, "DATA_FANOUT", fanout)
+        assert storage.migrate_layout() == len(CODES) * 3
+        check_data(storage, fanout)
+
+        assert storage.migrate_layout() == 0
+        check_data(storage, fanout)
+
+
+def test_migrate_partial_layout(storage, monkeypatch):
+    create_data(storage)
+    monkeypatch.setattr(settings, "DATA_FANOUT", 1)
+    box = settings.DATA_ROOT / "box"
+    Path(box / "12").mkdir()
+    os.rename(box / "12345678", box / "12" / "12345678")
+
+    assert storage.migrate_layout() == len(CODES) * 3 - 1
+    check_data(storage, 1)
+    assert sorted(os.listdir(box)) == ["12", "34"]
+
+
+def test_save_slice_single_pass(storage):
+    code, filename = CODES[0], "a.bin"
+    content = os.urandom(3 * storage.CHUNK_SIZE + 1)
+    asyncio.run(storage.save_dummy_file(code, filename, 2 * len(content)))
+    filepath = asyncio.run(storage.get_filepath(code, filename))
+
+    file = CountingFile(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert storage._save_slice(filepath, file, len(content), sha256)
+    assert file.count == len(content)
+
+    file = CountingFile(content)
+    assert not storage._save_slice(filepath, file, 0, "0" * 64)
+    assert file.count == len(content)
+
+    data = (settings.DATA_ROOT / filepath).read_bytes()
+    assert data == content + content
+
+
+def test_save_file_stream(storage):
+    code, filename = CODES[0], "a.bin"
+    content = os.urandom(3 * storage.CHUNK_SIZE + 1)
+    asyncio.run(storage.save_dummy_file(code, filename, len(content)))
+    path = settings.DATA_ROOT / asyncio.run(storage.get_filepath(code, filename))
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    async def save(data: bytes, sha256: str) -> bool:
+        async def stream():
+            for i in range(0, len(data), 65536):
+                yield data[i : i + 65536]
+
+        return await storage.save_file_stream(
+            code, filename, stream(), 0, len(content), sha256
+        )
+
+    assert asyncio.run(save(content, sha256))
+    assert path.read_bytes() == content
+
+    assert not asyncio.run(save(content + b"x", sha256))
+    assert path.read_bytes() == content
+
+    assert not asyncio.run(save(content[:-1], sha256))
+    assert not asyncio.run(save(content, "0" * 64))
+    assert path.stat().st_size == len(content)